@@ -1,52 +1,92 @@
 import logging
+import click
 from config import Config
-from flask import Flask, g, send_from_directory
+from flask import Flask, current_app, g
 from flask_restful import Api, Resource, abort, reqparse, request
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_marshmallow import Marshmallow
 from flask_httpauth import HTTPBasicAuth
-from apispec import APISpec
-from apispec.ext.marshmallow import MarshmallowPlugin
-from flask_apispec.extension import FlaskApiSpec
 from flask_babel import Babel
+from werkzeug.middleware.proxy_fix import ProxyFix
+from helpers.cache import TTLCache
+from helpers.render import output_json
+from helpers.storage import send_upload
+from api import apidoc
+from api import compression
+from api import database
+from api import metrics
+from api import rate_limit
+from api import response_cache
 
-app = Flask(__name__, static_folder=Config.UPLOAD_FOLDER)
-app.config.from_object(Config)
-
-security_definitions = {
-    "basicAuth": {
-        "type": "basic"
-    }
-}
-
-ma_plugin = MarshmallowPlugin()
-app.config.update({
-    'APISPEC_SPEC': APISpec(
-        title='Notes Project',
-        version='v1',
-        plugins=[ma_plugin],
-        securityDefinitions=security_definitions,
-        security=[],
-        openapi_version='2.0.0'
-    ),
-    'APISPEC_SWAGGER_URL': '/swagger',  # URI API Doc JSON
-    'APISPEC_SWAGGER_UI_URL': '/swagger-ui'  # URI UI of API Doc
-})
-
-api = Api(app)
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-ma = Marshmallow(app)
+# Расширения создаются без приложения и подключаются к нему в create_app
+api = Api()
+api.representation('application/json')(output_json)
+db = database.RoutingSQLAlchemy()
+ma = Marshmallow()
 auth = HTTPBasicAuth()
 # swagger = Swagger(app)
-docs = FlaskApiSpec(app)
-babel = Babel(app)
+docs = apidoc.LazyApiSpec()
+babel = Babel()
+# Кэш успешных проверок пароля: username -> (digest пароля, user.id, password_hash)
+credentials_cache = TTLCache()
+# Кэш поколений токенов: user.id -> token_generation
+principals_cache = TTLCache()
 
-# Общие настройки логера
-logging.basicConfig(filename='record.log',
-                    level=logging.WARNING,
-                    format=f'%(asctime)s %(levelname)s %(name)s : %(message)s')
+
+def create_app(config=Config):
+    """
+    Собирает приложение. Тяжелое и редко нужное не делается при старте воркера:
+    документ OpenAPI строится при первом запросе /swagger, alembic (Flask-Migrate) подключается только для flask CLI
+    """
+    app = Flask(__name__, static_folder=config.UPLOAD_FOLDER)
+    app.config.from_object(config)
+    if config.TRUSTED_PROXIES:
+        # Иначе за nginx все клиенты приходят с его адреса и делят одну корзину RATE_LIMIT_ADDRESS
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=config.TRUSTED_PROXIES, x_proto=config.TRUSTED_PROXIES)
+
+    from api import routes  # noqa: F401 - api.add_resource и docs.register всех ресурсов
+    from api import commands
+    from api.models import user
+    api.init_app(app)
+    db.init_app(app)
+    db.app = app  # сессия и модели работают и вне контекста приложения (скрипты, тесты)
+    ma.init_app(app)
+    docs.init_app(app)
+    babel.init_app(app)
+    commands.init_app(app)
+    user.init_app(app)
+    if click.get_current_context(silent=True) is not None:
+        # Приложение загружает команда flask (flask db upgrade и пр.)
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+    # Сжатие - первым: его after_request выполнится последним
+    compression.init_app(app)
+    metrics.init_app(app)
+    # Ограничения частоты - до выбора реплики и кэша ответов: отклоненный запрос не тратит ничего
+    rate_limit.init_app(app)
+    database.init_app(app, db)
+    response_cache.init_app(app, db)
+    app.add_url_rule('/uploads/<path:filename>', 'download_file', download_file)
+
+    # Общие настройки логера
+    logging.basicConfig(filename='record.log',
+                        level=logging.WARNING,
+                        format=f'%(asctime)s %(levelname)s %(name)s : %(message)s')
+    return app
+
+
+metrics.registry.register_collector("auth_cache_hits_total", "Basic auth credential cache hits",
+                                    lambda: credentials_cache.hits)
+metrics.registry.register_collector("auth_cache_misses_total", "Basic auth credential cache misses",
+                                    lambda: credentials_cache.misses)
+metrics.registry.register_collector("token_cache_hits_total", "Auth token generation cache hits",
+                                    lambda: principals_cache.hits)
+metrics.registry.register_collector("token_cache_misses_total", "Auth token generation cache misses",
+                                    lambda: principals_cache.misses)
+metrics.registry.register_collector("response_cache_hits_total", "Public GET response cache hits",
+                                    lambda: response_cache.cache.hits)
+metrics.registry.register_collector("response_cache_misses_total", "Public GET response cache misses",
+                                    lambda: response_cache.cache.misses)
 
 
 # Настройка уровня логирования flask
@@ -60,12 +100,14 @@ def verify_password(username_or_token, password):
     # сначала проверяем authentication token
     # print("username_or_token = ", username_or_token)
     # print("password = ", password)
-    user = UserModel.verify_auth_token(username_or_token)
+    with metrics.stage("auth"):
+        user = UserModel.verify_auth_token(username_or_token)
+        if not user:
+            # потом авторизация
+            user = UserModel.verify_credentials(username_or_token, password)
     if not user:
-        # потом авторизация
-        user = UserModel.query.filter_by(username=username_or_token).first()
-        if not user or not user.verify_password(password):
-            return False
+        return False
+    rate_limit.limit_user(user.id)
     g.user = user
     logging.warning("!!!Request with auth User")
     return True
@@ -76,11 +118,10 @@ def get_user_roles(user):
     return g.user.get_roles()
 
 
-@app.route('/uploads/<path:filename>')
 def download_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename, as_attachment=True)
+    return send_upload(filename)
 
 
 @babel.localeselector
 def get_locale():
-    return request.accept_languages.best_match(app.config['LANGUAGES'])
+    return request.accept_languages.best_match(current_app.config['LANGUAGES'])
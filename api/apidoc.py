@@ -0,0 +1,68 @@
+import functools
+import os
+import threading
+import flask
+from apispec import APISpec
+from apispec.ext.marshmallow import MarshmallowPlugin
+from flask_apispec.apidoc import ResourceConverter, ViewConverter
+from flask_apispec.extension import FlaskApiSpec
+
+security_definitions = {
+    "basicAuth": {
+        "type": "basic"
+    }
+}
+
+
+def make_spec():
+    from api.schemas.file import FileField
+    ma_plugin = MarshmallowPlugin()
+    spec = APISpec(
+        title='Notes Project',
+        version='v1',
+        plugins=[ma_plugin],
+        securityDefinitions=security_definitions,
+        security=[],
+        openapi_version='2.0.0'
+    )
+    ma_plugin.map_to_openapi_type('file', None)(FileField)
+    return spec
+
+
+class LazyApiSpec(FlaskApiSpec):
+    """
+    FlaskApiSpec, который строит документ при первом запросе /swagger, а не при старте каждого воркера:
+    docs.register только запоминает ресурс, разбор схем marshmallow откладывается до build().
+    С APISPEC_FILE документ отдается из файла, построенного заранее (flask apispec --output <файл>)
+    """
+
+    def __init__(self, spec_factory=make_spec, document_options=True):
+        super().__init__(document_options=document_options)
+        self.spec_factory = spec_factory
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions["apispec"] = None
+        self.add_swagger_routes()
+
+    def _defer(self, callable, *args, **kwargs):
+        self._deferred.append(functools.partial(callable, *args, **kwargs))
+
+    def build(self, app=None):
+        app = app or flask.current_app._get_current_object()
+        with self._lock:
+            if app.extensions.get("apispec") is None:
+                self.spec = self.spec_factory()
+                self.resource_converter = ResourceConverter(app, self.spec, self.document_options)
+                self.view_converter = ViewConverter(app, self.spec, self.document_options)
+                for deferred in self._deferred:
+                    deferred()
+                app.extensions["apispec"] = self.spec
+            return app.extensions["apispec"]
+
+    def swagger_json(self):
+        path = flask.current_app.config.get("APISPEC_FILE")
+        if path:
+            return flask.send_file(os.path.abspath(path), mimetype="application/json", conditional=True)
+        return flask.jsonify(self.build().to_dict())
@@ -0,0 +1,151 @@
+import json
+import random
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from api import db, docs
+from api.models.user import UserModel
+from api.models.note import NoteModel, tags as note_tags
+from api.models.tag import TagModel
+from api.models import search
+from api.importer import import_notes
+from api.response_cache import cache as response_cache
+
+# Команды flask seed и пр., подключаются к приложению в init_app
+cli = AppGroup("notes")
+
+WORDS = ("note", "todo", "buy", "milk", "meeting", "call", "flask", "python", "idea", "book", "travel",
+         "project", "deadline", "bug", "release", "weekend", "gift", "recipe", "sport", "music")
+
+
+def next_id(model):
+    # Архивные заметки тоже занимают id
+    return (db.session.query(db.func.max(model.id)).execution_options(include_archived=True).scalar() or 0) + 1
+
+
+def sync_sequences(*models):
+    """
+    Строки вставлены с явными id: на PostgreSQL последовательности serial от этого не сдвигаются,
+    и следующий INSERT приложения получил бы уже занятый id
+    """
+    if db.engine.dialect.name != "postgresql":
+        return
+    for model in models:
+        table = model.__table__.name
+        db.session.execute(db.text(f"SELECT setval(pg_get_serial_sequence(:table, 'id'), max(id)) FROM {table}"),
+                           {"table": table})
+
+
+def free_names(column, prefix, ids):
+    """
+    Имена prefix<id>, которых еще нет в таблице: занятое (например, пользователь сам зарегистрировался как user5)
+    получает суффикс -2, -3, ...
+    """
+    taken = {name for (name,) in db.session.query(column).filter(column.like(prefix + "%"))}
+    names = []
+    for id in ids:
+        name, n = f"{prefix}{id}", 1
+        while name in taken:
+            n += 1
+            name = f"{prefix}{id}-{n}"
+        taken.add(name)
+        names.append(name)
+    return names
+
+
+def insert_batches(table, rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(table.insert(), rows[start:start + batch_size])
+
+
+@cli.command("seed")
+@click.option("--users", default=100, show_default=True, type=click.IntRange(min=1),
+              help="Сколько пользователей создать")
+@click.option("--notes", default=10000, show_default=True, help="Сколько заметок создать")
+@click.option("--tags", default=50, show_default=True, help="Сколько тегов создать")
+@click.option("--public-ratio", default=0.3, show_default=True, help="Доля публичных заметок")
+@click.option("--max-tags", default=3, show_default=True, help="Максимум тегов на заметку")
+@click.option("--password", default="password", show_default=True, help="Пароль всех созданных пользователей")
+@click.option("--batch-size", default=5000, show_default=True)
+@click.option("--seed", "random_seed", default=0, show_default=True, help="Seed генератора, для воспроизводимости")
+def seed(users, notes, tags, public_ratio, max_tags, password, batch_size, random_seed):
+    """
+    Заполняет БД тестовыми данными: пользователи user<N>, заметки и теги tag<N> (N - id строки)
+    """
+    rnd = random.Random(random_seed)
+    # Хэширование дорогое, поэтому у всех пользователей один и тот же хэш
+    password_hash = UserModel("seed", password).password_hash
+
+    first_user = next_id(UserModel)
+    user_ids = range(first_user, first_user + users)
+    user_rows = [{"id": id, "username": name, "password_hash": password_hash, "role": "simple_user"}
+                 for id, name in zip(user_ids, free_names(UserModel.username, "user", user_ids))]
+    insert_batches(UserModel.__table__, user_rows, batch_size)
+
+    first_tag = next_id(TagModel)
+    tag_ids = range(first_tag, first_tag + tags)
+    tag_rows = [{"id": id, "name": name} for id, name in zip(tag_ids, free_names(TagModel.name, "tag", tag_ids))]
+    insert_batches(TagModel.__table__, tag_rows, batch_size)
+
+    first_note = next_id(NoteModel)
+    author_ids = list(user_ids)
+    tag_ids = list(tag_ids)
+    for start in range(0, notes, batch_size):
+        note_rows, tag_links = [], []
+        for note_id in range(first_note + start, first_note + min(start + batch_size, notes)):
+            note_rows.append({"id": note_id, "author_id": rnd.choice(author_ids),
+                              "text": " ".join(rnd.choices(WORDS, k=rnd.randint(2, 12))),
+                              "private": rnd.random() >= public_ratio})
+            for tag_id in rnd.sample(tag_ids, rnd.randint(0, min(max_tags, len(tag_ids)))):
+                tag_links.append({"note_model_id": note_id, "tag_id": tag_id})
+        db.session.execute(NoteModel.__table__.insert(), note_rows)
+        search.index_rows(db.session.connection(), note_rows)
+        if tag_links:
+            db.session.execute(note_tags.insert(), tag_links)
+    sync_sequences(UserModel, TagModel, NoteModel)
+    db.session.commit()
+    response_cache.invalidate("notes", "tags", "users")
+    click.echo(f"Created {users} users, {notes} notes, {tags} tags")
+
+
+@cli.command("reindex-notes")
+def reindex_notes():
+    """
+    Перестраивает полнотекстовый индекс заметок (SQLite FTS5)
+    """
+    search.rebuild(db.session.connection())
+    db.session.commit()
+    click.echo("Search index rebuilt")
+
+
+@cli.command("import-notes")
+@click.argument("source", type=click.File("rb"), default="-")
+@click.option("--author", required=True, help="Имя пользователя, от которого создаются заметки")
+@click.option("--batch-size", default=None, type=click.IntRange(min=1),
+              help="Строк на один INSERT (по умолчанию IMPORT_BATCH_SIZE)")
+def import_notes_command(source, author, batch_size):
+    """
+    Импортирует заметки из NDJSON-файла (или stdin): по JSON-объекту {"text": ..., "private": ...} на строку
+    """
+    user = UserModel.query.filter_by(username=author).first()
+    if user is None:
+        raise click.BadParameter(f"user {author} not found", param_hint="--author")
+    report = import_notes(source, user.id, batch_size)
+    for error in report["errors"]:
+        click.echo(f"line {error['line']}: {error['errors']}", err=True)
+    click.echo(f"Imported {report['imported']} notes, {report['failed']} lines failed")
+
+
+@cli.command("apispec")
+@click.option("--output", default="swagger.json", show_default=True, type=click.File("w"))
+def write_apispec(output):
+    """
+    Строит документ OpenAPI заранее (при сборке): с APISPEC_FILE=<файл> /swagger отдает его, не разбирая схемы
+    """
+    json.dump(docs.build(current_app._get_current_object()).to_dict(), output, ensure_ascii=False)
+    click.echo("OpenAPI spec written")
+
+
+def init_app(app):
+    for command in cli.commands.values():
+        app.cli.add_command(command)
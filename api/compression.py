@@ -0,0 +1,92 @@
+import gzip
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него только gzip
+    brotli = None
+
+
+def choose_encoding():
+    # Предпочтение - br, если клиент его принимает и модуль установлен; q=0 означает отказ
+    accept = request.accept_encodings
+    if brotli is not None and accept["br"]:
+        return "br"
+    if accept["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress(data, encoding, config):
+    if encoding == "br":
+        return brotli.compress(data, quality=config["COMPRESS_BROTLI_QUALITY"])
+    return gzip.compress(data, compresslevel=config["COMPRESS_LEVEL"], mtime=0)
+
+
+def compress_stream(chunks, encoding, config):
+    """
+    Сжатие потокового ответа по мере генерации: каждая порция отдается клиенту сразу (flush), не дожидаясь конца
+    """
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=config["COMPRESS_BROTLI_QUALITY"])
+        flush, finish = compressor.flush, compressor.finish
+        process = compressor.process
+    else:
+        compressor = zlib.compressobj(config["COMPRESS_LEVEL"], zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # формат gzip
+        flush, finish = (lambda: compressor.flush(zlib.Z_SYNC_FLUSH)), compressor.flush
+        process = compressor.compress
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            data = process(chunk) + flush()
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def should_compress(response, config):
+    if request.endpoint in config["COMPRESS_EXCLUDE_ENDPOINTS"] or request.method == "HEAD":
+        return False
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    # direct_passthrough - файл отдается как есть (send_file)
+    if response.direct_passthrough or "Content-Encoding" in response.headers:
+        return False
+    if response.mimetype not in config["COMPRESS_MIMETYPES"]:
+        return False
+    return response.is_streamed or response.content_length is None or \
+        response.content_length >= config["COMPRESS_MIN_SIZE"]
+
+
+def init_app(app):
+    """
+    Сжатие ответов gzip/br по Accept-Encoding.
+    Регистрировать раньше остальных after_request: Flask вызывает их в обратном порядке, и сжатие должно быть последним
+    (кэш ответов и метрики видят несжатое тело)
+    """
+
+    @app.after_request
+    def compress_response(response):
+        config = app.config
+        if not should_compress(response, config):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = choose_encoding()
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding, config)
+            response.headers.pop("Content-Length", None)
+        else:
+            response.set_data(compress(response.get_data(), encoding, config))
+        response.headers["Content-Encoding"] = encoding
+        # Сжатое тело побайтно отличается от исходного, поэтому ETag у него слабый
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,174 @@
+import random
+import sqlite3
+import time
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import create_engine, event, orm
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import SelectBase
+from api.metrics import METRICS, LATENCY_BUCKETS, registry
+
+# Настройки пула, которые не применимы к SQLite без SQLITE_PRAGMAS (там NullPool/StaticPool)
+POOL_OPTIONS = ("pool_size", "max_overflow", "pool_timeout", "pool_recycle", "pool_pre_ping")
+READ_METHODS = ("GET", "HEAD")
+REPLICA_PREFIX = "replica"  # реплики - это binds с ключами replica0, replica1, ...
+# Как ограничить время одного запроса к БД (мс)
+STATEMENT_TIMEOUT = {
+    "postgresql": "SET statement_timeout = {}",
+    "mysql": "SET SESSION max_execution_time = {}",
+}
+
+METRICS["db_pool_checkout_seconds"] = ("histogram", "Time spent waiting for a pooled DB connection", LATENCY_BUCKETS)
+METRICS["db_write_retries_total"] = ("counter", "SQLite write transactions retried after 'database is locked'")
+
+# Cookie с временем последней записи клиента: пока она свежая, клиент читает с основной БД (read-your-writes).
+# Отметка ходит с клиентом, поэтому работает с любым воркером, который примет следующий запрос
+STICKY_COOKIE = "db_wrote_at"
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool, который замеряет ожидание свободного соединения (метрика db_pool_checkout_seconds)
+    """
+    name = "primary"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            registry.observe("db_pool_checkout_seconds", {"bind": self.name}, time.perf_counter() - start)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.name = self.name
+        return pool
+
+
+class RoutingSession(SignallingSession):
+    """
+    Сессия, которая в запросах на чтение (GET/HEAD) отправляет SELECT на реплику, выбранную для запроса.
+    Все остальное - запись, flush и SELECT после записи в этом же запросе - идет в основную БД
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if has_request_context():
+            if self._flushing or (clause is not None and not isinstance(clause, SelectBase)):
+                g.db_wrote = True
+            elif g.get("db_replica") and not g.get("db_wrote") and clause is not None:
+                return get_state(self.app).db.get_engine(self.app, bind=g.db_replica)
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        config = self.get_app().config
+        if sa_url.drivername.startswith("sqlite"):
+            return create_sqlite_engine(sa_url, engine_opts, config)
+        engine = create_engine(sa_url, **dict({"poolclass": TimedQueuePool}, **engine_opts))
+        timeout = config.get("DB_STATEMENT_TIMEOUT")
+        statement = STATEMENT_TIMEOUT.get(engine.dialect.name)
+        if timeout and statement:
+            @event.listens_for(engine, "connect")
+            def set_statement_timeout(connection, record):
+                cursor = connection.cursor()
+                cursor.execute(statement.format(int(timeout)))
+                cursor.close()
+        return engine
+
+    def get_engine(self, app=None, bind=None):
+        engine = super().get_engine(app, bind)
+        if isinstance(engine.pool, TimedQueuePool):
+            engine.pool.name = bind or "primary"
+        return engine
+
+
+def create_sqlite_engine(sa_url, engine_opts, config):
+    """
+    SQLite-файл с SQLITE_PRAGMAS (WAL и пр.): соединения живут в пуле, чтобы кэш страниц и mmap не терялись,
+    а транзакции запросов на запись начинаются с BEGIN IMMEDIATE (см. begin_transaction)
+    """
+    pragmas = config.get("SQLITE_PRAGMAS")
+    if not pragmas or sa_url.database in (None, "", ":memory:"):
+        engine_opts = {key: value for key, value in engine_opts.items() if key not in POOL_OPTIONS}
+        return create_engine(sa_url, **engine_opts)
+    engine_opts = {key: value for key, value in engine_opts.items() if key != "pool_pre_ping"}
+    engine_opts["poolclass"] = TimedQueuePool
+    engine_opts["connect_args"] = dict(engine_opts.get("connect_args", {}), check_same_thread=False)
+    engine = create_engine(sa_url, **engine_opts)
+    retries, backoff = config["SQLITE_WRITE_RETRIES"], config["SQLITE_WRITE_BACKOFF"]
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, record):
+        # BEGIN выдает begin_transaction, а не драйвер (он начинал бы транзакцию только перед первой записью)
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def begin_transaction(connection):
+        # Транзакция, начатая чтением, в WAL не может стать пишущей, если кто-то успел записать
+        # (SQLITE_BUSY без ожидания busy_timeout). Поэтому пишущие транзакции сразу берут блокировку записи;
+        # если ее не дождались за busy_timeout - повтор с экспоненциальной задержкой. До BEGIN ничего
+        # не выполнено, так что повтор безопасен
+        statement = "BEGIN IMMEDIATE" if is_write(connection) else "BEGIN"
+        cursor = connection.connection.cursor()
+        try:
+            for attempt in range(retries + 1):
+                try:
+                    cursor.execute(statement)
+                    return
+                except sqlite3.OperationalError as error:
+                    if attempt == retries or "locked" not in str(error):
+                        raise
+                    registry.inc("db_write_retries_total", {})
+                    time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+        finally:
+            cursor.close()
+
+    return engine
+
+
+def is_write(connection):
+    """
+    Пишущая ли транзакция: явно (execution_options(write=True)) или внутри запроса не на чтение.
+    Запись внутри GET/HEAD должна идти отдельной транзакцией с write=True (как UserModel.update_hash)
+    """
+    if connection.get_execution_options().get("write"):
+        return True
+    return has_request_context() and request.method not in READ_METHODS
+
+
+def replica_binds(app):
+    return sorted(key for key in app.config.get("SQLALCHEMY_BINDS") or () if key.startswith(REPLICA_PREFIX))
+
+
+def wrote_recently(sticky_seconds):
+    try:
+        wrote_at = float(request.cookies.get(STICKY_COOKIE, ""))
+    except ValueError:
+        return False
+    return 0 <= time.time() - wrote_at <= sticky_seconds
+
+
+def init_app(app, db):
+    @app.before_request
+    def choose_replica():
+        g.db_wrote = False
+        g.db_replica = None
+        replicas = replica_binds(app)
+        if replicas and request.method in READ_METHODS and not wrote_recently(app.config["REPLICA_STICKY_SECONDS"]):
+            g.db_replica = random.choice(replicas)
+
+    @app.after_request
+    def remember_writer(response):
+        # Пока реплики догоняют основную БД, клиент, который только что писал, читает с основной
+        if g.get("db_wrote") and replica_binds(app):
+            response.set_cookie(STICKY_COOKIE, f"{time.time():.3f}", max_age=app.config["REPLICA_STICKY_SECONDS"],
+                                httponly=True, samesite="Lax")
+        return response
@@ -0,0 +1,81 @@
+import csv
+import io
+import json
+from itertools import groupby
+from flask import current_app
+from api import db
+from api.models.note import NoteModel, tags as note_tags
+from api.models.tag import TagModel
+from api.models.user import UserModel
+
+FIELDS = ["id", "author_id", "author", "text", "private", "archive", "tags"]
+MIMETYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def export_query(user, since=None, tags=None):
+    """
+    Заметки, видимые пользователю (как get_all_for_user), в порядке id - только нужные колонки, без ORM-объектов.
+    Архивные тоже выгружаются: у каждой строки есть поле archive
+    """
+    query = NoteModel.get_all_for_user(user, include_archived=True). \
+        join(UserModel, NoteModel.author_id == UserModel.id). \
+        with_entities(NoteModel.id, NoteModel.author_id, UserModel.username, NoteModel.text,
+                      NoteModel.private, NoteModel.archive). \
+        order_by(NoteModel.id)
+    if since is not None:
+        query = query.filter(NoteModel.id > since)
+    if tags:
+        query = query.filter(NoteModel.tags.any(TagModel.name.in_(tags)))
+    return query
+
+
+def iter_notes(query, batch_size):
+    """
+    Читает query курсором на сервере БД (yield_per) и отдает пачки заметок-словарей;
+    теги для каждой пачки - одним запросом. В памяти одновременно только одна пачка
+    """
+    batch = []
+    for row in query.yield_per(batch_size):
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield with_tags(batch)
+            batch = []
+    if batch:
+        yield with_tags(batch)
+
+
+def with_tags(rows):
+    ids = [row.id for row in rows]
+    links = db.session.query(note_tags.c.note_model_id, TagModel.name). \
+        join(TagModel, TagModel.id == note_tags.c.tag_id). \
+        filter(note_tags.c.note_model_id.in_(ids)). \
+        order_by(note_tags.c.note_model_id, TagModel.name)
+    names = {note_id: [name for _, name in group] for note_id, group in groupby(links, key=lambda link: link[0])}
+    return [{"id": row.id, "author_id": row.author_id, "author": row.username, "text": row.text,
+             "private": row.private, "archive": row.archive, "tags": names.get(row.id, [])} for row in rows]
+
+
+def ndjson_chunks(batches):
+    for notes in batches:
+        yield "".join(json.dumps(note, ensure_ascii=False) + "\n" for note in notes)
+
+
+def csv_chunks(batches):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, FIELDS)
+    writer.writeheader()
+    # Заголовок уходит клиенту сразу, до первого запроса к БД
+    yield buffer.getvalue()
+    for notes in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(dict(note, tags=",".join(note["tags"])) for note in notes)
+        yield buffer.getvalue()
+
+
+def export_notes(query, format="ndjson", batch_size=None):
+    """
+    Генератор строк выгрузки в формате ndjson или csv
+    """
+    batches = iter_notes(query, batch_size or current_app.config["EXPORT_BATCH_SIZE"])
+    return ndjson_chunks(batches) if format == "ndjson" else csv_chunks(batches)
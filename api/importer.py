@@ -0,0 +1,86 @@
+import json
+from marshmallow import ValidationError
+from flask import current_app
+from api import db
+from api.models.note import NoteModel, public_notes_tag
+from api.models.user import UserModel
+from api.response_cache import invalidate_later
+from api.models import search
+from api.schemas.note import NoteCreateSchema
+
+note_schema = NoteCreateSchema()
+
+
+def read_batches(lines, batch_size, report):
+    """
+    Читает NDJSON порциями по batch_size объектов: [(номер строки, объект)]. Строки с невалидным JSON попадают в report
+    """
+    batch = []
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            batch.append((number, json.loads(line)))
+        except ValueError:
+            report.error(number, "Invalid JSON")
+            continue
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def validate(batch, author_id, report):
+    # Одна загрузка many=True на пачку заметно дешевле, чем load() на каждую строку
+    numbers = [number for number, _ in batch]
+    try:
+        data, errors = note_schema.load([obj for _, obj in batch], many=True), {}
+    except ValidationError as error:
+        data, errors = error.valid_data, error.messages
+    for index, messages in errors.items():
+        report.error(numbers[index], messages)
+    return [{"author_id": author_id, "text": item["text"], "private": item.get("private", True)}
+            for index, item in enumerate(data) if index not in errors]
+
+
+class ImportReport:
+    def __init__(self, max_errors):
+        self.max_errors = max_errors
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "errors": message})
+
+    def as_dict(self):
+        return {"imported": self.imported, "failed": self.failed, "errors": self.errors}
+
+
+def import_notes(lines, author_id, batch_size=None, max_errors=None):
+    """
+    Потоковый импорт заметок из NDJSON (по объекту NoteCreateSchema на строку).
+    В памяти держится не больше одной пачки из batch_size строк; каждая пачка - один INSERT и один commit
+    """
+    config = current_app.config
+    batch_size = batch_size or config["IMPORT_BATCH_SIZE"]
+    report = ImportReport(config["IMPORT_MAX_ERRORS"] if max_errors is None else max_errors)
+    table = NoteModel.__table__
+    username = None
+    for batch in read_batches(lines, batch_size, report):
+        batch = validate(batch, author_id, report)
+        if not batch:
+            continue
+        connection = db.session.connection()
+        last_id = db.session.query(db.func.max(NoteModel.id)).execution_options(include_archived=True).scalar() or 0
+        connection.execute(table.insert(), batch)
+        search.index_after(connection, last_id)
+        if not all(row["private"] for row in batch):
+            username = username or db.session.query(UserModel.username).filter_by(id=author_id).scalar()
+            invalidate_later(db.session, public_notes_tag(), public_notes_tag(username))
+        db.session.commit()
+        report.imported += len(batch)
+    return report.as_dict()
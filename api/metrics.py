@@ -0,0 +1,218 @@
+import glob
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from threading import Lock
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from helpers.render import render as render_json
+
+# Метрики в формате Prometheus: https://prometheus.io/docs/instrumenting/exposition_formats/
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+METRICS = {
+    "http_requests_total": ("counter", "HTTP requests by endpoint, method and status"),
+    "http_request_duration_seconds": ("histogram", "HTTP request latency", LATENCY_BUCKETS),
+    "http_request_sql_queries": ("histogram", "SQL statements per request", COUNT_BUCKETS),
+    "http_request_sql_seconds": ("histogram", "Time spent in SQL per request", LATENCY_BUCKETS),
+    "http_request_stage_seconds": ("histogram", "Time spent per request stage (auth, serialize, render)",
+                                   LATENCY_BUCKETS),
+}
+
+
+def labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Registry:
+    """
+    Счетчики и гистограммы текущего процесса. Если задан каталог (METRICS_DIR), каждый воркер gunicorn
+    периодически сбрасывает туда свой снимок, а /metrics суммирует снимки всех воркеров
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.collectors = []
+        self._lock = Lock()
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self.counters[(name, labels_key(labels))] += value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = (name, labels_key(labels))
+        with self._lock:
+            counts, total, count = self.histograms.get(key, ([0] * len(buckets), 0.0, 0))
+            counts = [c + 1 if value <= bound else c for c, bound in zip(counts, buckets)]
+            self.histograms[key] = (counts, total + value, count + 1)
+
+    def register_collector(self, name, help, collector):
+        """
+        Счетчик, значение которого ведется вне реестра (например, попадания в кэш): collector() -> число
+        """
+        METRICS[name] = ("counter", help)
+        self.collectors.append((name, collector))
+
+    def snapshot(self):
+        with self._lock:
+            counters = [[name, labels, value] for (name, labels), value in self.counters.items()]
+            histograms = [[name, labels, *value] for (name, labels), value in self.histograms.items()]
+        for name, collector in self.collectors:
+            counters.append([name, (), collector()])
+        return {"counters": counters, "histograms": histograms}
+
+    def flush(self, directory):
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+
+registry = Registry()
+
+
+def merge(snapshots):
+    counters = defaultdict(float)
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot["counters"]:
+            counters[(name, tuple(map(tuple, labels)))] += value
+        for name, labels, counts, total, count in snapshot["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            old_counts, old_total, old_count = histograms.get(key, ([0] * len(counts), 0.0, 0))
+            histograms[key] = ([a + b for a, b in zip(old_counts, counts)], old_total + total, old_count + count)
+    return counters, histograms
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+
+def render(counters, histograms):
+    lines = []
+    seen = set()
+
+    def header(name, kind, help):
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, "counter", METRICS[name][1])
+        lines.append(f"{name}{format_labels(labels)} {value:g}")
+    for (name, labels), (counts, total, count) in sorted(histograms.items()):
+        header(name, "histogram", METRICS[name][1])
+        for bound, bucket_count in zip(METRICS[name][2], counts):
+            lines.append(f"{name}_bucket{format_labels(labels, le=f'{bound:g}')} {bucket_count}")
+        lines.append(f"{name}_bucket{format_labels(labels, le='+Inf')} {count}")
+        lines.append(f"{name}_sum{format_labels(labels)} {total:g}")
+        lines.append(f"{name}_count{format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def stage(name):
+    """
+    Замер этапа обработки запроса (auth, serialize, render). Вложенные замеры одного этапа не суммируются
+    """
+    if not has_request_context() or "metrics_stages" not in g:
+        yield
+        return
+    depth = g.metrics_depth.get(name, 0)
+    g.metrics_depth[name] = depth + 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        g.metrics_depth[name] = depth
+        if depth == 0:
+            g.metrics_stages[name] = g.metrics_stages.get(name, 0) + time.perf_counter() - start
+
+
+class TimedDumpMixin:
+    """
+    Примесь для схем ответа: время dump попадает в этап "serialize"
+    """
+
+    def dump(self, obj, *, many=None):
+        with stage("serialize"):
+            return super().dump(obj, many=many)
+
+
+def timed_render(data):
+    with stage("render"):
+        return render_json(data)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "metrics_stages" in g:
+        context._metrics_start = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_metrics_start", None)
+    if start is not None and has_request_context() and "metrics_stages" in g:
+        g.metrics_sql_count += 1
+        g.metrics_sql_time += time.perf_counter() - start
+
+
+def init_app(app):
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+    # flask-apispec отдает результат marshal_with через эту функцию (по умолчанию flask.jsonify)
+    app.config["APISPEC_FORMAT_RESPONSE"] = timed_render
+    state = {"flushed": 0.0}
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        g.metrics_stages = {}
+        g.metrics_depth = {}
+        g.metrics_sql_count = 0
+        g.metrics_sql_time = 0.0
+
+    @app.after_request
+    def record_request_metrics(response):
+        if "metrics_start" not in g:
+            return response
+        endpoint = request.url_rule.rule if request.url_rule else "<unmatched>"
+        labels = {"endpoint": endpoint, "method": request.method}
+        registry.inc("http_requests_total", dict(labels, status=response.status_code))
+        registry.observe("http_request_duration_seconds", labels, time.perf_counter() - g.metrics_start)
+        registry.observe("http_request_sql_queries", labels, g.metrics_sql_count)
+        registry.observe("http_request_sql_seconds", labels, g.metrics_sql_time)
+        for name, seconds in g.metrics_stages.items():
+            registry.observe("http_request_stage_seconds", dict(labels, stage=name), seconds)
+
+        directory = app.config.get("METRICS_DIR")
+        if directory and time.monotonic() - state["flushed"] > app.config["METRICS_FLUSH_INTERVAL"]:
+            state["flushed"] = time.monotonic()
+            registry.flush(directory)
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        directory = app.config.get("METRICS_DIR")
+        if directory:
+            registry.flush(directory)
+            snapshots = []
+            for path in glob.glob(os.path.join(directory, "*.json")):
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+        else:
+            snapshots = [registry.snapshot()]
+        return Response(render(*merge(snapshots)), mimetype="text/plain; version=0.0.4")
@@ -1,4 +1,7 @@
+from datetime import datetime
 from api import db
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
 
 
 class MixinMethods:
@@ -9,3 +12,30 @@ class MixinMethods:
     def delete(self):
         self.archive = True
         self.save()
+
+
+class VersionMixin:
+    """
+    Номер версии и время изменения строки - для ETag/Last-Modified.
+    Увеличиваются при каждом UPDATE через ORM; при записи в обход ORM нужно вызывать bump()
+    """
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow,
+                           server_default=db.func.current_timestamp())
+    # Меняет ли версию изменение коллекций (relationship) - например, тегов заметки
+    versioned_collections = False
+
+    @classmethod
+    def bump(cls, *criterion):
+        """
+        UPDATE ... SET version = version + 1 для строк, подходящих под criterion (выражение для .where)
+        """
+        table = cls.__table__
+        return table.update().where(*criterion).values(version=table.c.version + 1, updated_at=datetime.utcnow())
+
+
+@event.listens_for(VersionMixin, "before_update", propagate=True)
+def increment_version(mapper, connection, target):
+    if object_session(target).is_modified(target, include_collections=target.versioned_collections):
+        # Выражение вместо числа: версия увеличивается в самом UPDATE, даже если объект в сессии устарел
+        target.version = type(target).version + 1
@@ -1,28 +1,202 @@
 from api import db
 from api.models.user import UserModel
 from api.models.tag import TagModel
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Query, joinedload, selectinload
 from sqlalchemy.sql import expression
-from api.models.base import MixinMethods
+from api.models.base import MixinMethods, VersionMixin
+from api.models import search
+from api.response_cache import cache as response_cache, invalidate_later
 
 
 tags = db.Table('tags',
                 db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True),
-                db.Column('note_model_id', db.Integer, db.ForeignKey('note_model.id'), primary_key=True)
+                db.Column('note_model_id', db.Integer, db.ForeignKey('note_model.id'), primary_key=True),
+                # Первичный ключ начинается с tag_id; теги заметок (selectin, any()) ищутся по note_model_id
+                db.Index('ix_tags_note_model_id', 'note_model_id', 'tag_id'),
                 )
 
+loaders = {"selectin": selectinload, "joined": joinedload}
 
-class NoteModel(db.Model, MixinMethods):
+
+def public_notes_tag(username=None):
+    """
+    Метка кэша ответов со списком публичных заметок (всех или одного автора)
+    """
+    return f"public-notes:{username}" if username else "public-notes"
+
+
+class NoteModel(db.Model, MixinMethods, VersionMixin):
     id = db.Column(db.Integer, primary_key=True)
     author_id = db.Column(db.Integer, db.ForeignKey(UserModel.id))
     text = db.Column(db.String(255), unique=False, nullable=False)
     private = db.Column(db.Boolean(), default=True, nullable=False)
-    tags = db.relationship(TagModel, secondary=tags, lazy='subquery', backref=db.backref('notes', lazy=True))
+    tags = db.relationship(TagModel, secondary=tags, lazy='select', backref=db.backref('notes', lazy=True))
     archive = db.Column(db.Boolean(), default=False, server_default=expression.false(), nullable=False)
+    versioned_collections = True  # теги входят в представление заметки
+    # Частичные индексы: архивные заметки в них не попадают (см. exclude_archived).
+    # author_id, private - свои заметки и публичные заметки автора; private, id - лента публичных заметок по id
+    __table_args__ = (
+        db.Index("ix_note_model_author_id_private_active", author_id, private,
+                 sqlite_where=archive == expression.false(), postgresql_where=archive == expression.false()),
+        db.Index("ix_note_model_private_id_active", private, id,
+                 sqlite_where=archive == expression.false(), postgresql_where=archive == expression.false()),
+    )
+
+    @classmethod
+    def eager(cls, strategy):
+        """
+        Опции запроса, загружающие author и tags заранее (selectin или joined), чтобы не было N+1 запросов.
+        Теги всегда грузятся selectin: joined подключил бы их вложенным LEFT JOIN (tags JOIN tag),
+        который SQLite материализует, читая всю таблицу tags
+        """
+        loader = loaders[strategy]
+        return loader(cls.author), selectinload(cls.tags)
+
+    @classmethod
+    def with_archived(cls):
+        """
+        Запрос без условия archive = false, которое по умолчанию добавляется ко всем запросам заметок
+        """
+        return cls.query.execution_options(include_archived=True)
 
     @classmethod
-    def get_all_for_user(cls, author):
-        return cls.query.filter((NoteModel.author.has(id=author.id)) | (NoteModel.private == False))
+    def reload(cls, note, strategy):
+        """
+        Заметка после commit (все атрибуты сброшены) сразу с author и tags - вместо трех ленивых запросов.
+        id берется из identity: обращение к note.id само перечитало бы строку
+        """
+        note_id, = inspect(note).identity
+        return cls.with_archived().options(*cls.eager(strategy)).filter(cls.id == note_id).one()
+
+    @classmethod
+    def visible_ids(cls, author, include_archived=False):
+        """
+        id заметок, видимых author: свои UNION ALL публичные. В отличие от "author_id = ? OR private = false"
+        каждая часть идет по своему индексу, а результат - список id, по которому заметки читаются
+        по первичному ключу уже в порядке id (без сканирования таблицы и сортировки)
+        """
+        active = () if include_archived else (cls.archive == expression.false(),)
+        own = db.select([cls.id]).where(db.and_(cls.author_id == author.id, *active))
+        public = db.select([cls.id]).where(db.and_(cls.private == expression.false(), *active))
+        return db.union_all(own, public)
+
+    @classmethod
+    def get_all_for_user(cls, author, include_archived=False):
+        query = cls.with_archived() if include_archived else cls.query
+        return query.filter(cls.id.in_(cls.visible_ids(author, include_archived)))
+
+    @staticmethod
+    def attach_tags(note_ids, tag_ids):
+        """
+        Добавляет каждой заметке каждый тег одним INSERT ... ON CONFLICT DO NOTHING: уже существующие связи
+        (в том числе добавленные параллельным запросом) пропускаются без ошибки. Возвращает число новых связей
+        """
+        dialect = db.engine.dialect.name
+        rows = [{"note_model_id": note_id, "tag_id": tag_id} for note_id in note_ids for tag_id in tag_ids]
+        if dialect == "postgresql":
+            statement = postgresql.insert(tags).on_conflict_do_nothing(index_elements=["tag_id", "note_model_id"])
+        elif dialect == "sqlite":
+            statement = tags.insert().prefix_with("OR IGNORE")
+        else:
+            existing = set(db.session.query(tags.c.note_model_id, tags.c.tag_id).filter(
+                tags.c.note_model_id.in_(note_ids), tags.c.tag_id.in_(tag_ids)))
+            rows = [row for row in rows if (row["note_model_id"], row["tag_id"]) not in existing]
+            statement = tags.insert()
+        if not rows:
+            return 0
+        added = db.session.execute(statement, rows).rowcount
+        if added:
+            # Какие именно заметки получили теги, INSERT не сообщает: версия меняется у всех note_ids
+            db.session.execute(NoteModel.bump(NoteModel.id.in_(note_ids)))
+            NoteModel.invalidate_public(note_ids)
+        return added
+
+    @staticmethod
+    def detach_tags(note_ids, tag_ids):
+        links = tags.c.note_model_id.in_(note_ids) & tags.c.tag_id.in_(tag_ids)
+        db.session.execute(NoteModel.bump(NoteModel.id.in_(db.select([tags.c.note_model_id]).where(links))))
+        result = db.session.execute(tags.delete().where(links))
+        if result.rowcount:
+            NoteModel.invalidate_public(note_ids)
+        return result.rowcount
+
+    @staticmethod
+    def invalidate_public(note_ids):
+        """
+        Сбросить после commit кэш списков публичных заметок, в которые входят заметки note_ids
+        """
+        authors = db.session.query(UserModel.username).join(NoteModel, NoteModel.author_id == UserModel.id). \
+            filter(NoteModel.id.in_(note_ids), NoteModel.private == False).distinct()
+        usernames = [username for (username,) in authors]
+        if usernames:
+            invalidate_later(db.session, public_notes_tag(), *map(public_notes_tag, usernames))
 
     def restore(self):
         self.archive = False
         self.save()
+
+
+search.register(NoteModel)
+
+
+@event.listens_for(Query, "before_compile", retval=True, bake_ok=True)
+def exclude_archived(query):
+    """
+    Область видимости по умолчанию: запросы заметок не возвращают архивные.
+    Включить их - query.execution_options(include_archived=True) или NoteModel.with_archived()
+    """
+    # Дочитывание атрибутов уже загруженного объекта (refresh) не фильтруется: архивная заметка не "исчезает"
+    if query._execution_options.get("include_archived") or query._refresh_state is not None:
+        return query
+    # Сущность (или ее alias) встречается в нескольких колонках, например в with_entities(count(id), max(...))
+    entities = []
+    for description in query.column_descriptions:
+        entity = description["entity"]
+        if entity is not None and entity not in entities and inspect(entity).mapper.class_ is NoteModel:
+            entities.append(entity)
+            query = query.enable_assertions(False).filter(entity.archive == expression.false())
+    return query
+
+
+def touch_tagged_notes(connection, tag_id):
+    # Имя тега входит в представление заметки, поэтому меняются и версии заметок с этим тегом
+    tagged = db.select([tags.c.note_model_id]).where(tags.c.tag_id == tag_id)
+    connection.execute(NoteModel.bump(NoteModel.id.in_(tagged)))
+
+
+@event.listens_for(TagModel, "after_update")
+def tag_renamed(mapper, connection, target):
+    if inspect(target).attrs.name.history.has_changes():
+        touch_tagged_notes(connection, target.id)
+
+
+@event.listens_for(TagModel, "before_delete")
+def tag_deleted(mapper, connection, target):
+    touch_tagged_notes(connection, target.id)
+
+
+def note_cache_tags(note, session):
+    private = inspect(note).attrs.private.history
+    if note.private and False not in (private.deleted or ()):
+        return ()  # заметка не была и не стала публичной
+    # get() берет автора из identity map, если он уже загружен
+    author = session.query(UserModel).get(note.author_id) if note.author_id else None
+    return (public_notes_tag(),) + ((public_notes_tag(author.username),) if author else ())
+
+
+def user_cache_tags(user, session):
+    if user in session.new:
+        return ("users",)
+    attrs = inspect(user).attrs
+    # Поля UserSchema: автор вложен и в заметки
+    if user not in session.deleted and not any(attrs[name].history.has_changes()
+                                                for name in ("username", "role", "is_staff")):
+        return ()
+    usernames = set(attrs.username.history.deleted or ()) | {user.username}
+    return ("users", public_notes_tag()) + tuple(map(public_notes_tag, usernames))
+
+
+response_cache.track(NoteModel, note_cache_tags)
+response_cache.track(UserModel, user_cache_tags)
@@ -0,0 +1,79 @@
+import re
+from api import db
+from sqlalchemy import DDL, column, event, inspect, literal_column, table, text
+
+# Полнотекстовый индекс заметок:
+#   SQLite     - отдельная FTS5-таблица note_fts (rowid = note_model.id), синхронизируется при сохранении заметки
+#   PostgreSQL - вычисляемая колонка note_model.search_vector (tsvector) с GIN-индексом, синхронизируется самой БД
+SQLITE_CREATE = "CREATE VIRTUAL TABLE IF NOT EXISTS note_fts USING fts5(text, tokenize='unicode61')"
+SQLITE_DROP = "DROP TABLE IF EXISTS note_fts"
+POSTGRES_CREATE = [
+    "ALTER TABLE note_model ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('simple', text)) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_note_model_search_vector ON note_model USING gin (search_vector)",
+]
+note_fts = table("note_fts", column("rowid"))
+SQLITE_UPSERT = text("INSERT OR REPLACE INTO note_fts(rowid, text) VALUES (:id, :text)")
+
+
+def words(q):
+    return re.findall(r"\w+", q.lower())
+
+
+def index_rows(connection, rows):
+    """
+    rows - [{"id": ..., "text": ...}]. Нужно вызывать для заметок, добавленных в обход ORM (bulk insert)
+    """
+    if rows and connection.dialect.name == "sqlite":
+        connection.execute(SQLITE_UPSERT, [{"id": row["id"], "text": row["text"]} for row in rows])
+
+
+def index_after(connection, last_id):
+    """
+    Индексирует все заметки с id > last_id - для пакетной вставки, когда id новых строк заранее неизвестны
+    """
+    if connection.dialect.name == "sqlite":
+        connection.execute(text("INSERT OR REPLACE INTO note_fts(rowid, text) "
+                                "SELECT id, text FROM note_model WHERE id > :id"), id=last_id)
+
+
+def rebuild(connection):
+    if connection.dialect.name != "sqlite":
+        return
+    connection.execute(text("DELETE FROM note_fts"))
+    connection.execute(text("INSERT INTO note_fts(rowid, text) SELECT id, text FROM note_model"))
+
+
+def search(query, q):
+    """
+    Ограничивает query заметками, подходящими под запрос q, и сортирует их по релевантности
+    """
+    terms = words(q)
+    if not terms:
+        return query.filter(db.false())
+    if db.engine.dialect.name == "postgresql":
+        ts_query = "plainto_tsquery('simple', :q)"
+        return query.filter(text(f"note_model.search_vector @@ {ts_query}")). \
+            order_by(literal_column(f"ts_rank(note_model.search_vector, {ts_query})").desc()). \
+            params(q=" ".join(terms))
+    # Каждое слово - в кавычках, чтобы пользовательский ввод не разбирался как синтаксис FTS5;
+    # последнее слово ищется как префикс, чтобы поиск работал во время набора
+    match = " ".join(f'"{term}"' for term in terms) + "*"
+    return query.join(note_fts, note_fts.c.rowid == literal_column("note_model.id")). \
+        filter(text("note_fts MATCH :match")). \
+        order_by(literal_column("bm25(note_fts)")). \
+        params(match=match)
+
+
+def register(model):
+    note_table = model.__table__
+    event.listen(note_table, "after_create", DDL(SQLITE_CREATE).execute_if(dialect="sqlite"))
+    event.listen(note_table, "before_drop", DDL(SQLITE_DROP).execute_if(dialect="sqlite"))
+    for statement in POSTGRES_CREATE:
+        event.listen(note_table, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+
+    @event.listens_for(model, "after_insert")
+    @event.listens_for(model, "after_update")
+    def sync_note(mapper, connection, target):
+        if inspect(target).attrs.text.history.has_changes():
+            index_rows(connection, [{"id": target.id, "text": target.text}])
@@ -1,7 +1,12 @@
-from api import db
+from api import db, Config
+from api.models.base import VersionMixin
+from api.response_cache import cache as response_cache
+from sqlalchemy import inspect
+from helpers.autocomplete import PrefixIndex
+from sqlalchemy.dialects import postgresql
 
 
-class TagModel(db.Model):
+class TagModel(db.Model, VersionMixin):
     __tablename__ = 'tag'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), unique=True, nullable=False)
@@ -13,3 +18,67 @@ class TagModel(db.Model):
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+
+    @classmethod
+    def insert_names(cls, names):
+        """
+        INSERT ... ON CONFLICT DO NOTHING: уже существующие имена пропускаются без ошибки
+        """
+        table = cls.__table__
+        dialect = db.engine.dialect.name
+        if dialect == "postgresql":
+            statement = postgresql.insert(table).on_conflict_do_nothing(index_elements=["name"])
+        elif dialect == "sqlite":
+            statement = table.insert().prefix_with("OR IGNORE")
+        else:
+            existing = {name for (name,) in db.session.query(cls.name).filter(cls.name.in_(names))}
+            names = [name for name in names if name not in existing]
+            statement = table.insert()
+        if names:
+            db.session.execute(statement, [{"name": name} for name in names])
+            tag_names.add_later(db.session, *names)
+
+    @classmethod
+    def resolve(cls, refs, create_missing=False):
+        """
+        Превращает список id и/или имен тегов в теги одним IN-запросом.
+        Возвращает (теги, отвергнутые элементы с причиной)
+        """
+        max_length = cls.name.type.length
+        ids, names, rejected = [], [], []
+        for ref in refs:
+            if isinstance(ref, int) and not isinstance(ref, bool):
+                ids.append(ref)
+            elif isinstance(ref, str) and 0 < len(ref.strip()) <= max_length:
+                names.append(ref.strip())
+            else:
+                rejected.append({"item": ref, "reason": "invalid tag id or name"})
+        if create_missing and names:
+            cls.insert_names(list(dict.fromkeys(names)))
+        found = cls.query.filter(cls.id.in_(ids) | cls.name.in_(names)).all() if ids or names else []
+        by_id = {tag.id: tag for tag in found}
+        by_name = {tag.name: tag for tag in found}
+        tags = []
+        for ref in ids + names:
+            tag = by_id.get(ref) if isinstance(ref, int) else by_name.get(ref)
+            if tag is None:
+                rejected.append({"item": ref, "reason": "tag not found"})
+            elif tag not in tags:
+                tags.append(tag)
+        return tags, rejected
+
+
+# Индекс имен тегов для /tags/search
+tag_names = PrefixIndex(lambda: [name for (name,) in db.session.query(TagModel.name)], Config.AUTOCOMPLETE_REFRESH)
+tag_names.track(TagModel, "name")
+
+
+def tag_cache_tags(tag, session):
+    if tag in session.new:
+        return ("tags",)
+    if tag in session.deleted or inspect(tag).attrs.name.history.has_changes():
+        return ("tags", "notes")  # имя тега выводится и в заметках
+    return ()
+
+
+response_cache.track(TagModel, tag_cache_tags)
@@ -1,17 +1,67 @@
-from api import db, Config, ma
-from passlib.apps import custom_app_context as pwd_context
+import hashlib
+import hmac
+from api import db, Config, ma, credentials_cache, principals_cache
+from helpers.passwords import PasswordHasher
+from helpers.autocomplete import PrefixIndex
 from itsdangerous import (TimedJSONWebSignatureSerializer
                           as Serializer, BadSignature, SignatureExpired)
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import IntegrityError, OperationalError
+from api.models.base import VersionMixin
 
 
-class UserModel(db.Model):
+# До init_app - настройки по умолчанию из Config (скрипты, импортирующие модели без приложения)
+password_hasher = PasswordHasher.from_config(Config)
+secret_key = Config.SECRET_KEY
+token_loader = Serializer(secret_key)
+
+
+def init_app(app):
+    """
+    Хэширование паролей, ключ подписи токенов и кэши авторизации настраиваются по конфигу приложения
+    """
+    global secret_key, token_loader
+    password_hasher.configure(app.config)
+    secret_key = app.config["SECRET_KEY"]
+    token_loader = Serializer(secret_key)
+    credentials_cache.configure(app.config["AUTH_CACHE_SIZE"], app.config["AUTH_CACHE_TTL"])
+    principals_cache.configure(app.config["TOKEN_CACHE_SIZE"], app.config["TOKEN_CACHE_TTL"])
+
+
+def password_digest(password):
+    return hmac.new(secret_key.encode(), password.encode(), hashlib.sha256).hexdigest()
+
+
+def generate_auth_token(id, role, token_generation, expiration=600):
+    s = Serializer(secret_key, expires_in=expiration)
+    return s.dumps({'id': id, 'role': role, 'gen': token_generation})
+
+
+class Principal:
+    """
+    Пользователь, авторизованный по токену без загрузки из БД: id и роль берутся из подписанного токена
+    """
+
+    def __init__(self, id, role, token_generation):
+        self.id = id
+        self.role = role
+        self.token_generation = token_generation
+
+    def get_roles(self):
+        return self.role
+
+    def generate_auth_token(self, expiration=600):
+        return generate_auth_token(self.id, self.role, self.token_generation, expiration)
+
+
+class UserModel(db.Model, VersionMixin):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(32), unique=True)
     password_hash = db.Column(db.String(128))
     notes = db.relationship('NoteModel', backref='author', lazy='dynamic')
     is_staff = db.Column(db.Boolean(), default=False, server_default="false", nullable=False)
     role = db.Column(db.String(32), nullable=False, server_default="simple_user", default="simple_user")
+    # Увеличивается при смене пароля/роли - все выданные ранее токены становятся недействительными
+    token_generation = db.Column(db.Integer, nullable=False, server_default="0", default=0)
 
     def __init__(self, username, password, role="simple_user"):
         self.username = username
@@ -22,14 +72,37 @@ class UserModel(db.Model):
         return self.role
 
     def hash_password(self, password):
-        self.password_hash = pwd_context.hash(password)
+        self.password_hash = password_hasher.hash(password)
+        credentials_cache.pop(self.username)
+        self.revoke_tokens()
+
+    def revoke_tokens(self):
+        self.token_generation = (self.token_generation or 0) + 1
+        principals_cache.pop(self.id)
 
     def verify_password(self, password):
-        return pwd_context.verify(password, self.password_hash)
+        valid, new_hash = password_hasher.verify_and_update(password, self.password_hash)
+        if valid and new_hash:
+            # Хэш сделан по старым настройкам (схема/раунды) - тихо обновляем его
+            self.update_hash(new_hash)
+        return valid
+
+    def update_hash(self, new_hash):
+        """
+        Запись посреди запроса на чтение (Basic-авторизация в GET). Его транзакция начата обычным BEGIN, и в WAL
+        она не может стать пишущей, если кто-то записал после ее начала - поэтому чтение завершаем, а запись
+        идет отдельной транзакцией с BEGIN IMMEDIATE (write=True). Не дождались блокировки - обновим при следующем входе
+        """
+        db.session.commit()
+        db.session.connection(execution_options={"write": True})
+        self.password_hash = new_hash
+        try:
+            db.session.commit()
+        except OperationalError:
+            db.session.rollback()
 
     def generate_auth_token(self, expiration=600):
-        s = Serializer(Config.SECRET_KEY, expires_in=expiration)
-        return s.dumps({'id': self.id})
+        return generate_auth_token(self.id, self.role, self.token_generation, expiration)
 
     def save(self):
         try:
@@ -41,15 +114,48 @@ class UserModel(db.Model):
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        credentials_cache.pop(self.username)
+        principals_cache.pop(self.id)
+
+    @staticmethod
+    def verify_credentials(username, password):
+        """
+        Проверка логина/пароля. Успешные проверки кэшируются, чтобы не платить за дорогой хэш на каждый запрос
+        """
+        digest = password_digest(password)
+        cached = credentials_cache.get(username)
+        if cached and hmac.compare_digest(cached[0], digest):
+            user = UserModel.query.get(cached[1])
+            # Пароль могли сменить в другом воркере (его hash_password сбросил только свой кэш), а пользователя -
+            # удалить и создать заново: запись годится, только пока хэш в строке тот же
+            if user and user.username == username and user.password_hash == cached[2]:
+                return user
+        user = UserModel.query.filter_by(username=username).first()
+        if not user or not user.verify_password(password):
+            return None
+        credentials_cache.set(username, (digest, user.id, user.password_hash))
+        return user
 
     @staticmethod
     def verify_auth_token(token):
-        s = Serializer(Config.SECRET_KEY)
         try:
-            data = s.loads(token)
+            data = token_loader.loads(token)
         except SignatureExpired:
             return None  # valid token, but expired
         except BadSignature:
             return None  # invalid token
+        # Поколение токенов пользователя уже известно - обходимся без запроса в БД
+        generation = data.get('gen')
+        if generation is not None and principals_cache.get(data['id']) == generation:
+            return Principal(data['id'], data['role'], generation)
         user = UserModel.query.get(data['id'])
+        if not user or user.token_generation != data.get('gen', user.token_generation):
+            return None  # token revoked
+        principals_cache.set(user.id, user.token_generation)
         return user
+
+
+# Индекс имен пользователей для /users/search
+usernames = PrefixIndex(lambda: [name for (name,) in db.session.query(UserModel.username).filter(
+    UserModel.username.isnot(None))], Config.AUTOCOMPLETE_REFRESH)
+usernames.track(UserModel, "username")
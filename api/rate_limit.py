@@ -0,0 +1,218 @@
+import functools
+import logging
+import math
+import threading
+import time
+from flask import current_app, g, request
+from werkzeug.exceptions import TooManyRequests
+from api.metrics import METRICS, registry
+from helpers.cache import TTLCache
+from helpers.render import render
+
+# Ограничение частоты запросов корзиной токенов (token bucket): в корзине до capacity токенов, каждый запрос
+# забирает один, за seconds корзина наполняется заново. Ресурс задает свой предел атрибутом
+# rate_limit = {"get": "10/60"} (None - без ограничения), остальные берут RATE_LIMIT_DEFAULT.
+# Предел ресурса действует и на адрес клиента (до авторизации), и на пользователя (после нее, limit_user)
+METRICS["rate_limited_total"] = ("counter", "Requests rejected by rate limits (429) or load shedding (503)")
+
+# Корзина в Redis: проверка и списание атомарны для всех воркеров
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate))
+return {allowed, tostring(tokens)}
+"""
+
+
+@functools.lru_cache(maxsize=None)
+def parse_limit(value):
+    """
+    "10/60" -> (10, 60.0): не больше 10 запросов подряд и в среднем 10 за 60 секунд. Пусто - без ограничения
+    """
+    if not value:
+        return None
+    capacity, seconds = value.split("/")
+    return int(capacity), float(seconds)
+
+
+class MemoryBackend:
+    """
+    Корзины внутри процесса: у каждого воркера gunicorn свои, так что клиент получает предел на каждый воркер
+    """
+
+    def __init__(self, maxsize):
+        self.buckets = TTLCache(maxsize)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, seconds):
+        rate = capacity / seconds
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            # Через seconds корзина снова полная - такая же, как если бы записи не было
+            self.buckets.set(key, (tokens, now), ttl=seconds)
+        return allowed, tokens, rate
+
+    def clear(self):
+        self.buckets.clear()
+
+
+class RedisBackend:
+    """
+    Корзины в Redis, общие для всех воркеров (нужен пакет redis). Если Redis недоступен, запросы пропускаются
+    """
+
+    def __init__(self, url, prefix="rate-limit:"):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.script = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+        self.errors = redis.RedisError
+
+    def take(self, key, capacity, seconds):
+        rate = capacity / seconds
+        try:
+            allowed, tokens = self.script(keys=[self.prefix + key], args=[capacity, rate, time.time()])
+        except self.errors:
+            logging.exception("Rate limit backend is unavailable")
+            return True, capacity, rate
+        return bool(allowed), float(tokens), rate
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+
+class RateLimiter:
+    def __init__(self):
+        self.backend = None
+        self.max_in_flight = 0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def configure(self, config):
+        if config.get("RATE_LIMIT_URL"):
+            self.backend = RedisBackend(config["RATE_LIMIT_URL"])
+        else:
+            self.backend = MemoryBackend(config["RATE_LIMIT_CACHE_SIZE"])
+        self.max_in_flight = config["MAX_IN_FLIGHT"]
+
+    def acquire(self):
+        """
+        Место для еще одного одновременного запроса в воркере; False - воркер перегружен
+        """
+        with self._lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def check(self, limits):
+        """
+        limits - [(ключ, (capacity, seconds))], проверяются по порядку. Возвращает 0 или секунды до повтора
+        """
+        for key, (capacity, seconds) in limits:
+            allowed, tokens, rate = self.backend.take(key, capacity, seconds)
+            if not allowed:
+                return (1 - tokens) / rate
+        return 0
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+
+limiter = RateLimiter()
+
+
+def endpoint_limit(config):
+    """
+    (метод, предел) ресурса текущего запроса: атрибут rate_limit ресурса или RATE_LIMIT_DEFAULT
+    """
+    method = "get" if request.method == "HEAD" else request.method.lower()
+    view = current_app.view_functions.get(request.endpoint)
+    rules = getattr(getattr(view, "view_class", None), "rate_limit", {})
+    return method, parse_limit(rules.get(method, config["RATE_LIMIT_DEFAULT"]))
+
+
+def request_limits(config):
+    """
+    Корзины до авторизации - только по адресу клиента: общая по всем ресурсам и отдельная на ресурс и метод.
+    Имя из заголовка Authorization еще не проверено: по нему нельзя ни расходовать чужую корзину, ни обходить
+    предел, перебирая имена
+    """
+    limits = []
+    address_limit = parse_limit(config["RATE_LIMIT_ADDRESS"])
+    if address_limit:
+        limits.append((f"addr:{request.remote_addr}", address_limit))
+    method, limit = endpoint_limit(config)
+    if limit:
+        limits.append((f"{request.endpoint}:{method}:addr:{request.remote_addr}", limit))
+    return limits
+
+
+def limit_user(user_id):
+    """
+    Предел ресурса на пользователя - после успешной проверки пароля или токена (verify_password),
+    по id проверенного пользователя. Превышен - 429 с Retry-After
+    """
+    config = current_app.config
+    if not config["RATE_LIMIT_ENABLED"] or request.endpoint in config["RATE_LIMIT_EXEMPT_ENDPOINTS"]:
+        return
+    method, limit = endpoint_limit(config)
+    if not limit:
+        return
+    retry_after = limiter.check([(f"{request.endpoint}:{method}:user:{user_id}", limit)])
+    if retry_after:
+        registry.inc("rate_limited_total", {"reason": "user"})
+        seconds = max(1, math.ceil(retry_after))
+        raise TooManyRequests(f"Too many requests, retry in {seconds} s", retry_after=seconds)
+
+
+def init_app(app):
+    """
+    Регистрировать раньше before_request, которые ходят в БД или кэш: лишний запрос отклоняется до авторизации
+    (проверка пароля passlib) и до обращений к БД
+    """
+    limiter.configure(app.config)
+
+    @app.before_request
+    def limit_request():
+        if request.endpoint is None or request.endpoint in app.config["RATE_LIMIT_EXEMPT_ENDPOINTS"]:
+            return None
+        if not limiter.acquire():
+            registry.inc("rate_limited_total", {"reason": "in_flight"})
+            return render({"message": "Server is overloaded, try again later"}, 503, {"Retry-After": "1"})
+        g.rate_limit_slot = True
+        if not app.config["RATE_LIMIT_ENABLED"]:
+            return None
+        retry_after = limiter.check(request_limits(app.config))
+        if retry_after:
+            registry.inc("rate_limited_total", {"reason": "rate"})
+            seconds = max(1, math.ceil(retry_after))
+            return render({"message": f"Too many requests, retry in {seconds} s"}, 429, {"Retry-After": str(seconds)})
+        return None
+
+    @app.teardown_request
+    def release_slot(exception):
+        if g.pop("rate_limit_slot", False):
+            limiter.release()
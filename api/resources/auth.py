@@ -2,6 +2,9 @@ from api import Resource, g, auth
 
 
 class TokenResource(Resource):
+    # Каждый запрос с паролем - дорогая проверка passlib
+    rate_limit = {"get": "10/60"}
+
     @auth.login_required
     def get(self):
         token = g.user.generate_auth_token()
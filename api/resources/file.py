@@ -1,23 +1,97 @@
 import os
-from config import Config
-from api import ma_plugin, api
+from flask import current_app, request
+from api import api, abort, auth, g
 from flask_apispec.views import MethodResource
 from flask_apispec import marshal_with, doc, use_kwargs
-from marshmallow import fields
+from api.schemas.file import FileField, UploadSessionRequestSchema
+from helpers.storage import ContentStore
 
 
-@ma_plugin.map_to_openapi_type('file', None)
-class FileField(fields.Raw):
-    pass
+def content_store():
+    config = current_app.config
+    return ContentStore(config["UPLOAD_FOLDER"], config["UPLOAD_CHUNK_SIZE"], config["UPLOAD_MAX_SIZE"])
+
+
+def stored_file(relative, sha256, duplicate, size):
+    return {"url": "/".join([current_app.config["UPLOAD_FOLDER_NAME"], *relative.split(os.sep)]),
+            "sha256": sha256, "size": size, "duplicate": duplicate}
 
 
 @api.resource('/upload')
 @doc(tags=['Files'])
 class UploadPictureResource(MethodResource):
+    @doc(description="Files are stored by SHA-256 of their content: identical uploads share one file. "
+                     "Request size is limited by MAX_CONTENT_LENGTH, larger files go through /upload/sessions.",
+         responses={413: {"description": "File is too large"}})
     @use_kwargs({"image": FileField(required=True)}, location="files")
     def put(self, **kwargs):
         uploaded_file = kwargs["image"]
-        target = os.path.join(Config.UPLOAD_FOLDER, uploaded_file.filename)
-        uploaded_file.save(target)
-        return {"msg": "uploaded image successfully",
-                "url": os.path.join(Config.UPLOAD_FOLDER_NAME, uploaded_file.filename)}, 200
+        relative, sha256, duplicate, size = content_store().save_stream(uploaded_file.stream, uploaded_file.filename)
+        return {"msg": "uploaded image successfully", **stored_file(relative, sha256, duplicate, size)}, 200
+
+
+@api.resource('/upload/sessions')
+@doc(tags=['Files'])
+class UploadSessionsResource(MethodResource):
+    @auth.login_required
+    @doc(summary="Start a resumable upload",
+         description="Returns a session id. Send the file in parts with PATCH /upload/sessions/<id>.",
+         security=[{"basicAuth": []}],
+         responses={429: {"description": "Too many open upload sessions"}})
+    @use_kwargs(UploadSessionRequestSchema, location="json")
+    def post(self, filename, size, sha256=None):
+        config = current_app.config
+        store = content_store()
+        # Каждая сессия - файл на диске до UPLOAD_MAX_SIZE: число открытых на пользователя ограничено
+        if store.open_sessions(g.user.id) >= config["UPLOAD_SESSIONS_PER_USER"]:
+            abort(429, error="Too many open upload sessions")
+        session_id = store.create_session(filename, size, sha256, config["UPLOAD_SESSION_TTL"], owner=g.user.id)
+        return {"id": session_id, "offset": 0, "size": size}, 201
+
+
+@api.resource('/upload/sessions/<string:session_id>')
+@doc(tags=['Files'])
+class UploadSessionResource(MethodResource):
+    @auth.login_required
+    @doc(summary="Resumable upload state: how many bytes are already received", security=[{"basicAuth": []}])
+    def get(self, session_id):
+        meta, offset = self.get_session(session_id)
+        return {"id": session_id, "offset": offset, "size": meta["size"]}, 200
+
+    @auth.login_required
+    @doc(summary="Append a part of the file", security=[{"basicAuth": []}],
+         description="Body - raw bytes, header Upload-Offset - position of the part in the file. "
+                     "On offset mismatch returns 409 with the current offset. "
+                     "The last part completes the upload and returns the stored file.",
+         params={"Upload-Offset": {"in": "header", "type": "integer", "required": True}},
+         responses={409: {"description": "Offset mismatch"}, 413: {"description": "Larger than declared size"}})
+    def patch(self, session_id):
+        self.get_session(session_id)
+        offset = request.headers.get("Upload-Offset", type=int)
+        if offset is None or offset < 0:
+            abort(400, error="Upload-Offset header is required")
+        store = content_store()
+        meta, offset, accepted = store.append(session_id, offset, request.stream)
+        if not accepted:
+            return {"error": "Offset mismatch", "offset": offset, "size": meta["size"]}, 409
+        if offset < meta["size"]:
+            return {"id": session_id, "offset": offset, "size": meta["size"]}, 200
+        result = store.complete(session_id)
+        if result is None:
+            abort(422, error="SHA-256 of the uploaded file does not match")
+        return {"msg": "uploaded successfully", **stored_file(*result, meta["size"])}, 201
+
+    @auth.login_required
+    @doc(summary="Cancel a resumable upload", security=[{"basicAuth": []}])
+    def delete(self, session_id):
+        self.get_session(session_id)
+        content_store().delete_session(session_id)
+        return {}, 204
+
+    @staticmethod
+    def get_session(session_id):
+        session = content_store().session(session_id)
+        # Чужая сессия для пользователя не существует
+        if session is None or session[0].get("owner") != g.user.id:
+            abort(404, error=f"Upload session {session_id} not found")
+        return session
@@ -1,25 +1,66 @@
-from api import auth, abort, g, Resource, reqparse, api, app
-from api.models.note import NoteModel
+from api import auth, abort, g, Resource, reqparse, api, db
+from api.importer import import_notes
+from api.exporter import export_query, export_notes, MIMETYPES
+from api.models.note import NoteModel, public_notes_tag
+from api.models import search
 from api.models.tag import TagModel
+from api.models.user import UserModel
 from flask_apispec import marshal_with, use_kwargs, doc
 from sqlalchemy.orm.exc import NoResultFound
-from api.schemas.note import NoteSchema, NoteCreateSchema, NoteEditSchema
+from api.schemas.note import NoteSchema, NoteCreateSchema, NoteEditSchema, NotePageSchema, NoteFilterArgsSchema, \
+    NoteSearchArgsSchema, NoteTagsRequestSchema, NoteTagsResultSchema, NoteImportResultSchema, \
+    NoteExportArgsSchema
+from api.schemas.page import PageArgsSchema
 from flask_apispec.views import MethodResource
 from webargs import fields
 from helpers.shortcuts import get_or_404
+from helpers.pagination import paginate, paginate_ranked
+from helpers.conditional import conditional, row_validators, page_validators
 from flask_babel import _
+from flask import current_app, request, Response, stream_with_context
+
+
+def note_validators(resource, note_id):
+    notes = NoteModel.get_all_for_user(g.user).filter(NoteModel.id == note_id).join(NoteModel.author)
+    return row_validators(notes, NoteModel, UserModel)
+
+
+def notes_validators(resource, **kwargs):
+    notes = NoteModel.get_all_for_user(g.user).join(NoteModel.author)
+    return page_validators(notes, NoteModel.id, NoteModel, UserModel, **kwargs)
+
+
+def public_notes(username=None):
+    notes = NoteModel.query.filter_by(private=False)
+    if username:
+        # Скалярный подзапрос вместо EXISTS (author.has): условие author_id = ? идет по индексу
+        author_id = db.session.query(UserModel.id).filter_by(username=username).as_scalar()
+        notes = notes.filter(NoteModel.author_id == author_id)
+    return notes
+
+
+def public_notes_validators(resource, username=None, **kwargs):
+    return page_validators(public_notes(username).join(NoteModel.author), NoteModel.id, NoteModel, UserModel, **kwargs)
 
 
 @doc(tags=['Notes'])
 class NoteResource(MethodResource):
+    # Как загружать author/tags и сколько SQL-запросов (вместе с авторизацией) допустимо на ответ
+    eager = {"get": "joined", "put": "joined", "delete": "joined"}
+    query_budget = {"get": 4, "put": 6, "delete": 6}
+
     @auth.login_required
     @doc(summary="Get note by id", security=[{"basicAuth": []}])
+    @doc(responses={304: {"description": "Not modified (If-None-Match / If-Modified-Since)"}})
     @doc(responses={404: {"description": "Not found"}})
     @marshal_with(NoteSchema)
+    @conditional(note_validators)
     def get(self, note_id):
         author = g.user
         try:
-            note = NoteModel.get_all_for_user(author).filter_by(id=note_id).one()
+            note = NoteModel.get_all_for_user(author). \
+                options(*NoteModel.eager(self.eager["get"])). \
+                filter_by(id=note_id).one()
             return note, 200
         except NoResultFound:
             # abort(404, error=(f"Note with id={note_id} not found"))
@@ -33,16 +74,17 @@ class NoteResource(MethodResource):
     @marshal_with(NoteSchema)
     def put(self, note_id, **kwargs):
         author = g.user
+        # author и tags нужны только в ответе: их загружает reload после commit
         note = NoteModel.query.get(note_id)
         if not note:
             abort(404, error=f"note {note_id} not found")
-        if note.author != author:
+        if note.author_id != author.id:
             abort(403, error=f"Forbidden")
 
         note.text = kwargs.get("text") or note.text
         note.private = kwargs.get("private") or note.private
         note.save()
-        return note, 200
+        return NoteModel.reload(note, self.eager["put"]), 200
 
     @auth.login_required
     @doc(summary='Delete note by id', security=[{"basicAuth": []}])
@@ -55,18 +97,25 @@ class NoteResource(MethodResource):
             abort(404, error=f"Note with id:{note_id} not found")
         # FIXME: удаление только своих(авторизованного пользователя) заметок
         note.delete()
-        return note, 200
+        return NoteModel.reload(note, self.eager["delete"]), 200
 
 
 @doc(tags=['Notes'])
 class NotesListResource(MethodResource):
+    eager = {"get": "selectin", "post": "joined"}
+    query_budget = {"get": 5, "post": 5}
+
     @auth.login_required
     @doc(summary="Get notes list", security=[{"basicAuth": []}])
-    @marshal_with(NoteSchema(many=True), code=200)
-    def get(self):
-        # FIXME: получение только своих(авторизованного пользователя) заметок
-        notes = NoteModel.query.all()
-        return notes, 200
+    @doc(responses={304: {"description": "Not modified (If-None-Match / If-Modified-Since)"}})
+    @use_kwargs(PageArgsSchema, location='query')
+    @marshal_with(NotePageSchema, code=200)
+    @conditional(notes_validators)
+    def get(self, **kwargs):
+        # Свои заметки и публичные заметки других пользователей - те же, что проверяет notes_validators
+        notes = NoteModel.get_all_for_user(g.user).options(*NoteModel.eager(self.eager["get"]))
+        page = paginate(notes, NoteModel.id, **kwargs)
+        return page, 200
 
     @auth.login_required
     @doc(summary="Create note", security=[{"basicAuth": []}])
@@ -76,46 +125,167 @@ class NotesListResource(MethodResource):
         author = g.user
         note = NoteModel(author_id=author.id, **kwargs)
         note.save()
-        return note, 201
+        return NoteModel.reload(note, self.eager["post"]), 201
 
 
 @doc(tags=['Notes'])
 class NoteSetTagsResource(MethodResource):
+    eager = {"put": "joined"}
+    query_budget = {"put": 8}
+
     @doc(summary="Set tags to Note")
     @use_kwargs({"tags": fields.List(fields.Int())}, location=('json'))
     @marshal_with(NoteSchema)
     def put(self, note_id, **kwargs):
-        note = NoteModel.query.get(note_id)
+        note = NoteModel.query.options(*NoteModel.eager(self.eager["put"])).get(note_id)
         if not note:
             abort(404, error=f"note {note_id} not found")
-        for tag_id in kwargs["tags"]:
-            tag = TagModel.query.get(tag_id)
-            note.tags.append(tag)
+        tags, rejected = TagModel.resolve(kwargs["tags"])
+        if rejected:
+            abort(400, error="Unknown tags", rejected=rejected)
+        for tag in tags:
+            if tag not in note.tags:
+                note.tags.append(tag)
         note.save()
         return note, 200
 
 
+@doc(tags=['Notes'])
+class NotesTagsResource(MethodResource):
+    query_budget = {"put": 8}
+
+    @auth.login_required
+    @doc(summary="Attach/detach tags to many notes",
+         description="Tags are ids or names. On attach, unknown names are created. "
+                     "Notes of other users, unknown notes and unknown tags are reported in 'rejected'.",
+         security=[{"basicAuth": []}])
+    @use_kwargs(NoteTagsRequestSchema, location='json')
+    @marshal_with(NoteTagsResultSchema)
+    def put(self, notes, tags, action):
+        note_ids = list(dict.fromkeys(notes))
+        own_ids = {id for (id,) in db.session.query(NoteModel.id).filter(
+            NoteModel.id.in_(note_ids), NoteModel.author_id == g.user.id)}
+        rejected = [{"item": id, "reason": "note not found"} for id in note_ids if id not in own_ids]
+        note_ids = [id for id in note_ids if id in own_ids]
+
+        # Если все заметки отвергнуты, новые теги не создаем: привязывать их не к чему
+        found_tags, rejected_tags = TagModel.resolve(tags, create_missing=(action == "attach" and bool(note_ids)))
+        rejected += rejected_tags
+        tag_ids = [tag.id for tag in found_tags]
+        changed = 0
+        if note_ids and tag_ids:
+            if action == "attach":
+                changed = NoteModel.attach_tags(note_ids, tag_ids)
+            else:
+                changed = NoteModel.detach_tags(note_ids, tag_ids)
+        # Снимаем значения до commit, иначе после него каждый тег перечитывался бы отдельным запросом
+        found_tags = [{"id": tag.id, "name": tag.name} for tag in found_tags]
+        db.session.commit()
+        return {"notes": note_ids, "tags": found_tags, "changed": changed, "rejected": rejected}, 200
+
+
+@doc(tags=['Notes'])
+class NotesImportResource(MethodResource):
+    rate_limit = {"post": "10/60"}
+
+    @auth.login_required
+    @doc(summary="Import notes from NDJSON",
+         description="Request body: one NoteCreate JSON object per line (application/x-ndjson). "
+                     "Invalid lines are skipped and reported by line number.",
+         security=[{"basicAuth": []}])
+    @doc(responses={400: {"description": "batch_size is out of range"}})
+    @marshal_with(NoteImportResultSchema)
+    def post(self):
+        batch_size = request.args.get("batch_size", type=int)
+        max_batch_size = current_app.config["IMPORT_BATCH_SIZE"]
+        if batch_size is not None and not 1 <= batch_size <= max_batch_size:
+            # Пачка держится в памяти и уходит одним INSERT: больше IMPORT_BATCH_SIZE не разрешаем
+            abort(400, error=f"batch_size must be between 1 and {max_batch_size}")
+        # Тело читается построчно, не загружаясь в память целиком
+        return import_notes(request.stream, g.user.id, batch_size), 200
+
+
+@doc(tags=['Notes'])
+class NotesExportResource(MethodResource):
+    rate_limit = {"get": "10/60"}  # Выгрузка читает все заметки пользователя
+
+    @auth.login_required
+    @doc(summary="Export notes visible to the user as NDJSON or CSV",
+         description="The response is streamed; rows are ordered by id.",
+         produces=list(MIMETYPES.values()),
+         security=[{"basicAuth": []}])
+    @use_kwargs(NoteExportArgsSchema, location='query')
+    def get(self, format, since=None, tag=None):
+        query = export_query(g.user, since, tag)
+        response = Response(stream_with_context(export_notes(query, format)), mimetype=MIMETYPES[format])
+        response.headers["Content-Disposition"] = f"attachment; filename=notes.{format}"
+        return response
+
+
 @doc(tags=['Notes'])
 class NoteFilerResource(MethodResource):
-    @use_kwargs({"username": fields.Str()}, location=('query'))
-    @marshal_with(NoteSchema(many=True))
-    def get(self, **kwargs):
-        notes = NoteModel.query. \
-            filter_by(private=False). \
-            filter(NoteModel.author.has(**kwargs)).all()
-        return notes, 200
+    eager = {"get": "selectin"}
+    query_budget = {"get": 4}
+    # Метки кэша ответов (см. api/response_cache.py)
+    response_cache = {"get": lambda args: ("notes", public_notes_tag(args.get("username")))}
+
+    @doc(responses={304: {"description": "Not modified (If-None-Match / If-Modified-Since)"}})
+    @use_kwargs(NoteFilterArgsSchema, location='query')
+    @marshal_with(NotePageSchema)
+    @conditional(public_notes_validators)
+    def get(self, username=None, **kwargs):
+        notes = public_notes(username).options(*NoteModel.eager(self.eager["get"]))
+        return paginate(notes, NoteModel.id, **kwargs), 200
+
+
+@doc(tags=['Notes'])
+class NoteSearchResource(MethodResource):
+    eager = {"get": "selectin"}
+    query_budget = {"get": 4}
+
+    @auth.login_required
+    @doc(summary="Full-text search in notes", security=[{"basicAuth": []}])
+    @use_kwargs(NoteSearchArgsSchema, location='query')
+    @marshal_with(NotePageSchema)
+    def get(self, q, **kwargs):
+        notes = NoteModel.get_all_for_user(g.user). \
+            options(*NoteModel.eager(self.eager["get"]))
+        return paginate_ranked(search.search(notes, q), **kwargs), 200
 
 
-# @api.resource('/notes/<int:note_id>/restore')  # PUT
 @doc(tags=['Notes'])
 @api.resource('/notes/<int:note_id>/archive')  # DEL
 class NoteArchive(MethodResource):
+    eager = {"delete": "joined"}
+    query_budget = {"delete": 4}
+
     @doc(summary="Move Note to archive")
     @marshal_with(NoteSchema)
     def delete(self, note_id):
         note = get_or_404(NoteModel, note_id)
         note.delete()
-        return note, 200
+        return NoteModel.reload(note, self.eager["delete"]), 200
+
+
+@doc(tags=['Notes'])
+@api.resource('/notes/<int:note_id>/restore')  # PUT
+class NoteRestore(MethodResource):
+    eager = {"put": "joined"}
+    query_budget = {"put": 5}
+
+    @auth.login_required
+    @doc(summary="Restore Note from archive", security=[{"basicAuth": []}])
+    @doc(responses={404: {"description": "Not found"}})
+    @doc(responses={403: {"description": "Forbidden"}})
+    @marshal_with(NoteSchema)
+    def put(self, note_id):
+        note = NoteModel.with_archived().get(note_id)
+        if not note:
+            abort(404, error=f"note {note_id} not found")
+        if note.author_id != g.user.id:
+            abort(403, error=f"Forbidden")
+        note.restore()
+        return NoteModel.reload(note, self.eager["put"]), 200
 
 # BAD:
 # GET: /notes
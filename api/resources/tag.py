@@ -1,15 +1,31 @@
 from api import auth, abort, g, Resource, reqparse
-from api.models.tag import TagModel
-from api.schemas.tag import TagSchema
+from api.models.tag import TagModel, tag_names
+from api.schemas.tag import TagSchema, TagPageSchema
+from api.schemas.page import PageArgsSchema
+from flask import current_app
 from flask_apispec.views import MethodResource
 from flask_apispec import marshal_with, use_kwargs, doc
-from webargs import fields
+from webargs import fields, validate
+from helpers.pagination import paginate
+from helpers.conditional import conditional, row_validators, page_validators
+
+
+def tag_validators(resource, tag_id):
+    return row_validators(TagModel.query.filter(TagModel.id == tag_id), TagModel)
+
+
+def tags_validators(resource, **kwargs):
+    return page_validators(TagModel.query, TagModel.id, TagModel, **kwargs)
 
 
 @doc(tags=['Tags'])
 class TagsResource(MethodResource):
+    response_cache = {"get": lambda args: ("tags",)}
+
     @marshal_with(TagSchema)
     @doc(summary="Get tag by id")
+    @doc(responses={304: {"description": "Not modified (If-None-Match / If-Modified-Since)"}})
+    @conditional(tag_validators)
     def get(self, tag_id):
         tag = TagModel.query.get(tag_id)
         if not tag:
@@ -19,11 +35,15 @@ class TagsResource(MethodResource):
 
 @doc(tags=['Tags'])
 class TagsListResource(MethodResource):
+    response_cache = {"get": lambda args: ("tags",)}
+
     @doc(summary="Get all tags")
-    @marshal_with(TagSchema(many=True))
-    def get(self):
-        tags = TagModel.query.all()
-        return tags, 200
+    @doc(responses={304: {"description": "Not modified (If-None-Match / If-Modified-Since)"}})
+    @use_kwargs(PageArgsSchema, location='query')
+    @marshal_with(TagPageSchema)
+    @conditional(tags_validators)
+    def get(self, **kwargs):
+        return paginate(TagModel.query, TagModel.id, **kwargs), 200
 
     @doc(summary="Create new tag")
     @use_kwargs({"name": fields.Str(required=True)})
@@ -32,3 +52,17 @@ class TagsListResource(MethodResource):
         tag = TagModel(**kwargs)
         tag.save()
         return tag, 201
+
+
+@doc(tags=['Tags'])
+class TagsSearchResource(MethodResource):
+    @doc(summary="Search tags by name",
+         description="Tag names starting with the given text first, then similar ones (one or two typos)")
+    @use_kwargs({"name": fields.Str(required=True), "limit": fields.Int(validate=validate.Range(min=1))},
+                location='query')
+    @marshal_with(TagSchema(many=True))
+    def get(self, name, limit=None):
+        limit = min(limit or current_app.config["AUTOCOMPLETE_LIMIT"], current_app.config["AUTOCOMPLETE_LIMIT_MAX"])
+        names = tag_names.search(name, limit)
+        found = {tag.name: tag for tag in TagModel.query.filter(TagModel.name.in_(names))}
+        return [found[name] for name in names if name in found], 200
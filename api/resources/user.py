@@ -1,9 +1,13 @@
-from api import Resource, abort, reqparse, auth
-from api.models.user import UserModel
-from api.schemas.user import UserSchema, UserRequestSchema
+from api import Resource, abort, reqparse, auth, credentials_cache
+from api.models.user import UserModel, usernames
+from api.schemas.user import UserSchema, UserRequestSchema, UserPageSchema
+from api.schemas.page import PageArgsSchema
+from flask import current_app
 from flask_apispec.views import MethodResource
 from flask_apispec import marshal_with, use_kwargs, doc
-from webargs import fields
+from webargs import fields, validate
+from helpers.pagination import paginate
+from helpers.conditional import conditional, row_validators, page_validators
 
 # language=YAML <-- оставил для примера
 """
@@ -42,11 +46,23 @@ responses:
 """
 
 
+def user_validators(resource, user_id):
+    return row_validators(UserModel.query.filter(UserModel.id == user_id), UserModel)
+
+
+def users_validators(resource, **kwargs):
+    return page_validators(UserModel.query, UserModel.id, UserModel, **kwargs)
+
+
 @doc(tags=['Users'])
 class UserResource(MethodResource):
+    response_cache = {"get": lambda args: ("users",)}
+
     @doc(summary="Get user by id", description="Returns single user")
+    @doc(responses={304: {"description": "Not modified (If-None-Match / If-Modified-Since)"}})
     @doc(responses={404: {"description": 'User not found'}})
     @marshal_with(UserSchema, code=200)
+    @conditional(user_validators)
     def get(self, user_id):
         user = UserModel.query.get(user_id)
         if not user:
@@ -64,8 +80,11 @@ class UserResource(MethodResource):
         user = UserModel.query.get(user_id)
         if not user:
             abort(404, error=f"User with id={user_id} not found")
+        credentials_cache.pop(user.username)
         user.username = kwargs.get("username") or user.username
-        user.role = kwargs.get("role") or user.role
+        if kwargs.get("role") and kwargs["role"] != user.role:
+            user.role = kwargs["role"]
+            user.revoke_tokens()
         user.save()
         return user, 200
 
@@ -85,11 +104,16 @@ class UserResource(MethodResource):
 
 @doc(description='Api for notes.', tags=['Users'])
 class UsersListResource(MethodResource):
+    response_cache = {"get": lambda args: ("users",)}
+    rate_limit = {"post": "10/60"}  # Регистрация хэширует пароль
+
     @doc(summary="Get all Users")
-    @marshal_with(UserSchema(many=True), code=200)
-    def get(self):
-        users = UserModel.query.all()
-        return users, 200
+    @doc(responses={304: {"description": "Not modified (If-None-Match / If-Modified-Since)"}})
+    @use_kwargs(PageArgsSchema, location='query')
+    @marshal_with(UserPageSchema, code=200)
+    @conditional(users_validators)
+    def get(self, **kwargs):
+        return paginate(UserModel.query, UserModel.id, **kwargs), 200
 
     @doc(summary="Create new User")
     @marshal_with(UserSchema, code=201)
@@ -105,13 +129,17 @@ class UsersListResource(MethodResource):
 
 @doc(description='Api for users.', tags=['Users'])
 class UsersSearchResource(MethodResource):
-    @doc(summary="Get list of all users by search")
-    @use_kwargs({"username": fields.Str()}, location=('query'))
+    @doc(summary="Get list of all users by search",
+         description="Usernames starting with the given text first, then similar ones (one or two typos)")
+    @use_kwargs({"username": fields.Str(), "limit": fields.Int(validate=validate.Range(min=1))}, location=('query'))
     @marshal_with(UserSchema(many=True), code=200)
-    def get(self, **kwargs):
+    def get(self, username=None, limit=None):
         users = []
-        if kwargs.get("username"):
-            users = UserModel.query.filter(UserModel.username.like(f'%{kwargs["username"]}%')).all()
+        if username:
+            limit = min(limit or current_app.config["AUTOCOMPLETE_LIMIT"], current_app.config["AUTOCOMPLETE_LIMIT_MAX"])
+            names = usernames.search(username, limit)
+            found = {user.username: user for user in UserModel.query.filter(UserModel.username.in_(names))}
+            users = [found[name] for name in names if name in found]
         return users, 200
 
 # endpoint: /users/search
\ No newline at end of file
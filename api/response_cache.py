@@ -0,0 +1,189 @@
+import hashlib
+import json
+import threading
+from urllib.parse import urlencode
+from flask import Response, current_app, g, request
+from sqlalchemy import event
+from helpers.cache import TTLCache
+
+# Кэш готовых ответов публичных GET-ресурсов.
+# Ресурс включает кэширование атрибутом response_cache = {"get": lambda args: (метка, ...)}: метки описывают,
+# от каких данных зависит ответ. Запись в БД помечает затронутые метки (track/invalidate_later), и после commit
+# все ответы с этими метками перестают отдаваться: у каждой метки есть номер поколения, входящий в ключ кэша
+STORED_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+SESSION_KEY = "response_cache_tags"
+
+
+class MemoryBackend:
+    """
+    Кэш внутри процесса: у каждого воркера gunicorn свой
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.entries = TTLCache(maxsize, ttl)
+        self.generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, entry):
+        self.entries.set(key, entry)
+
+    def get_generations(self, tags):
+        return [self.generations.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+        with self._lock:
+            for tag in tags:
+                self.generations[tag] = self.generations.get(tag, 0) + 1
+
+    def clear(self):
+        self.entries.clear()
+        with self._lock:
+            self.generations.clear()
+
+
+class RedisBackend:
+    """
+    Общий для всех воркеров кэш в Redis (нужен пакет redis). Размер ограничивается настройкой самого Redis
+    (maxmemory + maxmemory-policy allkeys-lru)
+    """
+
+    def __init__(self, url, ttl, prefix="response-cache:"):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, entry):
+        self.client.set(self.prefix + key, json.dumps(entry), ex=self.ttl)
+
+    def get_generations(self, tags):
+        values = self.client.mget([f"{self.prefix}tag:{tag}" for tag in tags])
+        return [int(value or 0) for value in values]
+
+    def bump(self, tags):
+        pipeline = self.client.pipeline()
+        for tag in tags:
+            pipeline.incr(f"{self.prefix}tag:{tag}")
+        pipeline.execute()
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+
+class ResponseCache:
+    def __init__(self):
+        self.backend = None
+        self.trackers = {}
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, config):
+        if config.get("RESPONSE_CACHE_URL"):
+            self.backend = RedisBackend(config["RESPONSE_CACHE_URL"], config["RESPONSE_CACHE_TTL"])
+        else:
+            self.backend = MemoryBackend(config["RESPONSE_CACHE_SIZE"], config["RESPONSE_CACHE_TTL"])
+
+    def key(self, endpoint, args, tags):
+        # Порядок параметров в URL не важен: ?a=1&b=2 и ?b=2&a=1 - одна запись
+        query = urlencode(sorted(args.items(multi=True)))
+        generations = self.backend.get_generations(tags)
+        raw = json.dumps([endpoint, query, list(zip(tags, generations))])
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def invalidate(self, *tags):
+        if tags and self.backend is not None:
+            self.backend.bump(set(tags))
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def track(self, model, tags_for):
+        """
+        tags_for(объект, session) -> метки ответов, которые устаревают при вставке/изменении/удалении объекта model
+        """
+        self.trackers[model] = tags_for
+
+
+cache = ResponseCache()
+
+
+def invalidate_later(session, *tags):
+    """
+    Сбросить метки после commit - для записи в обход ORM (bulk insert/update)
+    """
+    session.info.setdefault(SESSION_KEY, set()).update(tags)
+
+
+def collect_tags(session, flush_context):
+    # В after_flush списки new/dirty/deleted и история атрибутов еще в состоянии до flush
+    for target in list(session.new) + list(session.dirty) + list(session.deleted):
+        tags_for = cache.trackers.get(type(target))
+        if tags_for is None:
+            continue
+        if target in session.dirty and not session.is_modified(target):
+            continue
+        invalidate_later(session, *tags_for(target, session))
+
+
+def invalidate_committed(session):
+    cache.invalidate(*session.info.pop(SESSION_KEY, ()))
+
+
+def discard_tags(session):
+    session.info.pop(SESSION_KEY, None)
+
+
+def cached_tags():
+    """
+    Метки кэша для текущего запроса или None, если его ответ не кэшируется
+    """
+    if request.method != "GET" or request.endpoint is None:
+        return None
+    view = current_app.view_functions.get(request.endpoint)
+    rules = getattr(getattr(view, "view_class", None), "response_cache", {})
+    tags_for = rules.get("get")
+    return tuple(tags_for(request.args)) if tags_for else None
+
+
+def init_app(app, db):
+    cache.configure(app.config)
+    event.listen(db.session, "after_flush", collect_tags)
+    event.listen(db.session, "after_commit", invalidate_committed)
+    event.listen(db.session, "after_rollback", discard_tags)
+
+    @app.before_request
+    def serve_cached_response():
+        tags = cached_tags()
+        if not tags:
+            return None
+        key = cache.key(request.endpoint, request.args, tags)
+        entry = cache.backend.get(key)
+        if entry is None:
+            cache.misses += 1
+            g.response_cache_key = key
+            return None
+        cache.hits += 1
+        response = Response(entry["body"], status=entry["status"], headers=entry["headers"])
+        response.headers["X-Cache"] = "HIT"
+        return response.make_conditional(request)
+
+    @app.after_request
+    def store_response(response):
+        key = g.pop("response_cache_key", None)
+        if key is None:
+            return response
+        response.headers["X-Cache"] = "MISS"
+        if response.status_code == 200 and not response.is_streamed:
+            headers = [(name, response.headers[name]) for name in STORED_HEADERS if name in response.headers]
+            cache.backend.set(key, {"status": 200, "headers": headers, "body": response.get_data(as_text=True)})
+        return response
+
@@ -0,0 +1,71 @@
+from api import api, docs
+from api.resources import note
+from api.resources.user import UserResource, UsersListResource, UsersSearchResource
+from api.resources.auth import TokenResource
+from api.resources.tag import TagsResource, TagsListResource, TagsSearchResource
+from api.resources.file import UploadPictureResource, UploadSessionsResource, UploadSessionResource
+
+# CRUD
+
+# Create --> POST
+# Read --> GET
+# Update --> PUT
+# Delete --> DELETE
+api.add_resource(UsersListResource,
+                 '/users')  # GET, POST
+api.add_resource(UsersSearchResource,
+                 '/users/search')  # GET
+api.add_resource(UserResource,
+                 '/users/<int:user_id>')  # GET, PUT, DELETE
+
+api.add_resource(TokenResource,
+                 '/auth/token')  # GET
+
+api.add_resource(note.NotesListResource,
+                 '/notes',  # GET, POST
+                 )
+api.add_resource(note.NoteResource,
+                 '/notes/<int:note_id>',  # GET, PUT, DELETE
+                 )
+
+api.add_resource(TagsListResource,
+                 '/tags')  # GET, POST
+api.add_resource(TagsResource,
+                 '/tags/<int:tag_id>')  # GET, PUT, DELETE
+api.add_resource(TagsSearchResource,
+                 '/tags/search')  # GET
+
+api.add_resource(note.NoteSetTagsResource,
+                 '/notes/<int:note_id>/add_tags')  # PUT
+api.add_resource(note.NotesTagsResource,
+                 '/notes/tags')  # PUT
+api.add_resource(note.NotesImportResource,
+                 '/notes/import')  # POST
+api.add_resource(note.NotesExportResource,
+                 '/notes/export')  # GET
+api.add_resource(note.NoteFilerResource,
+                 '/notes/public/filter')  # PUT
+api.add_resource(note.NoteSearchResource,
+                 '/notes/search')  # GET
+
+
+# Ресурсы только запоминаются: документ OpenAPI строится при первом запросе /swagger (api/apidoc.py)
+docs.register(UserResource)
+docs.register(UsersListResource)
+docs.register(note.NoteResource)
+docs.register(note.NotesListResource)
+docs.register(TagsResource)
+docs.register(TagsListResource)
+docs.register(note.NoteSetTagsResource)
+docs.register(note.NotesTagsResource)
+docs.register(note.NotesImportResource)
+docs.register(note.NotesExportResource)
+docs.register(note.NoteFilerResource)
+docs.register(note.NoteSearchResource)
+docs.register(note.NoteArchive)
+docs.register(note.NoteRestore)
+docs.register(UploadPictureResource)
+docs.register(UploadSessionsResource)
+docs.register(UploadSessionResource)
+docs.register(UsersSearchResource)
+docs.register(TagsSearchResource)
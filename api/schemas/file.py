@@ -0,0 +1,15 @@
+from api import ma
+from marshmallow import fields, validate
+
+
+# Файл из multipart/form-data (в документации OpenAPI - type: file)
+class FileField(fields.Raw):
+    pass
+
+
+# Десериализация запроса(request): начало загрузки по частям
+class UploadSessionRequestSchema(ma.Schema):
+    filename = ma.Str(required=True)
+    size = ma.Int(required=True, validate=validate.Range(min=1))
+    # Если указан, после загрузки хэш проверяется, и при несовпадении файл не сохраняется
+    sha256 = ma.Str(validate=validate.Regexp(r"^[0-9a-fA-F]{64}$"))
@@ -1,22 +1,73 @@
 from api import ma
+from marshmallow import validate
+from api.metrics import TimedDumpMixin
+from helpers.compiled_schema import CompiledDumpMixin
 from api.models.note import NoteModel
 from api.schemas.user import UserSchema
+from api.schemas.tag import TagSchema
+from api.schemas.page import PageSchema, PageArgsSchema
 
 
 #       schema        flask-restful
 # object ------>  dict ----------> json
 
-class NoteSchema(ma.SQLAlchemyAutoSchema):
+class NoteSchema(TimedDumpMixin, CompiledDumpMixin, ma.SQLAlchemyAutoSchema):
     class Meta:
         model = NoteModel
+        exclude = ("version",)  # версия отдается в ETag
 
     author = ma.Nested(UserSchema())
+    tags = ma.Nested(TagSchema, many=True)
     _links = ma.Hyperlinks({
         'self': ma.URLFor('noteresource', values=dict(note_id="<id>")),
         'collection': ma.URLFor('noteslistresource')
     })
 
 
+class NotePageSchema(PageSchema):
+    items = ma.Nested(NoteSchema, many=True)
+
+
+class NoteFilterArgsSchema(PageArgsSchema):
+    username = ma.Str()
+
+
+class NoteSearchArgsSchema(PageArgsSchema):
+    class Meta:
+        exclude = ("before",)
+
+    q = ma.Str(required=True)
+
+
+class NoteExportArgsSchema(ma.Schema):
+    format = ma.Str(validate=validate.OneOf(["ndjson", "csv"]), missing="ndjson")
+    # Только заметки с id больше since - для дозагрузки с места, где остановилась прошлая выгрузка
+    since = ma.Int(validate=validate.Range(min=0))
+    # Только заметки хотя бы с одним из тегов: ?tag=a&tag=b
+    tag = ma.List(ma.Str())
+
+
+class NoteTagsRequestSchema(ma.Schema):
+    notes = ma.List(ma.Int(), required=True, validate=validate.Length(min=1))
+    # id тега (число) или имя тега (строка); несуществующие имена при attach создаются
+    tags = ma.List(ma.Raw(), required=True, validate=validate.Length(min=1))
+    action = ma.Str(validate=validate.OneOf(["attach", "detach"]), missing="attach")
+
+
+class NoteTagsResultSchema(TimedDumpMixin, ma.Schema):
+    notes = ma.List(ma.Int())
+    tags = ma.Nested(TagSchema, many=True)
+    changed = ma.Int()
+    rejected = ma.List(ma.Dict())
+
+
+class NoteImportResultSchema(ma.Schema):
+    imported = ma.Int()
+    failed = ma.Int()
+    # [{"line": номер строки, "errors": сообщение или ошибки полей}]
+    errors = ma.List(ma.Dict())
+
+
 class NoteCreateSchema(ma.SQLAlchemyAutoSchema):
     class Meta:
         model = NoteModel
@@ -26,5 +77,6 @@ class NoteCreateSchema(ma.SQLAlchemyAutoSchema):
 class NoteEditSchema(ma.SQLAlchemyAutoSchema):
     class Meta:
         model = NoteModel
+        exclude = ("version", "updated_at")
     text = ma.auto_field(required=False)
     private = ma.auto_field(required=False)
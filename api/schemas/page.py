@@ -0,0 +1,17 @@
+from api import ma
+from api.metrics import TimedDumpMixin
+from marshmallow import validate
+
+
+# Параметры постраничного вывода: ?limit=&after=&before=&total=
+class PageArgsSchema(ma.Schema):
+    limit = ma.Int(validate=validate.Range(min=1))
+    after = ma.Str()
+    before = ma.Str()
+    total = ma.Bool()
+
+
+# Обертка над страницей: {"items": [...], "_links": {...}, "total": n}
+class PageSchema(TimedDumpMixin, ma.Schema):
+    _links = ma.Dict()
+    total = ma.Int()
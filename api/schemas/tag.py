@@ -1,14 +1,21 @@
 from api import ma
+from api.metrics import TimedDumpMixin
+from helpers.compiled_schema import CompiledDumpMixin
 from api.models.tag import TagModel
+from api.schemas.page import PageSchema
 
 
 # Сериализация ответа(response)
-class TagSchema(ma.SQLAlchemyAutoSchema):
+class TagSchema(TimedDumpMixin, CompiledDumpMixin, ma.SQLAlchemyAutoSchema):
     class Meta:
         model = TagModel
         fields = ("id", "name",)
 
 
+class TagPageSchema(PageSchema):
+    items = ma.Nested(TagSchema, many=True)
+
+
 # Десериализация запроса(request)
 class TagRequestSchema(ma.SQLAlchemySchema):
     class Meta:
@@ -1,5 +1,8 @@
 from api import ma
+from api.metrics import TimedDumpMixin
+from helpers.compiled_schema import CompiledDumpMixin
 from api.models.user import UserModel
+from api.schemas.page import PageSchema
 
 
 #       schema        flask-restful
@@ -7,7 +10,7 @@ from api.models.user import UserModel
 
 
 # Сериализация ответа(response)
-class UserSchema(ma.SQLAlchemyAutoSchema):
+class UserSchema(TimedDumpMixin, CompiledDumpMixin, ma.SQLAlchemyAutoSchema):
     class Meta:
         model = UserModel
         fields = ('id', 'username', "is_staff", "role")
@@ -18,6 +21,10 @@ class UserSchema(ma.SQLAlchemyAutoSchema):
     # role = ma.auto_field()
 
 
+class UserPageSchema(PageSchema):
+    items = ma.Nested(UserSchema, many=True)
+
+
 # Десериализация запроса(request)
 # json --> dict (**kwargs)
 class UserRequestSchema(ma.SQLAlchemySchema):
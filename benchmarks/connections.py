@@ -0,0 +1,168 @@
+"""
+Сколько одновременных соединений выдерживает один воркер gunicorn: sync против gevent.
+
+    flask seed --users 100 --notes 100000
+    python benchmarks/connections.py --profiles sync gevent --levels 1 10 50 200 --read-rate 20000
+    python benchmarks/connections.py --slow 3 --slow-share 0.1 --read-rate 0
+
+Для каждого профиля запускается gunicorn -c gunicorn.conf.py с одним воркером (--workers), на него
+открывается по --levels одновременных соединений. Каждый клиент "медленный", как мобильная сеть:
+читает ответ со скоростью --read-rate байт/с (и, с --slow, отправляет запрос частями в течение --slow секунд;
+так делает доля клиентов --slow-share, остальные отправляют сразу).
+Sync-воркер занят соединением, пока ответ не уйдет в буферы сокета ядра: ответ меньше них (страница JSON)
+медленный читатель не задерживает. Медленно отправленный запрос держит sync-воркер целиком, и быстрые клиенты ждут за ним.
+С --target профили не запускаются, нагрузка идет на уже запущенный сервер.
+
+Соединение считается обслуженным, если ответ 2xx/3xx пришел за --max-latency секунд.
+"Выдерживает" - наибольший уровень, на котором обслужено не меньше 99% запросов.
+"""
+import argparse
+import asyncio
+import math
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHUNK = 4096
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+async def one_request(host, port, path, slow, read_rate, max_latency):
+    """
+    Один запрос в отдельном соединении (sync-воркер не держит keep-alive). Возвращает (status, latency)
+    """
+    request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode()
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    sock = socket.socket()
+    sock.setblocking(False)
+    # Маленький приемный буфер: ответ не помещается в буферы ядра целиком, сервер ждет, пока клиент его дочитает
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, CHUNK)
+    try:
+        await asyncio.wait_for(loop.sock_connect(sock, (host, port)), max_latency)
+        reader, writer = await asyncio.open_connection(sock=sock, limit=CHUNK)
+        try:
+            parts = 5 if slow else 1
+            for n in range(parts):
+                writer.write(request[n * len(request) // parts:(n + 1) * len(request) // parts])
+                await writer.drain()
+                if slow:
+                    await asyncio.sleep(slow / parts)
+            response = b""
+            while True:
+                chunk = await asyncio.wait_for(reader.read(CHUNK), max_latency - (time.perf_counter() - start))
+                if not chunk:
+                    break
+                response += chunk
+                if read_rate:
+                    await asyncio.sleep(len(chunk) / read_rate)
+        finally:
+            writer.close()
+    except (asyncio.TimeoutError, OSError):
+        sock.close()
+        return None, time.perf_counter() - start
+    status = int(response.split(b" ", 2)[1]) if response.startswith(b"HTTP/") else None
+    return status, time.perf_counter() - start
+
+
+async def client(host, port, path, slow, read_rate, max_latency, deadline, results):
+    while time.perf_counter() < deadline:
+        results.append(await one_request(host, port, path, slow, read_rate, max_latency))
+
+
+async def run_level(url, connections, seconds, slow, slow_share, read_rate, max_latency):
+    parts = urlsplit(url)
+    path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+    results = []
+    deadline = time.perf_counter() + seconds
+    # Медленно отправляет запрос только часть клиентов: sync-воркер, занятый ими, заставляет ждать и остальных
+    slow_clients = math.ceil(connections * slow_share) if slow else 0
+    await asyncio.gather(*(client(parts.hostname, parts.port or 80, path, slow if n < slow_clients else 0, read_rate,
+                                  max_latency, deadline, results) for n in range(connections)))
+    served = [latency for status, latency in results if status and status < 400 and latency <= max_latency]
+    return {
+        "connections": connections,
+        "requests": len(results),
+        "served_pct": 100 * len(served) / len(results) if results else 0,
+        "rps": len(served) / seconds,
+        "p50_ms": (percentile(served, 50) or 0) * 1000,
+        "p99_ms": (percentile(served, 99) or 0) * 1000,
+    }
+
+
+def wait_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not start")
+
+
+def start_gunicorn(profile, workers, port):
+    env = dict(os.environ, GUNICORN_PROFILE=profile, WEB_CONCURRENCY=str(workers), PORT=str(port))
+    # Все клиенты теста приходят с одного адреса: пределы частоты запросов выключены, если не заданы явно
+    env.setdefault("RATE_LIMIT_ENABLED", "0")
+    return subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def measure(label, url, args):
+    sustained = 0
+    for level in args.levels:
+        result = asyncio.run(run_level(url, level, args.seconds, args.slow, args.slow_share, args.read_rate,
+                                       args.max_latency))
+        print(f"{label:<8} {level:>11} {result['requests']:>9} {result['served_pct']:>8.1f}% "
+              f"{result['rps']:>8.1f} {result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f}", flush=True)
+        if result["served_pct"] >= 99:
+            sustained = level
+    return sustained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", nargs="+", choices=["sync", "gevent"], default=["sync", "gevent"])
+    parser.add_argument("--target", help="URL запущенного сервера вместо запуска gunicorn")
+    parser.add_argument("--path", default="/notes/public/filter?limit=100")
+    parser.add_argument("--workers", type=int, default=1, help="Воркеров gunicorn")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--seconds", type=float, default=10, help="Длительность каждого уровня")
+    parser.add_argument("--slow", type=float, default=0, help="Секунд на отправку запроса клиентом")
+    parser.add_argument("--slow-share", type=float, default=1, help="Доля клиентов, отправляющих запрос медленно")
+    parser.add_argument("--read-rate", type=float, default=50000, help="Скорость чтения ответа клиентом, байт/с")
+    parser.add_argument("--max-latency", type=float, default=5)
+    args = parser.parse_args()
+
+    print(f"{'profile':<8} {'connections':>11} {'requests':>9} {'served':>9} {'rps':>8} {'p50 ms':>9} {'p99 ms':>9}")
+    summary = {}
+    if args.target:
+        summary["target"] = measure("target", args.target.rstrip("/") + args.path, args)
+    for profile in [] if args.target else args.profiles:
+        server = start_gunicorn(profile, args.workers, args.port)
+        try:
+            base = f"http://127.0.0.1:{args.port}"
+            wait_ready(base + args.path)
+            summary[profile] = measure(profile, base + args.path, args)
+        finally:
+            server.terminate()
+            server.wait()
+    for label, sustained in summary.items():
+        print(f"{label}: {sustained} concurrent connections sustained by {args.workers} worker(s)")
+
+
+if __name__ == "__main__":
+    main()
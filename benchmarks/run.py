@@ -0,0 +1,251 @@
+"""
+Нагрузочный прогон всех маршрутов приложения.
+
+    flask seed --users 100 --notes 100000
+    python benchmarks/run.py --requests 200 --output results/new.json
+    python benchmarks/run.py --target http://127.0.0.1:8000 --concurrency 8 --output results/gunicorn.json
+    python benchmarks/run.py --compare results/old.json results/new.json
+
+По умолчанию запросы идут через тестовый клиент Flask (SQL считается напрямую через события SQLAlchemy).
+С --target запросы идут по HTTP в запущенный gunicorn, а SQL на запрос берется из разницы /metrics.
+Прогон шлет сотни запросов с одного адреса: пределы частоты и сброс нагрузки выключаются (в тестовом клиенте -
+самим скриптом, gunicorn для --target запускается с RATE_LIMIT_ENABLED=0 MAX_IN_FLIGHT=0)
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import time
+import urllib.error
+import urllib.request
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Настройки читает config.py при импорте приложения
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+os.environ.setdefault("MAX_IN_FLIGHT", "0")
+
+from app import app  # noqa: E402
+from api.models.note import NoteModel  # noqa: E402
+from api.models.tag import TagModel  # noqa: E402
+from api.models.user import UserModel  # noqa: E402
+from helpers.queries import count_queries  # noqa: E402
+
+SKIP_RULES = ("/static/", "/uploads/", "/swagger", "/flask-apispec/", "/metrics")
+# Тела запросов для изменяющих методов (используются с --writes)
+BODIES = {
+    ("/notes", "POST"): {"text": "Benchmark note", "private": False},
+    ("/notes/<int:note_id>", "PUT"): {"text": "Benchmark edit"},
+    ("/tags", "POST"): {"name": "bench-{n}"},
+    ("/users", "POST"): {"username": "bench-{n}", "password": "password"},
+    ("/notes/<int:note_id>/add_tags", "PUT"): {"tags": []},
+}
+# Обязательные параметры запроса (на данных flask seed: слова заметок, имена user<N> и tag<N>)
+QUERIES = {
+    "/notes/search": "?q=milk",
+    "/tags/search": "?name=tag1",
+    "/users/search": "?username=user1",
+    "/notes/export": "?format=ndjson",
+}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def sample_args():
+    with app.app_context():
+        note = NoteModel.query.filter_by(private=False).order_by(NoteModel.id).first()
+        user = UserModel.query.order_by(UserModel.id).first()
+        tag = TagModel.query.order_by(TagModel.id).first()
+        return {
+            "note_id": note.id if note else None,
+            "user_id": user.id if user else None,
+            "tag_id": tag.id if tag else None,
+        }
+
+
+def routes(writes):
+    args = sample_args()
+    for rule in app.url_map.iter_rules():
+        if rule.rule.startswith(SKIP_RULES):
+            continue
+        values = {name: args.get(name) for name in rule.arguments}
+        if None in values.values():
+            continue
+        path = re.sub(r"<(?:[^:>]+:)?([^>]+)>", lambda m: str(values[m.group(1)]), rule.rule)
+        path += QUERIES.get(rule.rule, "")
+        for method in sorted(rule.methods - {"HEAD", "OPTIONS"}):
+            if method == "GET" or (writes and method in ("POST", "PUT")):
+                yield rule.rule, method, path
+
+
+def body_for(rule, method, n):
+    body = BODIES.get((rule, method))
+    if body is None:
+        return None
+    return json.dumps({k: v.format(n=n) if isinstance(v, str) else v for k, v in body.items()})
+
+
+class ClientTarget:
+    def __init__(self, headers):
+        self.client = app.test_client()
+        self.headers = headers
+
+    def request(self, method, path, body):
+        with count_queries() as queries:
+            response = self.client.open(path, method=method, headers=self.headers, data=body,
+                                        content_type="application/json")
+            response.get_data()
+        return response.status_code, len(queries)
+
+    def sql_total(self):
+        return None
+
+
+class HttpTarget:
+    def __init__(self, base_url, headers):
+        self.base_url = base_url.rstrip("/")
+        self.headers = dict(headers, **{"Content-Type": "application/json"})
+
+    def request(self, method, path, body):
+        request = urllib.request.Request(self.base_url + path, method=method, headers=self.headers,
+                                         data=body.encode() if body else None)
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status, None
+        except urllib.error.HTTPError as e:
+            return e.code, None
+
+    def sql_total(self):
+        # Сумма http_request_sql_queries_sum по всем endpoint из /metrics
+        with urllib.request.urlopen(self.base_url + "/metrics") as response:
+            text = response.read().decode()
+        return sum(float(line.rsplit(" ", 1)[1]) for line in text.splitlines()
+                   if line.startswith("http_request_sql_queries_sum"))
+
+
+def run_route(target, rule, method, path, requests, concurrency):
+    latencies, statuses, sql = [], {}, []
+
+    def one(n):
+        start = time.perf_counter()
+        status, queries = target.request(method, path, body_for(rule, method, n))
+        return time.perf_counter() - start, status, queries
+
+    sql_before = target.sql_total()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for latency, status, queries in pool.map(one, range(requests)):
+            latencies.append(latency)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if queries is not None:
+                sql.append(queries)
+    elapsed = time.perf_counter() - started
+    sql_after = target.sql_total()
+    if sql_before is not None:
+        # В /metrics попадают и запросы к самому /metrics, их SQL равен 0
+        sql = [(sql_after - sql_before) / requests]
+
+    return {
+        "rule": rule,
+        "method": method,
+        "path": path,
+        "requests": requests,
+        "throughput_rps": round(requests / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "sql_per_request": round(sum(sql) / len(sql), 2) if sql else None,
+        "statuses": statuses,
+    }
+
+
+def auth_headers(target_url, username, password, use_token):
+    basic = {"Authorization": "Basic " + b64encode(f"{username}:{password}".encode()).decode()}
+    if not use_token:
+        return basic
+    if target_url:
+        request = urllib.request.Request(target_url.rstrip("/") + "/auth/token", headers=basic)
+        with urllib.request.urlopen(request) as response:
+            token = json.loads(response.read())["token"]
+    else:
+        token = json.loads(app.test_client().get("/auth/token", headers=basic).data)["token"]
+    return {"Authorization": "Basic " + b64encode(f"{token}:".encode()).decode()}
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = {(r["rule"], r["method"]): r for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    print(f"{'route':45} {'rps':>18} {'p95 ms':>20} {'sql/req':>14}")
+    for result in new:
+        before = old.get((result["rule"], result["method"]))
+        if not before:
+            continue
+
+        def cell(key):
+            a, b = before[key], result[key]
+            if a is None or b is None:
+                return "-"
+            change = (b - a) / a * 100 if a else 0
+            return f"{a:g} -> {b:g} ({change:+.0f}%)"
+
+        print(f"{result['method'] + ' ' + result['rule']:45} {cell('throughput_rps'):>18} "
+              f"{cell('p95_ms'):>20} {cell('sql_per_request'):>14}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", help="URL запущенного сервера; по умолчанию - тестовый клиент Flask")
+    parser.add_argument("--requests", type=int, default=100, help="Запросов на маршрут")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="Параллельных запросов; с тестовым клиентом SQL на запрос точен только при 1")
+    parser.add_argument("--username", default="user1")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--basic", action="store_true", help="Авторизация логином/паролем вместо токена")
+    parser.add_argument("--writes", action="store_true", help="Прогонять также POST/PUT")
+    parser.add_argument("--route", action="append", help="Только указанные маршруты (можно несколько раз)")
+    parser.add_argument("--output", help="Куда записать результаты (JSON)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Сравнить два файла результатов")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    headers = auth_headers(args.target, args.username, args.password, not args.basic)
+    target = HttpTarget(args.target, headers) if args.target else ClientTarget(headers)
+    results = []
+    for rule, method, path in routes(args.writes):
+        if args.route and rule not in args.route:
+            continue
+        result = run_route(target, rule, method, path, args.requests, args.concurrency)
+        results.append(result)
+        print(f"{method:6} {rule:40} {result['throughput_rps']:>9} rps  p50={result['p50_ms']}ms "
+              f"p95={result['p95_ms']}ms p99={result['p99_ms']}ms sql={result['sql_per_request']} "
+              f"{result['statuses']}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump({
+                "target": args.target or "test_client",
+                "database": app.config["SQLALCHEMY_DATABASE_URI"].split("@")[-1],
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "timestamp": time.time(),
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
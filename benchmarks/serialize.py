@@ -0,0 +1,85 @@
+"""
+Сравнение путей сериализации списка заметок: marshmallow dump + flask.jsonify (как было)
+против собранного dump (helpers/compiled_schema.py) + быстрого JSON (helpers/render.py).
+
+    python benchmarks/serialize.py --sizes 1000 10000 --repeat 5
+
+БД не нужна: заметки с авторами и тегами создаются в памяти.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import json as flask_json  # noqa: E402
+from app import app  # noqa: E402
+from api.models.note import NoteModel  # noqa: E402
+from api.models.tag import TagModel  # noqa: E402
+from api.models.user import UserModel  # noqa: E402
+from api.schemas.note import NoteSchema  # noqa: E402
+from helpers import render  # noqa: E402
+from helpers.compiled_schema import CompiledDumpMixin  # noqa: E402
+
+
+def make_user(id):
+    # Без UserModel.__init__: он хэширует пароль
+    user = UserModel.__mapper__.class_manager.new_instance()
+    user.id, user.username, user.role, user.is_staff = id, f"user{id}", "simple_user", False
+    return user
+
+
+def make_notes(count):
+    users = [make_user(i) for i in range(1, 101)]
+    tags = [TagModel(id=i, name=f"tag{i}") for i in range(1, 51)]
+    now = datetime.utcnow()
+    return [NoteModel(id=i, author=users[i % len(users)], text=f"Note number {i} про что-то",
+                      private=bool(i % 3), archive=False, updated_at=now, tags=tags[i % 7:i % 7 + i % 4])
+            for i in range(1, count + 1)]
+
+
+def best(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def run(size, repeat):
+    notes = make_notes(size)
+    rows = []
+    with app.test_request_context("/notes"):
+        CompiledDumpMixin.compiled = False
+        dump_old, data_old = best(lambda: NoteSchema(many=True).dump(notes), repeat)
+        CompiledDumpMixin.compiled = True
+        dump_new, data_new = best(lambda: NoteSchema(many=True).dump(notes), repeat)
+        assert data_old == data_new, "собранный dump отличается от marshmallow"
+        # flask.jsonify в режиме DEBUG (как в Config) печатает с отступами
+        pretty_old, _ = best(lambda: flask_json.dumps(data_old, indent=2, ensure_ascii=False), repeat)
+        compact_old, _ = best(lambda: flask_json.dumps(data_old, ensure_ascii=False, separators=(",", ":")), repeat)
+        json_new, _ = best(lambda: render.dumps(data_new), repeat)
+    rows.append(("dump", dump_old, dump_new))
+    rows.append(("json (DEBUG indent)", pretty_old, json_new))
+    rows.append(("json (compact)", compact_old, json_new))
+    rows.append(("total vs DEBUG", dump_old + pretty_old, dump_new + json_new))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5, help="Повторов на замер (берется лучший)")
+    args = parser.parse_args()
+    print(f"json encoder: {'orjson' if render.orjson else 'json (stdlib)'}")
+    print(f"{'notes':>7} {'stage':<22} {'old, ms':>9} {'new, ms':>9} {'speedup':>8}")
+    for size in args.sizes:
+        for stage, old, new in run(size, args.repeat):
+            print(f"{size:>7} {stage:<22} {old * 1000:>9.1f} {new * 1000:>9.1f} {old / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Чтение SQLite несколькими процессами (как воркеры gunicorn), пока другой процесс пишет:
+настройки SQLite по умолчанию (rollback journal) против профиля SQLITE_PRAGMAS (WAL и пр.).
+
+    python benchmarks/sqlite_concurrency.py --workers 1 2 4 --seconds 5
+
+Для каждого числа читателей печатает чтения/с, записи/с и число ошибок "database is locked".
+БД создается во временном каталоге. Код выхода 1, если в профиле wal были ошибки или читатели ничего не прочли.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.engine.url import make_url  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from app import app  # noqa: E402
+from api import db  # noqa: E402
+from api.models.note import NoteModel  # noqa: E402
+from api.models.user import UserModel  # noqa: E402
+from config import Config  # noqa: E402
+
+PROFILES = {"default": {}, "wal": Config.SQLITE_PRAGMAS}
+notes = NoteModel.__table__
+page = db.select([notes]).where((notes.c.private == db.false()) & (notes.c.archive == db.false())). \
+    order_by(notes.c.id).limit(Config.PAGE_SIZE + 1)
+
+
+def make_engine(url, profile):
+    app.config["SQLITE_PRAGMAS"] = PROFILES[profile]
+    with app.app_context():
+        return db.create_engine(make_url(url), dict(app.config["SQLALCHEMY_ENGINE_OPTIONS"]))
+
+
+def reader(url, profile, seconds, results):
+    engine = make_engine(url, profile)
+    reads = errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        try:
+            with engine.connect() as connection:
+                connection.execute(page).fetchall()
+            reads += 1
+        except OperationalError:
+            errors += 1
+    results.put(("read", reads, errors))
+
+
+def writer(url, profile, seconds, results):
+    engine = make_engine(url, profile).execution_options(write=True)
+    writes = errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        try:
+            # Чтение, затем запись в одной транзакции - как у ресурсов API
+            with engine.begin() as connection:
+                count = connection.execute(db.select([db.func.count()]).select_from(notes)).scalar()
+                connection.execute(notes.insert(), {"author_id": 1, "text": f"note {count}", "private": False})
+            writes += 1
+        except OperationalError:
+            errors += 1
+    results.put(("write", writes, errors))
+
+
+def prepare(url, profile, rows):
+    engine = make_engine(url, profile)
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(UserModel.__table__.insert(), {"id": 1, "username": "bench", "password_hash": "-"})
+        connection.execute(notes.insert(), [{"author_id": 1, "text": f"note {i}", "private": bool(i % 2)}
+                                            for i in range(rows)])
+    engine.dispose()
+
+
+def run(profile, workers, seconds, rows):
+    directory = tempfile.mkdtemp()
+    url = "sqlite:///" + os.path.join(directory, "bench.db")
+    try:
+        prepare(url, profile, rows)
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=reader, args=(url, profile, seconds, results))
+                     for _ in range(workers)]
+        processes.append(multiprocessing.Process(target=writer, args=(url, profile, seconds, results)))
+        for process in processes:
+            process.start()
+        totals = {"read": [0, 0], "write": [0, 0]}
+        for _ in processes:
+            kind, count, errors = results.get()
+            totals[kind][0] += count
+            totals[kind][1] += errors
+        for process in processes:
+            process.join()
+        return {"reads/s": totals["read"][0] / seconds, "writes/s": totals["write"][0] / seconds,
+                "errors": totals["read"][1] + totals["write"][1]}
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--profiles", nargs="+", choices=PROFILES, default=list(PROFILES))
+    args = parser.parse_args()
+    print(f"{'profile':<8} {'readers':>7} {'reads/s':>10} {'writes/s':>9} {'errors':>7}")
+    failed = False
+    for profile in args.profiles:
+        for workers in args.workers:
+            result = run(profile, workers, args.seconds, args.rows)
+            print(f"{profile:<8} {workers:>7} {result['reads/s']:>10.0f} {result['writes/s']:>9.0f} "
+                  f"{result['errors']:>7}")
+            failed |= profile == "wal" and (result["errors"] > 0 or not result["reads/s"])
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,31 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(base_dir, 'base.db')
     TEST_DATABASE_URI = 'sqlite:///' + os.path.join(base_dir, 'test.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False  # Зачем эта настройка: https://flask-sqlalchemy-russian.readthedocs.io/ru/latest/config.html#id2
+    # Реплики только для чтения (через запятую): GET/HEAD читают с них, остальное идет в основную БД
+    DATABASE_REPLICA_URLS = [url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+    SQLALCHEMY_BINDS = {f'replica{i}': url for i, url in enumerate(DATABASE_REPLICA_URLS)}
+    REPLICA_STICKY_SECONDS = 5  # Сколько секунд после записи клиент читает с основной БД (пока реплики догоняют)
+    # Пул соединений (к SQLite не применяется)
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),  # Соединений сверх pool_size при пиковой нагрузке
+        'pool_timeout': 10,  # Секунд ожидания свободного соединения, дальше - ошибка
+        'pool_recycle': 1800,  # Пересоздавать соединения старше, чем через столько секунд
+        'pool_pre_ping': True,  # Проверять соединение перед выдачей из пула (после рестарта БД)
+    }
+    DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 10000))  # Предел одного SQL-запроса, мс
+    # SQLite-файл под несколькими воркерами: WAL - читатели не ждут писателя и наоборот.
+    # {} - оставить настройки SQLite по умолчанию
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'wal',
+        'synchronous': 'normal',  # В WAL сбой питания может потерять последние транзакции, но не испортить БД
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),  # Мс ожидания чужой блокировки записи
+        'mmap_size': 256 * 1024 * 1024,  # Чтение файла БД через mmap, без копирования в кэш страниц
+        'cache_size': -64 * 1024,  # Кэш страниц соединения: отрицательное значение - в КиБ
+        'temp_store': 'memory',  # Временные таблицы и индексы (сортировки) - в памяти
+    }
+    SQLITE_WRITE_RETRIES = int(os.environ.get('SQLITE_WRITE_RETRIES', 3))  # Повторов BEGIN IMMEDIATE после busy_timeout
+    SQLITE_WRITE_BACKOFF = 0.05  # Начальная задержка перед повтором, сек (удваивается)
     DEBUG = True
     PORT = 5000
     SECRET_KEY = "My secret key =)"
@@ -15,4 +40,63 @@ class Config:
     }
     UPLOAD_FOLDER_NAME = 'upload'
     UPLOAD_FOLDER = os.path.join(base_dir, UPLOAD_FOLDER_NAME)
-    LANGUAGES = ['en', 'ru']
\ No newline at end of file
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # Предел тела одного запроса (413), большие файлы - по частям
+    UPLOAD_MAX_SIZE = 1024 * 1024 * 1024  # Предел размера файла при загрузке по частям
+    UPLOAD_CHUNK_SIZE = 64 * 1024  # Порция чтения/записи при сохранении загрузки
+    UPLOAD_SESSION_TTL = 24 * 60 * 60  # Через сколько секунд удаляются брошенные загрузки по частям
+    UPLOAD_SESSIONS_PER_USER = 10  # Сколько загрузок по частям пользователь может держать открытыми
+    # Кто отдает байты /uploads: None - воркер, 'x-accel' - nginx (X-Accel-Redirect), 'x-sendfile' - Apache/lighttpd
+    UPLOAD_SEND_MODE = os.environ.get('UPLOAD_SEND_MODE')
+    UPLOAD_ACCEL_PREFIX = '/protected-uploads/'  # internal location nginx, смотрящий в UPLOAD_FOLDER
+    USE_X_SENDFILE = UPLOAD_SEND_MODE == 'x-sendfile'
+    LANGUAGES = ['en', 'ru']
+    APISPEC_SWAGGER_URL = '/swagger'  # URI API Doc JSON
+    APISPEC_SWAGGER_UI_URL = '/swagger-ui'  # URI UI of API Doc
+    # Документ OpenAPI, построенный при сборке (flask apispec --output swagger.json); пусто - строить при первом запросе
+    APISPEC_FILE = os.environ.get('APISPEC_FILE')
+    # Каталог для снимков метрик воркеров gunicorn (общий для всех воркеров, очищается при старте)
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = 1  # Как часто (сек) воркер сбрасывает свои метрики в METRICS_DIR
+    AUTOCOMPLETE_LIMIT = 10  # Подсказок в /users/search и /tags/search по умолчанию
+    AUTOCOMPLETE_LIMIT_MAX = 50
+    AUTOCOMPLETE_REFRESH = 60  # Раз в сколько секунд перестраивать индекс подсказок из БД
+    PAGE_SIZE = 20  # Размер страницы списков по умолчанию
+    PAGE_SIZE_MAX = 100  # Жесткий предел ?limit=
+    AUTH_CACHE_SIZE = 1024  # Сколько успешных проверок логин/пароль помнить
+    AUTH_CACHE_TTL = 300  # Сколько секунд помнить успешную проверку
+    TOKEN_CACHE_SIZE = 4096  # Сколько пользователей, авторизованных по токену, помнить без обращения к БД
+    TOKEN_CACHE_TTL = 30  # Через сколько секунд перепроверять поколение токенов в БД (задержка отзыва в других воркерах)
+    # Хэширование паролей: первая схема - основная, хэши остальных схем/раундов обновляются при входе
+    PASSWORD_SCHEMES = ['sha512_crypt', 'sha256_crypt']
+    PASSWORD_ROUNDS = {'sha512_crypt': 535000}
+    PASSWORD_POOL_WORKERS = 2  # 0 - хэшировать прямо в воркере
+    PASSWORD_POOL_QUEUE = 16  # Максимум задач хэширования в очереди, дальше - 503
+    PASSWORD_POOL_TIMEOUT = 5  # Секунд на одну операцию хэширования
+    IMPORT_BATCH_SIZE = 1000  # Сколько строк NDJSON вставлять одним INSERT при импорте заметок
+    IMPORT_MAX_ERRORS = 100  # Сколько ошибок по строкам перечислять в отчете импорта (остальные только считаются)
+    EXPORT_BATCH_SIZE = 1000  # Сколько строк за раз читать из курсора БД при выгрузке /notes/export
+    # Кэш ответов публичных GET: пусто - в памяти воркера, redis://... - общий для всех воркеров
+    RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL')
+    RESPONSE_CACHE_SIZE = 1024  # Сколько ответов хранить в памяти воркера
+    RESPONSE_CACHE_TTL = 60  # Секунд, после которых ответ пересчитывается, даже если данные не менялись
+    # Ограничение частоты запросов (token bucket) "<запросов>/<секунд>": столько запросов подряд и столько же
+    # в среднем за <секунд>. Ресурс может задать свой предел атрибутом rate_limit. Пусто - без ограничения
+    # 0 - пределы частоты выключены целиком, вместе с rate_limit ресурсов (нагрузочные прогоны benchmarks/)
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') != '0'
+    RATE_LIMIT_DEFAULT = os.environ.get('RATE_LIMIT_DEFAULT', '300/60')  # На адрес и на пользователя, на ресурс
+    RATE_LIMIT_ADDRESS = os.environ.get('RATE_LIMIT_ADDRESS', '600/60')  # На адрес клиента по всем ресурсам вместе
+    # Где хранить корзины: пусто - в памяти воркера (предел на каждый воркер), redis://... - общие для всех воркеров
+    RATE_LIMIT_URL = os.environ.get('RATE_LIMIT_URL')
+    RATE_LIMIT_CACHE_SIZE = 10000  # Сколько корзин клиентов помнить в памяти воркера
+    RATE_LIMIT_EXEMPT_ENDPOINTS = ['metrics', 'static']
+    # Сколько прокси (nginx и пр.) стоит перед приложением: адрес клиента для пределов и логов берется
+    # из X-Forwarded-For, которому доверяем на столько звеньев. 0 - прокси нет, адрес соединения
+    TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+    # Запросов, одновременно обрабатываемых воркером (gevent); сверх - сразу 503. 0 - без предела
+    MAX_IN_FLIGHT = int(os.environ.get('MAX_IN_FLIGHT', 0))
+    # Сжатие ответов (gzip, br - если установлен brotli)
+    COMPRESS_MIN_SIZE = 500  # Ответы меньше этого размера (байт) не сжимаются
+    COMPRESS_LEVEL = 6  # Уровень gzip, 1-9
+    COMPRESS_BROTLI_QUALITY = 4  # Качество brotli, 0-11
+    COMPRESS_MIMETYPES = ['application/json', 'application/x-ndjson', 'text/csv', 'text/html', 'text/plain']
+    COMPRESS_EXCLUDE_ENDPOINTS = ['download_file', 'static']  # загруженные файлы обычно уже сжаты (картинки)
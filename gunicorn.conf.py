@@ -0,0 +1,62 @@
+"""
+Настройки gunicorn: gunicorn -c gunicorn.conf.py app:app
+
+GUNICORN_PROFILE=sync (по умолчанию) - синхронные воркеры: запрос занимает воркер целиком,
+    одновременно обслуживается не больше запросов, чем воркеров.
+GUNICORN_PROFILE=gevent - кооперативные воркеры: пока запрос ждет клиента или PostgreSQL, воркер обслуживает
+    другие соединения. Медленно читающий ответ клиент sync-воркер не держит (страница JSON ~50 КБ целиком уходит
+    в буферы сокета ядра), а медленно отправляющий запрос - держит, и остальные ждут за ним.
+    benchmarks/connections.py --slow 3 --slow-share 0.1 --read-rate 0, один воркер: sync - 79-141 запрос/с и p99
+    2.4-3.4 с у быстрых клиентов уже при 10 соединениях, gevent - 372-389 запросов/с, p99 53 мс при 10 и 256 мс при 50.
+    Пул хэширования паролей (ProcessPoolExecutor) под monkey-patching gevent работает: проверки паролей идут
+    в процессах пула, остальные запросы воркера в это время обслуживаются.
+    Вызовы SQLite блокируют весь воркер на время запроса к БД - поэтому busy_timeout короткий,
+    а ожидание блокировки записи идет через повторы с кооперативным sleep (SQLITE_WRITE_RETRIES).
+"""
+import glob
+import multiprocessing
+import os
+
+profile = os.environ.get("GUNICORN_PROFILE", "sync")
+bind = "0.0.0.0:" + os.environ.get("PORT", "8000")
+timeout = 30
+
+if profile == "gevent":
+    worker_class = "gevent"
+    workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+    worker_connections = int(os.environ.get("WORKER_CONNECTIONS", 1000))  # соединений на воркер
+    # Асинхронный воркер ждет заголовки запроса не дольше keepalive и закрывает соединение (по умолчанию 2 с -
+    # мало для мобильной сети); соединения при этом воркер не держат, большое значение ему не вредит
+    keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 10))
+    # Настройки читает config.py при импорте приложения в воркере
+    os.environ.setdefault("DB_POOL_SIZE", "20")  # одновременных запросов к БД на воркер больше, чем в sync
+    os.environ.setdefault("SQLITE_BUSY_TIMEOUT", "50")
+    os.environ.setdefault("SQLITE_WRITE_RETRIES", "8")
+    # Сверх этого запросы сразу получают 503, а не копятся в очереди к БД и пулу хэширования паролей
+    os.environ.setdefault("MAX_IN_FLIGHT", "200")
+elif profile == "sync":
+    worker_class = "sync"
+    workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+else:
+    raise RuntimeError(f"Unknown GUNICORN_PROFILE: {profile}")
+
+
+def on_starting(server):
+    # Снимки метрик прошлого запуска (METRICS_DIR) иначе суммировались бы с новыми
+    directory = os.environ.get("METRICS_DIR")
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            os.remove(path)
+
+
+def post_fork(server, worker):
+    if profile != "gevent":
+        return
+    # gevent подменяет сокеты сам, а psycopg2 ходит в сеть из C - его переключаем на ожидание через gevent
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        server.log.warning("psycogreen is not installed: PostgreSQL queries will block the gevent worker")
+    else:
+        patch_psycopg()
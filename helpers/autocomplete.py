@@ -0,0 +1,195 @@
+import time
+from collections import deque
+from threading import Lock
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+
+class Node:
+    __slots__ = ("children", "names")
+
+    def __init__(self):
+        self.children = {}
+        self.names = None  # исходные строки, заканчивающиеся в этом узле (ключи хранятся в нижнем регистре)
+
+
+class PrefixIndex:
+    """
+    Префиксное дерево для автодополнения с учетом опечаток. Стоимость поиска зависит от длины запроса
+    и limit, а не от числа строк в таблице.
+    Индекс обновляется после commit (add/remove) и раз в refresh секунд полностью перестраивается через loader(),
+    чтобы подхватить изменения, сделанные другими воркерами
+    """
+
+    def __init__(self, loader, refresh=60):
+        self.loader = loader
+        self.refresh = refresh
+        self.root = None
+        self.built = 0
+        self._lock = Lock()  # изменения дерева и подмена root
+        self._build_lock = Lock()  # перестраивает один поток
+        self._pending = None  # изменения, пришедшие во время перестройки
+
+    def invalidate(self):
+        self.root = None
+
+    def add(self, name):
+        self._apply(self._insert, name)
+
+    def remove(self, name):
+        self._apply(self._discard, name)
+
+    def track(self, model, attribute):
+        """
+        Обновлять индекс при вставке/изменении/удалении строк model (значение - атрибут attribute).
+        Изменения копятся в сессии и попадают в индекс после commit: отмененная транзакция индекс не меняет
+        """
+
+        @event.listens_for(model, "after_insert")
+        @event.listens_for(model, "after_update")
+        def sync(mapper, connection, target):
+            history = inspect(target).attrs[attribute].history
+            session = object_session(target)
+            self.remove_later(session, *history.deleted or ())
+            self.add_later(session, *history.added or ())
+
+        @event.listens_for(model, "after_delete")
+        def delete(mapper, connection, target):
+            self.remove_later(object_session(target), getattr(target, attribute))
+
+        @event.listens_for(Session, "after_commit")
+        def apply_committed(session):
+            for change, name in session.info.pop(self, ()):
+                change(name)
+
+        @event.listens_for(Session, "after_rollback")
+        def discard(session):
+            session.info.pop(self, None)
+
+    def add_later(self, session, *names):
+        """
+        Добавить имена после commit session - для вставок в обход ORM, которых не видит track
+        """
+        session.info.setdefault(self, []).extend((self.add, name) for name in names)
+
+    def remove_later(self, session, *names):
+        session.info.setdefault(self, []).extend((self.remove, name) for name in names)
+
+    def search(self, q, limit=10):
+        """
+        Сначала строки, начинающиеся с q (короткие раньше), затем похожие с точностью до опечатки
+        """
+        self._ensure()
+        q = q.lower()
+        result = self.complete(q, limit)
+        if len(result) < limit:
+            for name in self.fuzzy(q, limit):
+                if name not in result:
+                    result.append(name)
+                    if len(result) == limit:
+                        break
+        return result
+
+    def complete(self, prefix, limit=10):
+        self._ensure()
+        node = self._find(prefix.lower())
+        return self._collect(node, limit) if node else []
+
+    def fuzzy(self, word, limit=10, max_distance=None, max_nodes=5000):
+        """
+        Строки, префикс которых отличается от word не более чем на max_distance правок (расстояние Левенштейна).
+        Первая буква должна совпадать: так перебирается в десятки раз меньше узлов, а опечатки в ней редки.
+        Перебор ограничен max_nodes узлами, чтобы время ответа не росло вместе с индексом
+        """
+        self._ensure()
+        word = word.lower()
+        start = self.root.children.get(word[:1])
+        if start is None:
+            return []
+        word = word[1:]
+        if max_distance is None:
+            max_distance = 1 if len(word) < 4 else 2
+        matches = []
+        first_row = list(range(len(word) + 1))
+        stack = [(child, char, first_row) for char, child in start.children.items()]
+        while stack and max_nodes:
+            max_nodes -= 1
+            node, char, previous = stack.pop()
+            row = [previous[0] + 1]
+            for i in range(1, len(word) + 1):
+                row.append(min(row[i - 1] + 1, previous[i] + 1, previous[i - 1] + (word[i - 1] != char)))
+            if row[-1] <= max_distance:
+                # Префикс этого узла похож на word - дальше в глубину не идем, берем все его продолжения
+                matches.append((row[-1], node))
+            elif min(row) <= max_distance:
+                stack.extend((child, next_char, row) for next_char, child in node.children.items())
+        result = []
+        for distance, node in sorted(matches, key=lambda match: match[0]):
+            result.extend(self._collect(node, limit - len(result)))
+            if len(result) >= limit:
+                break
+        return result[:limit]
+
+    def _ensure(self):
+        if self.root is not None and time.monotonic() - self.built <= self.refresh:
+            return
+        # Устаревший индекс перестраивает один поток, остальные пока ищут по старому; без индекса ждут все
+        if not self._build_lock.acquire(blocking=self.root is None):
+            return
+        try:
+            if self.root is not None and time.monotonic() - self.built <= self.refresh:
+                return
+            with self._lock:
+                self._pending = []
+            # Загрузка и построение - без self._lock: add/remove и поиск в это время не ждут
+            root = Node()
+            for name in self.loader():
+                self._insert(root, name)
+            with self._lock:
+                for change, name in self._pending:
+                    change(root, name)
+                self.root = root
+                self.built = time.monotonic()
+        finally:
+            with self._lock:
+                self._pending = None
+            self._build_lock.release()
+
+    def _apply(self, change, name):
+        with self._lock:
+            if self.root is not None:
+                change(self.root, name)
+            if self._pending is not None:
+                self._pending.append((change, name))
+
+    def _insert(self, root, name):
+        node = root
+        for char in name.lower():
+            node = node.children.setdefault(char, Node())
+        if node.names is None:
+            node.names = set()
+        node.names.add(name)
+
+    def _discard(self, root, name):
+        node = self._find(name.lower(), root)
+        if node and node.names:
+            node.names.discard(name)
+
+    def _find(self, key, root=None):
+        node = root or self.root
+        for char in key:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def _collect(self, node, limit):
+        # Обход в ширину: более короткие продолжения раньше, внутри одной длины - по алфавиту
+        result = []
+        queue = deque([node])
+        while queue and len(result) < limit:
+            node = queue.popleft()
+            if node.names:
+                result.extend(sorted(node.names)[:limit - len(result)])
+            queue.extend(node.children[char] for char in sorted(node.children))
+        return result
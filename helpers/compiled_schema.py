@@ -0,0 +1,79 @@
+from marshmallow import fields, missing
+from marshmallow.decorators import POST_DUMP, PRE_DUMP
+
+# Поля, значение которых можно преобразовать одной функцией: так же, как это делает их _serialize
+CONVERTERS = {
+    fields.Integer: int,
+    fields.String: str,
+    fields.Boolean: bool,
+    fields.Float: float,
+}
+
+
+def converter(field):
+    if type(field) in CONVERTERS and not getattr(field, "as_string", False):
+        return CONVERTERS[type(field)]
+    if type(field) is fields.DateTime and field.format in (None, "iso", "iso8601"):
+        return lambda value: value.isoformat()
+    if type(field) is fields.Nested and isinstance(field.schema, CompiledDumpMixin) and field.schema.compilable():
+        # Вложенные объекты - сразу собранной функцией вложенной схемы, минуя ее dump
+        dump, many = field.schema._compiled_dump(), field.schema.many or field.many
+        return (lambda value: [dump(item) for item in value]) if many else dump
+    return None
+
+
+def compile_dump(schema):
+    """
+    Собирает функцию obj -> dict для объектов (не словарей), эквивалентную schema.dump(obj, many=False):
+    простые поля читаются напрямую атрибутами, остальные (Hyperlinks, Method, ...) сериализуются самим полем
+    """
+    namespace = {"missing": missing, "accessor": schema.get_attribute}
+    lines = ["def dump(obj):", "    result = {}"]
+    for index, (name, field) in enumerate(schema.dump_fields.items()):
+        key = field.data_key if field.data_key is not None else name
+        attribute = field.attribute or name
+        convert = converter(field)
+        if convert is not None and attribute.isidentifier():
+            namespace[f"convert{index}"] = convert
+            lines += [f"    value = obj.{attribute}",
+                      f"    result[{key!r}] = None if value is None else convert{index}(value)"]
+        else:
+            namespace[f"field{index}"] = field
+            lines += [f"    value = field{index}.serialize({name!r}, obj, accessor=accessor)",
+                      f"    if value is not missing:",
+                      f"        result[{key!r}] = value"]
+    lines.append("    return result")
+    exec("\n".join(lines), namespace)
+    return namespace["dump"]
+
+
+class CompiledDumpMixin:
+    """
+    Примесь для схем ответа: dump объектов идет через заранее собранную функцию (compile_dump), без обхода полей
+    marshmallow на каждом объекте. Функция собирается один раз на класс схемы и набор полей.
+    Словари и схемы с pre_dump/post_dump сериализуются обычным путем
+    """
+    compiled = True  # False - всегда обычный dump marshmallow (для сравнения в benchmarks/serialize.py)
+
+    def dump(self, obj, *, many=None):
+        many = self.many if many is None else bool(many)
+        if obj is None or not self.compilable():
+            return super().dump(obj, many=many)
+        items = list(obj) if many else (obj,)
+        if any(isinstance(item, dict) for item in items):
+            return super().dump(obj, many=many)
+        dump = self._compiled_dump()
+        return [dump(item) for item in items] if many else dump(obj)
+
+    def compilable(self):
+        return self.compiled and not self._has_processors(PRE_DUMP) and not self._has_processors(POST_DUMP)
+
+    def _compiled_dump(self):
+        cls = type(self)
+        cache = cls.__dict__.get("_compiled_dumps")
+        if cache is None:
+            cache = cls._compiled_dumps = {}
+        key = tuple(self.dump_fields)
+        if key not in cache:
+            cache[key] = compile_dump(self)
+        return cache[key]
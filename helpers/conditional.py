@@ -0,0 +1,102 @@
+import hashlib
+from functools import wraps
+from flask import Response, request
+from sqlalchemy import func
+from werkzeug.http import http_date, quote_etag
+from helpers.pagination import approximate_count, page_query
+
+
+def make_etag(state):
+    return hashlib.sha1(repr(state).encode()).hexdigest()
+
+
+def not_modified(etag, last_modified):
+    # If-Modified-Since учитывается, только если клиент не прислал If-None-Match (RFC 7232, 6)
+    if request.if_none_match:
+        # Сравнение слабое: сжатый ответ отдается со слабым ETag (api/compression.py)
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+
+def conditional(validator):
+    """
+    Условный GET: validator(self, **kwargs) возвращает (состояние, время изменения) - обычно версии и updated_at строк
+    из одного легкого запроса - или None, если объекта нет (тогда метод вызывается как обычно).
+    Если клиент прислал совпадающий If-None-Match/If-Modified-Since, отвечает 304 без вызова метода и сериализации;
+    иначе добавляет к ответу ETag и Last-Modified.
+    Декоратор ставится под marshal_with
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            validators = validator(*args, **kwargs)
+            if validators is None:
+                return func(*args, **kwargs)
+            state, last_modified = validators
+            # Представление зависит и от URL: ссылки _links, параметры страницы
+            etag = make_etag((request.url, state))
+            last_modified = last_modified and last_modified.replace(microsecond=0)
+            headers = {"ETag": quote_etag(etag)}
+            if last_modified:
+                headers["Last-Modified"] = http_date(last_modified)
+            if request.authorization:
+                # Состояние зависит от пользователя: кэш не должен отдавать ETag/304 одного пользователя другому
+                headers["Vary"] = "Authorization"
+            if not_modified(etag, last_modified):
+                return Response(status=304, headers=headers)
+            result = func(*args, **kwargs)
+            if isinstance(result, Response):
+                return result
+            data, code = result if isinstance(result, tuple) else (result, 200)
+            return data, code, headers
+
+        return wrapper
+
+    return decorator
+
+
+def row_validators(query, model, *related):
+    """
+    Состояние одной строки: версии и время изменения model и связанных моделей related (через join в query)
+    """
+    columns = [column for entity in (model,) + related for column in (entity.version, entity.updated_at)]
+    row = query.with_entities(*columns).first()
+    if row is None:
+        return None
+    return tuple(row[0::2]), max(row[1::2])
+
+
+def collection_validators(query, model, *related):
+    """
+    Состояние набора строк: какие строки в него входят (количество, наименьший, наибольший id и сумма id),
+    сумма версий и последнее изменение. Состав меняется при удалении или сдвиге окна страницы,
+    сумма версий и время - при любом изменении.
+    query может быть с limit (страница): агрегаты считаются по его строкам
+    """
+    columns = []
+    for n, entity in enumerate((model,) + related):
+        columns += [entity.id.label(f"id_{n}"), entity.version.label(f"version_{n}"),
+                    entity.updated_at.label(f"updated_at_{n}")]
+    rows = query.with_entities(*columns).subquery()
+    aggregates = []
+    for n in range(len(related) + 1):
+        ids = rows.c[f"id_{n}"]
+        aggregates += [func.count(ids), func.min(ids), func.max(ids), func.sum(ids),
+                       func.sum(rows.c[f"version_{n}"]), func.max(rows.c[f"updated_at_{n}"])]
+    row = query.session.query(*aggregates).one()
+    updated = [value for value in row[5::6] if value is not None]
+    return tuple(row), max(updated) if updated else None
+
+
+def page_validators(query, column, model, *related, total=False, **page):
+    """
+    Состояние одной страницы списка: те же строки, что выберет paginate (limit, after, before), - без прохода
+    по всей таблице. С total=True в ответе есть общее количество, оно тоже входит в состояние
+    """
+    state, last_modified = collection_validators(page_query(query, column, **page), model, *related)
+    if total:
+        state += (approximate_count(query),)
+    return state, last_modified
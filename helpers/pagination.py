@@ -0,0 +1,110 @@
+import base64
+import binascii
+import json
+from api import abort, db
+from flask import current_app, request, url_for
+
+
+def encode_cursor(value, key="id"):
+    raw = json.dumps({key: value}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, key="id"):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value = json.loads(raw)[key]
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        abort(400, error=f"Invalid cursor: {cursor}")
+    if not isinstance(value, int) or value < 0:
+        abort(400, error=f"Invalid cursor: {cursor}")
+    return value
+
+
+def approximate_count(query):
+    """
+    Оценка количества строк. На PostgreSQL берется из плана запроса (без сканирования таблицы),
+    на остальных БД - обычный COUNT(*)
+    """
+    query = query.order_by(None)
+    if db.engine.dialect.name != 'postgresql':
+        return query.count()
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    plan = db.session.connection().execute(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def page_url(**cursor):
+    args = request.args.to_dict()
+    args.pop("after", None)
+    args.pop("before", None)
+    args.update(cursor)
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+
+def page_limit(limit=None):
+    return min(limit or current_app.config['PAGE_SIZE'], current_app.config['PAGE_SIZE_MAX'])
+
+
+def page_query(query, column, limit=None, after=None, before=None):
+    """
+    Строки одной страницы keyset-пагинации - на одну больше limit, чтобы узнать, есть ли следующая страница
+    """
+    if before is not None:
+        query = query.filter(column < decode_cursor(before)).order_by(column.desc())
+    else:
+        if after is not None:
+            query = query.filter(column > decode_cursor(after))
+        query = query.order_by(column)
+    return query.limit(page_limit(limit) + 1)
+
+
+def paginate(query, column, limit=None, after=None, before=None, total=False):
+    """
+    Keyset-пагинация по монотонному ключу column (обычно id).
+    Вместо OFFSET используется условие column > last_id, поэтому стоимость страницы не зависит от ее номера.
+    """
+    items = page_query(query, column, limit, after, before).all()
+    limit = page_limit(limit)
+    has_more = len(items) > limit
+    items = items[:limit]
+    if before is not None:
+        items.reverse()
+
+    if before is None:
+        has_next, has_prev = has_more, after is not None
+    else:
+        has_next, has_prev = True, has_more
+
+    links = {"self": request.full_path.rstrip('?')}
+    if items and has_next:
+        links["next"] = page_url(after=encode_cursor(getattr(items[-1], column.key)))
+    if items and has_prev:
+        links["prev"] = page_url(before=encode_cursor(getattr(items[0], column.key)))
+
+    page = {"items": items, "_links": links}
+    if total:
+        page["total"] = approximate_count(query)
+    return page
+
+
+def paginate_ranked(query, limit=None, after=None, total=False):
+    """
+    Пагинация результатов, отсортированных по вычисляемому рангу (поиск): курсор хранит смещение.
+    Глубокие страницы дороже первых, но поисковую выдачу обычно дальше нескольких страниц не листают
+    """
+    limit = page_limit(limit)
+    offset = decode_cursor(after, key="offset") if after is not None else 0
+    items = query.offset(offset).limit(limit + 1).all()
+    has_more = len(items) > limit
+    items = items[:limit]
+
+    links = {"self": request.full_path.rstrip('?')}
+    if has_more:
+        links["next"] = page_url(after=encode_cursor(offset + limit, key="offset"))
+    if offset:
+        links["prev"] = page_url(after=encode_cursor(max(offset - limit, 0), key="offset"))
+    page = {"items": items, "_links": links}
+    if total:
+        page["total"] = approximate_count(query)
+    return page
@@ -0,0 +1,113 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from threading import BoundedSemaphore, Lock
+from passlib.context import CryptContext
+from werkzeug.exceptions import ServiceUnavailable
+
+_contexts = {}
+
+
+class PasswordHasherBusy(ServiceUnavailable):
+    description = "Password hashing is overloaded, try again later"
+
+
+def context_settings(schemes, rounds):
+    """
+    Настройки CryptContext: первая схема - основная, остальные считаются устаревшими.
+    Хэши с другим числом раундов тоже требуют обновления (needs_update)
+    """
+    settings = {"schemes": tuple(schemes), "default": schemes[0], "deprecated": "auto"}
+    for scheme, value in rounds.items():
+        settings[f"{scheme}__default_rounds"] = value
+        settings[f"{scheme}__min_rounds"] = value
+        settings[f"{scheme}__max_rounds"] = value
+    return tuple(sorted(settings.items()))
+
+
+def _context(settings):
+    # CryptContext дорого собирать, поэтому в каждом процессе он создается один раз
+    if settings not in _contexts:
+        _contexts[settings] = CryptContext(**dict(settings))
+    return _contexts[settings]
+
+
+def _hash(settings, password):
+    return _context(settings).hash(password)
+
+
+def _verify_and_update(settings, password, password_hash):
+    return _context(settings).verify_and_update(password, password_hash)
+
+
+class PasswordHasher:
+    """
+    Хэширование паролей в пуле процессов, чтобы не блокировать воркер, обрабатывающий запросы.
+    queue_size ограничивает число задач в пуле; если пул занят или не уложился в timeout - 503
+    """
+
+    def __init__(self, settings, workers=2, queue_size=16, timeout=5):
+        self._pool = None
+        self._pool_pid = None
+        self._lock = Lock()
+        self._setup(settings, workers, queue_size, timeout)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(context_settings(config.PASSWORD_SCHEMES, config.PASSWORD_ROUNDS),
+                   workers=config.PASSWORD_POOL_WORKERS,
+                   queue_size=config.PASSWORD_POOL_QUEUE,
+                   timeout=config.PASSWORD_POOL_TIMEOUT)
+
+    def configure(self, config):
+        """
+        Перенастройка по app.config; пул процессов создается заново при следующем вызове
+        """
+        self._setup(context_settings(config["PASSWORD_SCHEMES"], config["PASSWORD_ROUNDS"]),
+                    config["PASSWORD_POOL_WORKERS"], config["PASSWORD_POOL_QUEUE"], config["PASSWORD_POOL_TIMEOUT"])
+
+    def _setup(self, settings, workers, queue_size, timeout):
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=False)
+            self._pool = None
+            self.settings = settings
+            self.workers = workers
+            self.timeout = timeout
+            self._slots = BoundedSemaphore(queue_size)
+
+    def hash(self, password):
+        return self._call(_hash, password)
+
+    def verify_and_update(self, password, password_hash):
+        """
+        Возвращает (valid, new_hash); new_hash не None, если хэш нужно пересчитать по текущим настройкам
+        """
+        if not password_hash:
+            return False, None
+        return self._call(_verify_and_update, password, password_hash)
+
+    def _executor(self):
+        # После fork (gunicorn) пул родителя непригоден - создаем свой
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _call(self, func, *args):
+        if not self.workers:
+            return func(self.settings, *args)
+        # Слот возвращается в тот семафор, из которого взят, даже если configure успел его заменить
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        try:
+            future = self._executor().submit(func, self.settings, *args)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise PasswordHasherBusy()
@@ -0,0 +1,38 @@
+import json
+from flask import current_app
+from flask.json import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен: без него - стандартный json
+    orjson = None
+
+# Типы, которые не умеет сам кодировщик (Decimal, UUID, ...), кодируются как в flask.jsonify
+_flask_encoder = JSONEncoder()
+
+
+def dumps(data, pretty=False):
+    """
+    JSON в байтах (UTF-8, без экранирования не-ASCII). Отступы - только если pretty
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(data, default=_flask_encoder.default, option=option)
+    if pretty:
+        return json.dumps(data, ensure_ascii=False, indent=2, default=_flask_encoder.default).encode()
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=_flask_encoder.default).encode()
+
+
+def render(data, code=200, headers=None):
+    """
+    Ответ application/json; отступы только в режиме DEBUG
+    """
+    response = current_app.response_class(dumps(data, pretty=current_app.debug) + b"\n",
+                                          mimetype="application/json", status=code)
+    response.headers.extend(headers or {})
+    return response
+
+
+def output_json(data, code, headers=None):
+    # Представление application/json для flask-restful (ответы ресурсов без marshal_with, ошибки abort)
+    return render(data, code, headers)
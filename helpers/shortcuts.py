@@ -1,8 +1,8 @@
 from api import abort
 
 
-def get_or_404(model, id):
-    object = model.query.get(id)
+def get_or_404(model, id, *options):
+    object = model.query.options(*options).get(id)
     if not object:
         abort(404, error=f"note {id} not found")
     return object
@@ -0,0 +1,259 @@
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import secrets
+import tempfile
+import time
+from contextlib import contextmanager
+from flask import current_app, request, send_from_directory
+from werkzeug.exceptions import NotFound, RequestEntityTooLarge
+from werkzeug.security import safe_join
+
+try:
+    import fcntl
+except ImportError:  # Windows: без блокировки одновременных дозаписей одной сессии
+    fcntl = None
+
+SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+CONTENT_PATH = re.compile(r"^([0-9a-f]{2})/([0-9a-f]{2})/(([0-9a-f]{64})(\.[a-z0-9]{1,10})?)$")
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def extension(filename):
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext if re.fullmatch(r"\.[a-z0-9]{1,10}", ext) else ""
+
+
+class ContentStore:
+    """
+    Хранилище файлов по содержимому: файл лежит в <root>/ab/cd/<sha256><расширение>, где ab и cd - начало хэша.
+    Одинаковые файлы хранятся один раз, а в каждом каталоге не больше нескольких тысяч файлов.
+    Незаконченные загрузки по частям лежат в <root>/.sessions
+    """
+
+    def __init__(self, root, chunk_size=64 * 1024, max_size=None):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+
+    def path_for(self, digest, ext=""):
+        return os.path.join(digest[:2], digest[2:4], digest + ext)
+
+    def save_stream(self, stream, filename, limit=None):
+        """
+        Пишет поток во временный файл порциями, считая SHA-256 на лету, и переносит его на место по хэшу.
+        Возвращает (относительный путь, sha256, был ли такой файл уже сохранен, размер)
+        """
+        limit = limit or self.max_size
+        tmp_dir = self._dir(".tmp")
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp:
+            try:
+                for chunk in iter(lambda: stream.read(self.chunk_size), b""):
+                    size += len(chunk)
+                    if limit and size > limit:
+                        raise RequestEntityTooLarge(f"File is larger than {limit} bytes")
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            except BaseException:
+                tmp.close()
+                os.remove(tmp.name)
+                raise
+        return self._commit(tmp.name, digest.hexdigest(), extension(filename)) + (size,)
+
+    def _commit(self, tmp_path, digest, ext):
+        relative = self.path_for(digest, ext)
+        target = os.path.join(self.root, relative)
+        if os.path.exists(target):
+            os.remove(tmp_path)
+            return relative, digest, True
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, target)  # атомарно: читатели не увидят недописанный файл
+        return relative, digest, False
+
+    # Загрузка по частям: сессия - файл .part (уже принятые байты) и .json (имя, ожидаемый размер и хэш)
+
+    def create_session(self, filename, size, sha256=None, ttl=None, owner=None):
+        if self.max_size and size > self.max_size:
+            raise RequestEntityTooLarge(f"File is larger than {self.max_size} bytes")
+        if ttl:
+            self.expire_sessions(ttl)
+        session_id = secrets.token_urlsafe(24)
+        meta = {"filename": filename, "size": size, "sha256": sha256, "owner": owner, "created": time.time()}
+        with open(self._session_path(session_id, ".json"), "w") as file:
+            json.dump(meta, file)
+        open(self._session_path(session_id, ".part"), "wb").close()
+        return session_id
+
+    def session(self, session_id):
+        """
+        (метаданные, сколько байт уже принято) или None, если сессии нет
+        """
+        if not SESSION_ID.match(session_id):
+            return None
+        try:
+            with open(self._session_path(session_id, ".json")) as file:
+                meta = json.load(file)
+            return meta, os.path.getsize(self._session_path(session_id, ".part"))
+        except (OSError, ValueError):
+            return None
+
+    def append(self, session_id, offset, stream):
+        """
+        Дописывает часть, начинающуюся с offset. Возвращает (метаданные, новое смещение) или
+        (метаданные, текущее смещение, False), если offset не совпал с уже принятым размером.
+        Сессии нет (истекла, отменена, завершена) - NotFound
+        """
+        meta = self._session_meta(session_id)
+        try:
+            with self._locked(self._session_path(session_id, ".part")) as part:
+                current = os.fstat(part.fileno()).st_size
+                if offset != current:
+                    return meta, current, False
+                part.seek(current)
+                for chunk in iter(lambda: stream.read(self.chunk_size), b""):
+                    current += len(chunk)
+                    if current > meta["size"]:
+                        part.truncate(offset)
+                        raise RequestEntityTooLarge(f"Upload is larger than declared size {meta['size']}")
+                    part.write(chunk)
+        except FileNotFoundError:
+            raise NotFound(f"Upload session {session_id} not found")
+        return meta, current, True
+
+    def complete(self, session_id):
+        """
+        Считает хэш собранного файла и переносит его в хранилище. Возвращает (путь, sha256, был ли уже) или
+        None, если хэш не совпал с заявленным (сессия удаляется)
+        """
+        meta = self._session_meta(session_id)
+        part_path = self._session_path(session_id, ".part")
+        digest = hashlib.sha256()
+        try:
+            with open(part_path, "rb") as part:
+                for chunk in iter(lambda: part.read(self.chunk_size), b""):
+                    digest.update(chunk)
+            digest = digest.hexdigest()
+            if meta.get("sha256") and meta["sha256"].lower() != digest:
+                self.delete_session(session_id)
+                return None
+            result = self._commit(part_path, digest, extension(meta["filename"]))
+        except FileNotFoundError:
+            # Сессию успели удалить: истекла, отменена или завершена параллельным запросом
+            raise NotFound(f"Upload session {session_id} not found")
+        self.delete_session(session_id)
+        return result
+
+    def open_sessions(self, owner):
+        """
+        Сколько незаконченных загрузок у owner
+        """
+        directory = self._dir(".sessions")
+        count = 0
+        for name in os.listdir(directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as file:
+                    count += json.load(file).get("owner") == owner
+            except (OSError, ValueError):
+                pass
+        return count
+
+    def delete_session(self, session_id):
+        for suffix in (".part", ".json"):
+            try:
+                os.remove(self._session_path(session_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def expire_sessions(self, ttl):
+        """
+        Удаляет сессии, не менявшиеся дольше ttl секунд. append меняет только .part,
+        поэтому возраст сессии - по более свежему файлу из пары
+        """
+        directory = self._dir(".sessions")
+        deadline = time.time() - ttl
+        changed = {}
+        for name in os.listdir(directory):
+            session_id = os.path.splitext(name)[0]
+            try:
+                mtime = os.path.getmtime(os.path.join(directory, name))
+            except FileNotFoundError:
+                continue
+            changed[session_id] = max(mtime, changed.get(session_id, mtime))
+        for session_id, mtime in changed.items():
+            if mtime < deadline:
+                self.delete_session(session_id)
+
+    def _session_meta(self, session_id):
+        session = self.session(session_id)
+        if session is None:
+            raise NotFound(f"Upload session {session_id} not found")
+        return session[0]
+
+    def _dir(self, name):
+        path = os.path.join(self.root, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _session_path(self, session_id, suffix):
+        return os.path.join(self._dir(".sessions"), session_id + suffix)
+
+    @contextmanager
+    def _locked(self, path):
+        with open(path, "r+b") as file:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            yield file
+
+
+def content_digest(path):
+    """
+    SHA-256 файла, если path - путь в хранилище по содержимому (ab/cd/<sha256>.ext), иначе None
+    """
+    match = CONTENT_PATH.match(path)
+    if match and match.group(4).startswith(match.group(1) + match.group(2)):
+        return match.group(4)
+    return None
+
+
+def send_upload(filename):
+    """
+    Отдает загруженный файл. Для файлов по содержимому ETag - их SHA-256, а кэшировать можно навсегда:
+    по этому адресу другое содержимое появиться не может.
+    UPLOAD_SEND_MODE: None - файл отдает воркер (с поддержкой Range), "x-accel" - nginx (X-Accel-Redirect),
+    "x-sendfile" - Apache/lighttpd (X-Sendfile); в двух последних случаях воркер не копирует байты файла
+    """
+    config = current_app.config
+    # Служебные каталоги (.tmp, .sessions) с недокачанными файлами не отдаются
+    if any(part.startswith(".") for part in filename.split("/")):
+        raise NotFound()
+    mode = config["UPLOAD_SEND_MODE"]
+    digest = content_digest(filename)
+    if mode == "x-accel":
+        path = safe_join(config["UPLOAD_FOLDER"], filename)
+        if path is None or not os.path.isfile(path):
+            raise NotFound()
+        response = current_app.response_class(mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream")
+        response.headers["X-Accel-Redirect"] = config["UPLOAD_ACCEL_PREFIX"].rstrip("/") + "/" + filename
+        response.headers["Content-Disposition"] = f"attachment; filename={os.path.basename(filename)}"
+    else:
+        # В режиме x-sendfile заголовок ставит сам send_file (USE_X_SENDFILE)
+        response = send_from_directory(config["UPLOAD_FOLDER"], filename, as_attachment=True,
+                                       add_etags=digest is None, conditional=False)
+    if digest:
+        response.set_etag(digest)
+        response.headers["Cache-Control"] = IMMUTABLE
+        response.headers.pop("Expires", None)
+    # Range обрабатывает тот, кто отдает байты: воркер сам или фронтовой сервер
+    response = response.make_conditional(request, accept_ranges=mode is None,
+                                         complete_length=response.content_length if mode is None else None)
+    if mode is None:
+        # werkzeug ставит Accept-Ranges только в ответ 206, клиенту же надо знать о докачке заранее
+        response.headers["Accept-Ranges"] = "bytes"
+    return response
@@ -0,0 +1,36 @@
+"""add note full-text search index
+
+Revision ID: 9e3d5b7a1c20
+Revises: 4c1f0e2a9b7d
+Create Date: 2026-10-18 12:03:17.204811
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e3d5b7a1c20'
+down_revision = '4c1f0e2a9b7d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS note_fts USING fts5(text, tokenize='unicode61')")
+        op.execute("INSERT INTO note_fts(rowid, text) SELECT id, text FROM note_model")
+    elif bind.dialect.name == 'postgresql':
+        op.execute("ALTER TABLE note_model ADD COLUMN search_vector tsvector "
+                   "GENERATED ALWAYS AS (to_tsvector('simple', text)) STORED")
+        op.execute("CREATE INDEX ix_note_model_search_vector ON note_model USING gin (search_vector)")
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        op.execute("DROP TABLE IF EXISTS note_fts")
+    elif bind.dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_note_model_search_vector")
+        op.execute("ALTER TABLE note_model DROP COLUMN IF EXISTS search_vector")
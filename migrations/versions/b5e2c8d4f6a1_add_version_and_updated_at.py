@@ -0,0 +1,36 @@
+"""add version and updated_at
+
+Revision ID: b5e2c8d4f6a1
+Revises: 9e3d5b7a1c20
+Create Date: 2026-10-18 14:26:51.730942
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e2c8d4f6a1'
+down_revision = '9e3d5b7a1c20'
+branch_labels = None
+depends_on = None
+
+tables = ['user_model', 'note_model', 'tag']
+
+
+def upgrade():
+    for table in tables:
+        op.add_column(table, sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+        # SQLite не умеет ADD COLUMN с непостоянным DEFAULT: добавляем колонку, заполняем и меняем через batch
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.execute(f"UPDATE {table} SET updated_at = CURRENT_TIMESTAMP")
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False,
+                                  server_default=sa.func.current_timestamp())
+
+
+def downgrade():
+    for table in tables:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
+            batch_op.drop_column('version')
@@ -0,0 +1,30 @@
+"""add partial indexes on active (not archived) notes
+
+Revision ID: c7a4e9f2b3d8
+Revises: b5e2c8d4f6a1
+Create Date: 2026-10-18 16:41:09.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7a4e9f2b3d8'
+down_revision = 'b5e2c8d4f6a1'
+branch_labels = None
+depends_on = None
+
+active = sa.column('archive') == sa.false()
+
+
+def upgrade():
+    op.create_index('ix_note_model_author_id_active', 'note_model', ['author_id'],
+                    sqlite_where=active, postgresql_where=active)
+    op.create_index('ix_note_model_private_active', 'note_model', ['private'],
+                    sqlite_where=active, postgresql_where=active)
+
+
+def downgrade():
+    op.drop_index('ix_note_model_private_active', table_name='note_model')
+    op.drop_index('ix_note_model_author_id_active', table_name='note_model')
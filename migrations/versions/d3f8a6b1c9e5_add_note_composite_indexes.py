@@ -0,0 +1,39 @@
+"""add composite indexes for note visibility and note tags
+
+Revision ID: d3f8a6b1c9e5
+Revises: c7a4e9f2b3d8
+Create Date: 2026-10-18 17:52:33.160417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3f8a6b1c9e5'
+down_revision = 'c7a4e9f2b3d8'
+branch_labels = None
+depends_on = None
+
+active = sa.column('archive') == sa.false()
+
+
+def upgrade():
+    # Одноколоночные частичные индексы заменяются составными с тем же условием
+    op.drop_index('ix_note_model_author_id_active', table_name='note_model')
+    op.drop_index('ix_note_model_private_active', table_name='note_model')
+    op.create_index('ix_note_model_author_id_private_active', 'note_model', ['author_id', 'private'],
+                    sqlite_where=active, postgresql_where=active)
+    op.create_index('ix_note_model_private_id_active', 'note_model', ['private', 'id'],
+                    sqlite_where=active, postgresql_where=active)
+    op.create_index('ix_tags_note_model_id', 'tags', ['note_model_id', 'tag_id'])
+
+
+def downgrade():
+    op.drop_index('ix_tags_note_model_id', table_name='tags')
+    op.drop_index('ix_note_model_private_id_active', table_name='note_model')
+    op.drop_index('ix_note_model_author_id_private_active', table_name='note_model')
+    op.create_index('ix_note_model_private_active', 'note_model', ['private'],
+                    sqlite_where=active, postgresql_where=active)
+    op.create_index('ix_note_model_author_id_active', 'note_model', ['author_id'],
+                    sqlite_where=active, postgresql_where=active)
@@ -1,12 +1,50 @@
+import csv
+import gzip
+import hashlib
+import io
 import json
-from api import db
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from api import db, credentials_cache, principals_cache, metrics, rate_limit, response_cache, database
 from app import app
 from unittest import TestCase
-from api.models.user import UserModel
+from werkzeug.exceptions import NotFound
+from werkzeug.test import Client as WerkzeugClient
+from api.models.user import UserModel, Principal, password_hasher, usernames
+from helpers.autocomplete import PrefixIndex
+from helpers.passwords import PasswordHasher, PasswordHasherBusy, context_settings
+from helpers.storage import ContentStore
 from api.models.note import NoteModel
+from api.models.tag import TagModel, tag_names
+from api.resources import note as note_resources
+from helpers.queries import count_queries
+from helpers.pagination import encode_cursor
 from api.schemas.user import UserSchema
+from api.schemas.note import NoteSchema
+from helpers.compiled_schema import CompiledDumpMixin
 from base64 import b64encode
 from config import Config
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class QueryBudgetMixin:
+    @contextmanager
+    def assertQueryBudget(self, resource, method):
+        """
+        Проверяет, что запросы внутри блока укладываются в бюджет, объявленный в resource.query_budget
+        """
+        budget = resource.query_budget[method]
+        with count_queries() as queries:
+            yield queries
+        self.assertLessEqual(len(queries), budget,
+                             f"{resource.__name__}.{method}: {len(queries)} SQL queries, budget {budget}:\n" +
+                             "\n".join(queries))
 
 
 class TestUsers(TestCase):
@@ -67,11 +105,47 @@ class TestUsers(TestCase):
             user.save()
 
         res = self.client.get('/users')
-        data = json.loads(res.data)
+        data = json.loads(res.data)["items"]
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data[0]["username"], users_data[0]["username"])
         self.assertEqual(data[1]["username"], users_data[1]["username"])
 
+    def test_users_pagination(self):
+        """
+        Постраничный вывод пользователей по курсору
+        """
+        for i in range(5):
+            UserModel(username=f"user{i}", password="12345").save()
+
+        res = self.client.get('/users?limit=2&total=true')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([u["username"] for u in data["items"]], ["user0", "user1"])
+        self.assertEqual(data["total"], 5)
+        self.assertNotIn("prev", data["_links"])
+
+        res = self.client.get(data["_links"]["next"])
+        data = json.loads(res.data)
+        self.assertEqual([u["username"] for u in data["items"]], ["user2", "user3"])
+
+        res = self.client.get(data["_links"]["prev"])
+        data = json.loads(res.data)
+        self.assertEqual([u["username"] for u in data["items"]], ["user0", "user1"])
+
+    def test_users_pagination_max_limit(self):
+        self.app.config["PAGE_SIZE_MAX"] = 3
+        try:
+            for i in range(5):
+                UserModel(username=f"user{i}", password="12345").save()
+            res = self.client.get('/users?limit=1000')
+            self.assertEqual(len(json.loads(res.data)["items"]), 3)
+        finally:
+            self.app.config["PAGE_SIZE_MAX"] = Config.PAGE_SIZE_MAX
+
+    def test_users_pagination_bad_cursor(self):
+        res = self.client.get('/users?after=not-a-cursor')
+        self.assertEqual(res.status_code, 400)
+
     def test_user_not_found(self):
         """
         Получение несуществующего пользователя
@@ -79,6 +153,72 @@ class TestUsers(TestCase):
         res = self.client.get('/users/1')
         self.assertEqual(res.status_code, 404)
 
+    def test_users_search(self):
+        """
+        Поиск пользователей: сначала по префиксу, затем с учетом опечатки
+        """
+        for username in ["alex", "alexander", "Alexey", "alina", "boris", "xalex"]:
+            UserModel(username=username, password="12345").save()
+
+        res = self.client.get('/users/search?username=ale&limit=3')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([user["username"] for user in data], ["alex", "Alexey", "alexander"])
+
+        res = self.client.get('/users/search?username=alx')
+        found = [user["username"] for user in json.loads(res.data)]
+        self.assertEqual(found[0], "alex")
+        self.assertTrue({"Alexey", "alexander"} <= set(found))
+        self.assertNotIn("boris", found)
+
+        res = self.client.get('/users/search?username=bor')
+        self.assertEqual([user["username"] for user in json.loads(res.data)], ["boris"])
+
+    def test_tags_search_refreshed_on_write(self):
+        TagModel(name="python").save()
+        self.assertEqual(json.loads(self.client.get('/tags/search?name=py').data)[0]["name"], "python")
+        TagModel(name="pyramid").save()
+        names = [tag["name"] for tag in json.loads(self.client.get('/tags/search?name=py').data)]
+        self.assertEqual(names, ["python", "pyramid"])
+        # Отмененная транзакция индекс не меняет
+        with self.app.app_context():
+            db.session.add(TagModel(name="pylons"))
+            db.session.flush()
+            db.session.rollback()
+        names = [tag["name"] for tag in json.loads(self.client.get('/tags/search?name=py').data)]
+        self.assertEqual(names, ["python", "pyramid"])
+        # То же для вставки в обход ORM (создание тегов по имени в PUT /notes/tags)
+        with self.app.app_context():
+            TagModel.insert_names(["pyqt"])
+            db.session.rollback()
+        self.assertEqual(tag_names.search("py"), ["python", "pyramid"])
+
+    def test_prefix_index_rebuild(self):
+        """
+        Перестройка индекса не блокирует запись и поиск по старому дереву; записи, пришедшие во время нее, не теряются
+        """
+        loaded, release = threading.Event(), threading.Event()
+        names = ["pyramid"]
+
+        def loader():
+            if len(names) > 1:
+                loaded.set()
+                release.wait(5)
+            return list(names)
+
+        index = PrefixIndex(loader)
+        self.assertEqual(index.complete("py"), ["pyramid"])
+        names.append("python")
+        index.built = 0
+        rebuild = threading.Thread(target=index.complete, args=("py",))
+        rebuild.start()
+        self.assertTrue(loaded.wait(5))
+        index.add("pylons")
+        self.assertEqual(index.complete("py"), ["pylons", "pyramid"])
+        release.set()
+        rebuild.join()
+        self.assertEqual(index.complete("py"), ["pylons", "python", "pyramid"])
+
     def test_unique_username(self):
         """
         Проверяет невозможность создания нескольких пользователей с одинаковым username
@@ -110,6 +250,117 @@ class TestUsers(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(data["username"], "Alex")
 
+    def test_credentials_cache(self):
+        """
+        Повторная Basic-авторизация не пересчитывает хэш пароля; смена пароля сбрасывает кэш
+        """
+        user = UserModel(username="admin", password="admin", role="admin")
+        user.save()
+        headers = {'Authorization': 'Basic ' + b64encode(b"admin:admin").decode('utf-8')}
+        credentials_cache.clear()
+        hits = credentials_cache.hits
+
+        self.assertEqual(self.client.get('/auth/token', headers=headers).status_code, 200)
+        self.assertEqual(self.client.get('/auth/token', headers=headers).status_code, 200)
+        self.assertEqual(credentials_cache.hits, hits + 1)
+
+        # Пароль сменили в другом воркере: кэш этого воркера не сброшен, но хэш в строке уже другой
+        other_hash = PasswordHasher(context_settings(["sha256_crypt"], {"sha256_crypt": 1000}), workers=0).hash("other")
+        with self.app.app_context():
+            db.session.execute(UserModel.__table__.update().values(password_hash=other_hash))
+            db.session.commit()
+        self.assertIsNotNone(credentials_cache.get("admin"))
+        self.assertEqual(self.client.get('/auth/token', headers=headers).status_code, 401)
+        self.assertEqual(self.client.get('/auth/token', headers={
+            'Authorization': 'Basic ' + b64encode(b"admin:other").decode('utf-8')}).status_code, 200)
+
+        with self.app.app_context():
+            user = UserModel.query.get(user.id)
+            user.hash_password("new password")
+            user.save()
+        self.assertIsNone(credentials_cache.get("admin"))
+        self.assertEqual(self.client.get('/auth/token', headers=headers).status_code, 401)
+
+    def test_password_rehash_on_login(self):
+        """
+        Хэш, сделанный по устаревшим настройкам, пересчитывается при успешном входе
+        """
+        old_settings = context_settings(["sha256_crypt"], {"sha256_crypt": 1000})
+        user = UserModel(username="admin", password="admin")
+        user.password_hash = PasswordHasher(old_settings, workers=0).hash("admin")
+        user.save()
+        old_hash = user.password_hash
+        credentials_cache.clear()
+
+        headers = {'Authorization': 'Basic ' + b64encode(b"admin:admin").decode('utf-8')}
+        self.assertEqual(self.client.get('/auth/token', headers=headers).status_code, 200)
+        with self.app.app_context():
+            new_hash = UserModel.query.get(user.id).password_hash
+        self.assertNotEqual(new_hash, old_hash)
+        self.assertTrue(new_hash.startswith("$6$"))
+        self.assertEqual(password_hasher.verify_and_update("admin", new_hash), (True, None))
+
+    def test_auth_config_from_app(self):
+        from flask import Flask
+        from api.models import user as user_model
+
+        class OtherConfig(Config):
+            SECRET_KEY = "another key"
+            AUTH_CACHE_TTL = 7
+            TOKEN_CACHE_SIZE = 3
+            PASSWORD_POOL_WORKERS = 0
+            PASSWORD_ROUNDS = {'sha512_crypt': 6000}
+
+        other = Flask(__name__)
+        other.config.from_object(OtherConfig)
+        with self.app.app_context():
+            token = UserModel("admin", "admin").generate_auth_token()
+        user_model.init_app(other)
+        try:
+            self.assertEqual((credentials_cache.ttl, principals_cache.maxsize), (7, 3))
+            self.assertEqual(password_hasher.workers, 0)
+            self.assertIn("rounds=6000$", password_hasher.hash("admin"))
+            # Токен, подписанный ключом из Config, ключом приложения не принимается
+            self.assertIsNone(UserModel.verify_auth_token(token))
+        finally:
+            user_model.init_app(self.app)
+        self.assertEqual(credentials_cache.ttl, Config.AUTH_CACHE_TTL)
+
+    def test_password_pool_busy(self):
+        hasher = PasswordHasher(password_hasher.settings, workers=1, queue_size=1)
+        hasher._slots.acquire()
+        with self.assertRaises(PasswordHasherBusy):
+            hasher.hash("admin")
+
+    def test_token_auth_without_user_lookup(self):
+        """
+        Повторная авторизация по токену не загружает пользователя из БД
+        """
+        user = UserModel(username="admin", password="admin", role="admin")
+        user.save()
+        with self.app.app_context():
+            token = UserModel.query.get(user.id).generate_auth_token()
+            self.assertIsInstance(UserModel.verify_auth_token(token), UserModel)
+            principal = UserModel.verify_auth_token(token)
+        self.assertIsInstance(principal, Principal)
+        self.assertEqual((principal.id, principal.get_roles()), (user.id, "admin"))
+
+    def test_token_revoked_on_role_change(self):
+        admin = UserModel(username="admin", password="admin", role="admin")
+        admin.save()
+        ivan = UserModel(username="ivan", password="12345")
+        ivan.save()
+        admin_headers = {'Authorization': 'Basic ' + b64encode(b"admin:admin").decode('utf-8')}
+        ivan_headers = {'Authorization': 'Basic ' + b64encode(b"ivan:12345").decode('utf-8')}
+        token = json.loads(self.client.get('/auth/token', headers=ivan_headers).data)["token"]
+        token_headers = {'Authorization': 'Basic ' + b64encode(f"{token}:".encode()).decode('utf-8')}
+        self.assertEqual(self.client.get('/auth/token', headers=token_headers).status_code, 200)
+
+        response = self.client.put(f'/users/{ivan.id}', headers=admin_headers,
+                                   data=json.dumps({"role": "editor"}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/auth/token', headers=token_headers).status_code, 401)
+
     def test_delete_user(self):
         """
         Удаление пользователя
@@ -121,9 +372,15 @@ class TestUsers(TestCase):
             # drop all tables
             db.session.remove()
             db.drop_all()
+        credentials_cache.clear()
+        principals_cache.clear()
+        usernames.invalidate()
+        tag_names.invalidate()
+        response_cache.cache.clear()
+        rate_limit.limiter.clear()
 
 
-class TestNotes(TestCase):
+class TestNotes(QueryBudgetMixin, TestCase):
     def setUp(self):
         self.app = app
         self.app.config.update({
@@ -182,7 +439,8 @@ class TestNotes(TestCase):
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)
-        self.assertEqual(len(data), 2)
+        self.assertEqual(len(data["items"]), 2)
+        self.assertNotIn("next", data["_links"])
 
     def test_get_note_by_id(self):
         notes_data = [
@@ -259,12 +517,857 @@ class TestNotes(TestCase):
             ids.append(note.id)
 
         res = self.client.get('/notes', headers=self.headers)
-        data = json.loads(res.data)
+        data = json.loads(res.data)["items"]
 
         self.assertFalse(data[0]["private"])
         self.assertTrue(data[1]["private"])
         self.assertTrue(data[2]["private"])
 
+    def test_public_filter_pagination(self):
+        for i in range(3):
+            NoteModel(author_id=self.user.id, text=f"Public note {i}", private=False).save()
+        NoteModel(author_id=self.user.id, text="Private note").save()
+
+        res = self.client.get('/notes/public/filter?username=admin&limit=2')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data["items"]), 2)
+        self.assertIn("username=admin", data["_links"]["next"])
+
+        data = json.loads(self.client.get(data["_links"]["next"]).data)
+        self.assertEqual([n["text"] for n in data["items"]], ["Public note 2"])
+
+    def test_notes_query_budget(self):
+        """
+        Количество SQL-запросов на список заметок не зависит от числа заметок/авторов/тегов
+        """
+        authors = [self.user]
+        for i in range(3):
+            author = UserModel(username=f"author{i}", password="12345")
+            author.save()
+            authors.append(author)
+        tags = []
+        for i in range(3):
+            tag = TagModel(name=f"tag{i}")
+            tag.save()
+            tags.append(tag)
+        tag_ids = [tag.id for tag in tags]
+        for i in range(20):
+            note = NoteModel(author_id=authors[i % 4].id, text=f"Note {i}", private=bool(i % 2))
+            note.tags = tags[:i % 4]
+            note.save()
+
+        with self.assertQueryBudget(note_resources.NotesListResource, "get"):
+            res = self.client.get('/notes', headers=self.headers)
+        self.assertEqual(len(json.loads(res.data)["items"]), 10)  # свои и публичные чужие
+        with self.assertQueryBudget(note_resources.NoteFilerResource, "get"):
+            res = self.client.get('/notes/public/filter')
+        self.assertEqual(len(json.loads(res.data)["items"]), 10)
+        with self.assertQueryBudget(note_resources.NoteResource, "get"):
+            res = self.client.get('/notes/3', headers=self.headers)
+        self.assertEqual([tag["name"] for tag in json.loads(res.data)["tags"]], ["tag0", "tag1"])
+        with self.assertQueryBudget(note_resources.NoteSetTagsResource, "put"):
+            res = self.client.put('/notes/3/add_tags', data=json.dumps({"tags": tag_ids}),
+                                  content_type='application/json')
+        self.assertEqual([tag["name"] for tag in json.loads(res.data)["tags"]], ["tag0", "tag1", "tag2"])
+
+        with self.assertQueryBudget(note_resources.NotesListResource, "post"):
+            res = self.client.post('/notes', headers=self.headers, data=json.dumps({"text": "Budget note"}),
+                                   content_type='application/json')
+        self.assertEqual(res.status_code, 201)
+        note_id = json.loads(res.data)["id"]
+        self.client.put(f'/notes/{note_id}/add_tags', data=json.dumps({"tags": tag_ids}),
+                        content_type='application/json')
+        with self.assertQueryBudget(note_resources.NoteResource, "put"):
+            res = self.client.put(f'/notes/{note_id}', headers=self.headers, data=json.dumps({"text": "Edited"}),
+                                  content_type='application/json')
+        self.assertEqual((res.status_code, len(json.loads(res.data)["tags"])), (200, 3))
+        with self.assertQueryBudget(note_resources.NoteSearchResource, "get"):
+            res = self.client.get('/notes/search?q=note', headers=self.headers)
+        self.assertEqual(len(json.loads(res.data)["items"]), 10)
+        with self.assertQueryBudget(note_resources.NoteArchive, "delete"):
+            res = self.client.delete(f'/notes/{note_id}/archive')
+        self.assertTrue(json.loads(res.data)["archive"])
+        with self.assertQueryBudget(note_resources.NoteResource, "delete"):
+            res = self.client.delete('/notes/3', headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+
+    def test_metrics(self):
+        """
+        /metrics отдает задержку, статусы, число SQL-запросов и время этапов по каждому endpoint
+        """
+        NoteModel(author_id=self.user.id, text="Test note").save()
+        self.client.get('/notes', headers=self.headers)
+        res = self.client.get('/metrics')
+        text = res.data.decode()
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('http_requests_total{endpoint="/notes",method="GET",status="200"}', text)
+        self.assertIn('http_request_duration_seconds_count{endpoint="/notes",method="GET"}', text)
+        self.assertIn('http_request_sql_queries_bucket{endpoint="/notes",method="GET",le="+Inf"}', text)
+        for stage in ("auth", "serialize", "render"):
+            self.assertIn(f'http_request_stage_seconds_count{{endpoint="/notes",method="GET",stage="{stage}"}}', text)
+        self.assertIn("auth_cache_misses_total", text)
+
+    def test_metrics_multiple_workers(self):
+        """
+        Снимки метрик нескольких воркеров суммируются
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            self.app.config["METRICS_DIR"] = directory
+            try:
+                worker = metrics.Registry()
+                worker.inc("http_requests_total", {"endpoint": "/tags", "method": "GET", "status": 200}, 5)
+                with open(os.path.join(directory, "1.json"), "w") as f:
+                    json.dump(worker.snapshot(), f)
+                metrics.registry.inc("http_requests_total", {"endpoint": "/tags", "method": "GET", "status": 200}, 2)
+                before = metrics.merge([metrics.registry.snapshot()])[0]
+                text = self.client.get('/metrics').data.decode()
+            finally:
+                self.app.config["METRICS_DIR"] = None
+        key = ("http_requests_total", (("endpoint", "/tags"), ("method", "GET"), ("status", 200)))
+        self.assertIn(f'http_requests_total{{endpoint="/tags",method="GET",status="200"}} {before[key] + 5:g}', text)
+
+    def test_seed_command(self):
+        # Имя, которое seed выбрал бы для следующего id, уже занято
+        UserModel(username="user3", password="user3").save()
+        result = self.app.test_cli_runner().invoke(args=["seed", "--users", "0"])
+        self.assertNotEqual(result.exit_code, 0)
+        result = self.app.test_cli_runner().invoke(args=["seed", "--users", "3", "--notes", "50", "--tags", "5",
+                                                         "--public-ratio", "0.5"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        with self.app.app_context():
+            self.assertEqual(UserModel.query.count(), 5)
+            self.assertEqual([user.username for user in UserModel.query.order_by(UserModel.id)],
+                             ["admin", "user3", "user3-2", "user4", "user5"])
+            self.assertEqual(NoteModel.query.count(), 50)
+            self.assertEqual(TagModel.query.count(), 5)
+            self.assertTrue(0 < NoteModel.query.filter_by(private=False).count() < 50)
+        # Новые строки получают следующие id (на PostgreSQL - после сдвига последовательностей)
+        res = self.client.post('/notes', headers=self.headers, data=json.dumps({"text": "After seed"}),
+                               content_type='application/json')
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(json.loads(res.data)["id"], 51)
+
+    def test_import_notes(self):
+        user_id = self.user.id
+        lines = [json.dumps({"text": f"Imported {i}", "private": i != 0}) for i in range(5)]
+        lines[1] = "{not json"
+        lines[3] = json.dumps({"private": True})
+        lines.insert(4, "")
+        body = "\n".join(lines + [json.dumps({"text": "Last milk"})])
+        res = self.client.post('/notes/import?batch_size=2', headers=self.headers, data=body,
+                               content_type='application/x-ndjson')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual((data["imported"], data["failed"]), (4, 2))
+        self.assertEqual([error["line"] for error in data["errors"]], [2, 4])
+        self.assertIn("text", data["errors"][1]["errors"])
+        with self.app.app_context():
+            self.assertEqual(NoteModel.query.filter_by(author_id=user_id).count(), 4)
+            self.assertEqual(NoteModel.query.filter_by(private=False).count(), 1)
+        res = self.client.get('/notes/search?q=milk', headers=self.headers)
+        self.assertEqual([note["text"] for note in json.loads(res.data)["items"]], ["Last milk"])
+
+        for batch_size in (0, -1, Config.IMPORT_BATCH_SIZE + 1):
+            res = self.client.post(f'/notes/import?batch_size={batch_size}', headers=self.headers, data=body,
+                                   content_type='application/x-ndjson')
+            self.assertEqual(res.status_code, 400)
+        with self.app.app_context():
+            self.assertEqual(NoteModel.query.filter_by(author_id=user_id).count(), 4)
+
+        # Лимиты импорта берутся из конфига приложения, а не из Config
+        self.app.config["IMPORT_MAX_ERRORS"] = 1
+        try:
+            res = self.client.post('/notes/import', headers=self.headers, data=body,
+                                   content_type='application/x-ndjson')
+        finally:
+            self.app.config["IMPORT_MAX_ERRORS"] = Config.IMPORT_MAX_ERRORS
+        data = json.loads(res.data)
+        self.assertEqual((data["failed"], len(data["errors"])), (2, 1))
+
+    def test_import_notes_command(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".ndjson", delete=False) as source:
+            source.write("\n".join(json.dumps({"text": f"Note {i}"}) for i in range(30)))
+        try:
+            result = self.app.test_cli_runner().invoke(args=["import-notes", source.name, "--author",
+                                                             self.user.username, "--batch-size", "7"])
+        finally:
+            os.remove(source.name)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Imported 30 notes", result.output)
+
+    def test_export_notes(self):
+        alex = UserModel(username="alex", password="alex")
+        alex.save()
+        python = TagModel(name="python")
+        python.save()
+        notes = [
+            NoteModel(author_id=self.user.id, text="First, \"quoted\""),
+            NoteModel(author_id=alex.id, text="Alex private"),
+            NoteModel(author_id=alex.id, text="Alex public", private=False),
+            NoteModel(author_id=self.user.id, text="Tagged"),
+        ]
+        for note in notes:
+            note.save()
+        ids = [note.id for note in notes]
+        NoteModel.attach_tags([ids[3]], [python.id])
+        db.session.commit()
+
+        res = self.client.get('/notes/export', headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "application/x-ndjson")
+        rows = [json.loads(line) for line in res.data.decode().splitlines()]
+        self.assertEqual([row["id"] for row in rows], [ids[0], ids[2], ids[3]])
+        self.assertEqual(rows[2]["tags"], ["python"])
+        self.assertEqual(rows[1]["author"], "alex")
+
+        res = self.client.get(f'/notes/export?format=csv&since={ids[0]}&tag=python', headers=self.headers)
+        self.assertEqual(res.mimetype, "text/csv")
+        rows = list(csv.DictReader(io.StringIO(res.data.decode())))
+        self.assertEqual([(row["id"], row["tags"]) for row in rows], [(str(ids[3]), "python")])
+
+    def test_read_replica_routing(self):
+        """
+        GET читает с реплики, запись идет в основную БД, а только что писавший клиент читает с основной
+        """
+        replica_path = os.path.join(tempfile.mkdtemp(), "replica.db")
+        self.app.config["SQLALCHEMY_BINDS"] = {"replica0": "sqlite:///" + replica_path}
+        try:
+            replica = db.get_engine(self.app, bind="replica0")
+            db.metadata.create_all(replica)
+            users = [dict(row) for row in db.session.execute(UserModel.__table__.select())]
+            replica.execute(UserModel.__table__.insert(), users)
+            db.session.remove()
+
+            res = self.client.post('/notes', headers=self.headers, data=json.dumps({"text": "Fresh note"}),
+                                   content_type='application/json')
+            self.assertEqual(res.status_code, 201)
+            # Свою запись клиент видит сразу, хотя на реплику она еще не попала
+            texts = [n["text"] for n in json.loads(self.client.get('/notes', headers=self.headers).data)["items"]]
+            self.assertEqual(texts, ["Fresh note"])
+
+            # Отметка о записи живет в cookie: без нее клиент снова читает с реплики
+            self.client.delete_cookie("localhost", database.STICKY_COOKIE)
+            texts = [n["text"] for n in json.loads(self.client.get('/notes', headers=self.headers).data)["items"]]
+            self.assertEqual(texts, [])
+            replica.execute(NoteModel.__table__.insert(), [dict(row) for row in db.session.execute(
+                NoteModel.__table__.select())])
+            db.session.remove()
+            texts = [n["text"] for n in json.loads(self.client.get('/notes', headers=self.headers).data)["items"]]
+            self.assertEqual(texts, ["Fresh note"])
+        finally:
+            self.app.config["SQLALCHEMY_BINDS"] = {}
+            self.client.delete_cookie("localhost", database.STICKY_COOKIE)
+            db.session.remove()
+            shutil.rmtree(os.path.dirname(replica_path))
+
+    def test_pool_checkout_metric(self):
+        """
+        Ожидание соединения из пула видно в /metrics по каждому bind
+        """
+        self.assertIsInstance(db.engine.pool, database.TimedQueuePool)
+        self.client.get('/notes', headers=self.headers)
+        self.assertIn('db_pool_checkout_seconds_count{bind="primary"}', self.client.get('/metrics').data.decode())
+
+    def test_sqlite_concurrent_writes(self):
+        """
+        В WAL читатели работают, пока идут записи, а пишущие транзакции (чтение, затем запись)
+        не падают с "database is locked"
+        """
+        with db.engine.connect() as connection:
+            self.assertEqual(connection.execute("PRAGMA journal_mode").scalar(), "wal")
+            self.assertEqual(connection.execute("PRAGMA busy_timeout").scalar(), Config.SQLITE_PRAGMAS["busy_timeout"])
+        engine = db.engine.execution_options(write=True)
+        table = NoteModel.__table__
+        user_id = self.user.id
+        db.session.commit()  # иначе сессия теста так и читала бы снимок БД до записей
+        errors, reads = [], []
+        done = threading.Event()
+
+        def write(worker):
+            try:
+                for i in range(20):
+                    with engine.begin() as connection:
+                        count = connection.execute(db.select([db.func.count()]).select_from(table)).scalar()
+                        connection.execute(table.insert(), {"author_id": user_id, "text": f"{worker}-{i}-{count}",
+                                                            "private": True})
+            except Exception as error:
+                errors.append(error)
+
+        def read():
+            while not done.is_set():
+                with db.engine.connect() as connection:
+                    reads.append(connection.execute(db.select([db.func.count()]).select_from(table)).scalar())
+
+        writers = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+        readers = [threading.Thread(target=read) for n in range(2)]
+        for thread in writers + readers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        done.set()
+        for thread in readers:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(NoteModel.query.count(), 80)
+        # Читатели не ждали конца записи: видели промежуточные состояния
+        self.assertTrue(any(0 < count < 80 for count in reads))
+
+    def test_rate_limit(self):
+        """
+        Лишние запросы к ресурсу с одного адреса получают 429 с Retry-After - до проверки пароля и обращений к БД.
+        Предел на адрес общий для всех ресурсов
+        """
+        for _ in range(10):
+            self.assertEqual(self.client.get('/auth/token', headers=self.headers).status_code, 200)
+        with count_queries() as queries:
+            res = self.client.get('/auth/token', headers=self.headers)
+        self.assertEqual(res.status_code, 429)
+        self.assertGreaterEqual(int(res.headers["Retry-After"]), 1)
+        self.assertEqual(queries, [])
+        self.assertIn('rate_limited_total{reason="rate"}', self.client.get('/metrics').data.decode())
+
+        self.app.config["RATE_LIMIT_ADDRESS"] = "3/60"
+        try:
+            statuses = [self.client.get('/notes/public/filter').status_code for _ in range(4)]
+        finally:
+            self.app.config["RATE_LIMIT_ADDRESS"] = Config.RATE_LIMIT_ADDRESS
+        self.assertEqual(statuses, [200, 200, 200, 429])
+        # Нагрузочные прогоны (benchmarks/) выключают все пределы, включая rate_limit ресурсов
+        self.app.config["RATE_LIMIT_ENABLED"] = False
+        try:
+            self.assertEqual(self.client.get('/auth/token', headers=self.headers).status_code, 200)
+        finally:
+            self.app.config["RATE_LIMIT_ENABLED"] = Config.RATE_LIMIT_ENABLED
+
+    def get_from(self, address, path, headers):
+        # Тестовый клиент Flask 1.1 под Werkzeug 2.0 теряет REMOTE_ADDR, поэтому запрос с адреса - через клиент Werkzeug
+        client = WerkzeugClient(self.app, self.app.response_class)
+        return client.get(path, headers=headers, environ_base={'REMOTE_ADDR': address})
+
+    def test_rate_limit_by_verified_user(self):
+        """
+        Неудачные попытки с чужим именем не расходуют корзину пользователя, перебор имен с одного адреса
+        не обходит предел ресурса, а предел на пользователя считается по проверенному id с любых адресов
+        """
+        wrong = {'Authorization': 'Basic ' + b64encode(b"admin:wrong").decode()}
+        for i in range(10):
+            self.assertEqual(self.get_from(f'10.0.0.{i}', '/auth/token', wrong).status_code, 401)
+        self.assertEqual(self.get_from('10.0.1.0', '/auth/token', self.headers).status_code, 200)
+
+        for i in range(10):
+            fake = {'Authorization': 'Basic ' + b64encode(f"user{i}:wrong".encode()).decode()}
+            self.assertEqual(self.get_from('10.0.2.0', '/auth/token', fake).status_code, 401)
+        self.assertEqual(self.get_from('10.0.2.0', '/auth/token', wrong).status_code, 429)
+
+        for i in range(1, 10):
+            self.assertEqual(self.get_from(f'10.0.3.{i}', '/auth/token', self.headers).status_code, 200)
+        res = self.get_from('10.0.4.0', '/auth/token', self.headers)
+        self.assertEqual(res.status_code, 429)
+        self.assertGreaterEqual(int(res.headers["Retry-After"]), 1)
+        self.assertIn('rate_limited_total{reason="user"}', self.client.get('/metrics').data.decode())
+
+    def test_token_bucket_refill(self):
+        backend = rate_limit.MemoryBackend(10)
+        self.assertTrue(backend.take("client", 2, 0.2)[0])
+        self.assertTrue(backend.take("client", 2, 0.2)[0])
+        allowed, tokens, rate = backend.take("client", 2, 0.2)
+        self.assertFalse(allowed)
+        self.assertLessEqual((1 - tokens) / rate, 0.1)
+        time.sleep(0.11)
+        self.assertTrue(backend.take("client", 2, 0.2)[0])
+
+    def test_load_shedding(self):
+        """
+        Сверх MAX_IN_FLIGHT одновременных запросов воркер сразу отвечает 503; /metrics не ограничивается
+        """
+        limiter = rate_limit.limiter
+        limiter.max_in_flight = 1
+        try:
+            self.assertTrue(limiter.acquire())  # запрос, который воркер уже обрабатывает
+            with count_queries() as queries:
+                res = self.client.get('/notes', headers=self.headers)
+            self.assertEqual(res.status_code, 503)
+            self.assertEqual(res.headers["Retry-After"], "1")
+            self.assertEqual(queries, [])
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+            limiter.release()
+            self.assertEqual(self.client.get('/notes', headers=self.headers).status_code, 200)
+            self.assertEqual(limiter.in_flight, 0)
+        finally:
+            limiter.max_in_flight = Config.MAX_IN_FLIGHT
+
+    def test_conditional_get_note(self):
+        """
+        ETag заметки меняется при изменении самой заметки, ее тегов и автора; совпадающий If-None-Match - 304
+        """
+        note = NoteModel(author_id=self.user.id, text="Note")
+        note.save()
+        note_id = note.id
+        tag = TagModel(name="python")
+        tag.save()
+        tag_id = tag.id
+        url = f'/notes/{note_id}'
+
+        res = self.client.get(url, headers=self.headers)
+        etag = res.headers["ETag"]
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("Last-Modified", res.headers)
+        self.assertNotIn("version", json.loads(res.data))
+        with count_queries() as queries:
+            res = self.client.get(url, headers={**self.headers, "If-None-Match": etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b"")
+        self.assertEqual(len(queries), 2)  # авторизация и версия заметки
+
+        etags = {etag}
+        for change in (lambda: NoteModel.query.get(note_id).save(),  # без изменений - та же версия
+                       lambda: self.client.put(url, headers=self.headers, data=json.dumps({"text": "Edited"}),
+                                               content_type='application/json'),
+                       lambda: self.client.put(f'{url}/add_tags', data=json.dumps({"tags": [tag_id]}),
+                                               content_type='application/json'),
+                       lambda: TagModel.query.get(tag_id).__setattr__("name", "flask") or db.session.commit()):
+            with self.app.app_context():
+                change()
+            res = self.client.get(url, headers={**self.headers, "If-None-Match": etag})
+            etag = res.headers["ETag"]
+            etags.add(etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)["tags"][0]["name"], "flask")
+        self.assertEqual(len(etags), 4)
+
+    def test_conditional_get_tags(self):
+        TagModel(name="python").save()
+        res = self.client.get('/tags')
+        last_modified = res.headers["Last-Modified"]
+        res = self.client.get('/tags', headers={"If-Modified-Since": last_modified})
+        self.assertEqual(res.status_code, 304)
+        res = self.client.get('/tags?limit=1', headers={"If-None-Match": res.headers["ETag"]})
+        self.assertEqual(res.status_code, 200)
+        TagModel(name="flask").save()
+        res = self.client.get('/tags', headers={"If-None-Match": res.headers["ETag"]})
+        self.assertEqual(len(json.loads(res.data)["items"]), 2)
+
+    def test_conditional_page_rows_changed(self):
+        """
+        Удаление строки внутри окна страницы меняет ETag, даже если количество, версии и время изменения те же
+        """
+        url = f'/users?limit=2&after={encode_cursor(self.user.id)}'
+        ids = []
+        for username in ("u1", "u2x", "u3", "u4"):
+            user = UserModel(username=username, password="12345")
+            user.save()
+            ids.append(user.id)
+        # Одно время изменения у всех: max(updated_at) и сумма версий окна после удаления не меняются
+        with self.app.app_context():
+            db.session.execute(UserModel.__table__.update().values(updated_at=datetime(2020, 1, 1)))
+            db.session.commit()
+        res = self.client.get(url)
+        etag = res.headers["ETag"]
+        self.assertEqual([user["username"] for user in json.loads(res.data)["items"]], ["u1", "u2x"])
+        with self.app.app_context():
+            db.session.delete(UserModel.query.get(ids[0]))
+            db.session.commit()
+        res = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers["ETag"], etag)
+        self.assertEqual([user["username"] for user in json.loads(res.data)["items"]], ["u2x", "u3"])
+
+    def test_conditional_get_notes(self):
+        """
+        ETag списка заметок зависит от пользователя и строк страницы: у другого пользователя свой список,
+        изменение за пределами страницы ETag не меняет
+        """
+        alex = UserModel(username="alex", password="alex")
+        alex.save()
+        NoteModel(author_id=alex.id, text="Alex private").save()
+        notes = [NoteModel(author_id=self.user.id, text=f"Note {i}") for i in range(3)]
+        for note in notes:
+            note.save()
+        # Страница limit=1 - первая заметка и вторая (по ней видно, есть ли следующая страница)
+        first_id, last_id = notes[0].id, notes[2].id
+        alex_headers = {'Authorization': 'Basic ' + b64encode(b"alex:alex").decode('ascii')}
+
+        res = self.client.get('/notes?limit=1', headers=self.headers)
+        etag = res.headers["ETag"]
+        self.assertIn("Authorization", res.headers["Vary"])
+        res = self.client.get('/notes?limit=1', headers={**alex_headers, "If-None-Match": etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([item["text"] for item in json.loads(res.data)["items"]], ["Alex private"])
+
+        with self.app.app_context():
+            NoteModel.query.get(last_id).text = "Third page"
+            db.session.commit()
+        with count_queries() as queries:
+            res = self.client.get('/notes?limit=1', headers={**self.headers, "If-None-Match": etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(len(queries), 2)  # авторизация и состояние страницы
+        with self.app.app_context():
+            NoteModel.query.get(first_id).text = "First page"
+            db.session.commit()
+        res = self.client.get('/notes?limit=1', headers={**self.headers, "If-None-Match": etag})
+        self.assertEqual(res.status_code, 200)
+
+    def test_public_notes_cache(self):
+        """
+        Кэш списка публичных заметок сбрасывается только при изменениях, влияющих на ответ
+        """
+        alex = UserModel(username="alex", password="alex")
+        alex.save()
+        alex_id, admin_id = alex.id, self.user.id
+        NoteModel(author_id=alex_id, text="Alex public", private=False).save()
+        urls = ['/notes/public/filter?username=alex', '/notes/public/filter?username=admin', '/notes/public/filter']
+
+        def get_all():
+            return [self.client.get(url) for url in urls]
+
+        self.assertEqual([res.headers["X-Cache"] for res in get_all()], ["MISS"] * 3)
+        responses = get_all()
+        self.assertEqual([res.headers["X-Cache"] for res in responses], ["HIT"] * 3)
+        self.assertEqual(len(json.loads(responses[0].data)["items"]), 1)
+        res = self.client.get(urls[0], headers={"If-None-Match": responses[0].headers["ETag"]})
+        self.assertEqual(res.status_code, 304)
+
+        # Личная заметка admin не попадает в публичные списки
+        NoteModel(author_id=admin_id, text="Admin private").save()
+        self.assertEqual([res.headers["X-Cache"] for res in get_all()], ["HIT"] * 3)
+        # Публичная заметка admin: сбрасываются список admin и общий список
+        NoteModel(author_id=admin_id, text="Admin public", private=False).save()
+        self.assertEqual([res.headers["X-Cache"] for res in get_all()], ["HIT", "MISS", "MISS"])
+
+        with self.app.app_context():
+            user = UserModel.query.get(alex_id)
+            user.username = "alexey"
+            user.save()
+        responses = get_all()
+        self.assertEqual([res.headers["X-Cache"] for res in responses], ["MISS", "HIT", "MISS"])
+        self.assertEqual(json.loads(responses[0].data)["items"], [])
+        self.assertEqual(json.loads(responses[2].data)["items"][0]["author"]["username"], "alexey")
+
+        with self.app.app_context():
+            TagModel(name="python").save()
+        self.assertEqual([res.headers["X-Cache"] for res in get_all()], ["HIT"] * 3)
+        self.assertEqual(self.client.get('/tags').headers["X-Cache"], "MISS")
+
+    def test_compiled_dump(self):
+        """
+        Собранный dump дает тот же результат, что и marshmallow
+        """
+        tag = TagModel(name="питон")
+        tag.save()
+        note = NoteModel(author_id=self.user.id, text="Заметка", tags=[tag])
+        note.save()
+        with self.app.test_request_context('/notes'):
+            note = NoteModel.query.get(note.id)
+            compiled = NoteSchema().dump(note)
+            CompiledDumpMixin.compiled = False
+            try:
+                plain = NoteSchema().dump(note)
+            finally:
+                CompiledDumpMixin.compiled = True
+        self.assertEqual(compiled, plain)
+        self.assertEqual(compiled["tags"], [{"id": tag.id, "name": "питон"}])
+        res = self.client.get(f'/notes/{note.id}', headers=self.headers)
+        self.assertIn("Заметка".encode(), res.data)
+
+    def test_compression(self):
+        for i in range(30):
+            NoteModel(author_id=self.user.id, text=f"Public note {i}", private=False).save()
+        gzip_headers = {"Accept-Encoding": "gzip"}
+
+        res = self.client.get('/notes/public/filter', headers=gzip_headers)
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", res.headers["Vary"])
+        self.assertEqual(len(json.loads(gzip.decompress(res.data))["items"]), 20)
+        self.assertTrue(res.headers["ETag"].startswith('W/'))
+        res = self.client.get('/notes/public/filter', headers={**gzip_headers, "If-None-Match": res.headers["ETag"]})
+        self.assertEqual(res.status_code, 304)
+
+        res = self.client.get('/notes/public/filter?username=nobody', headers=gzip_headers)
+        self.assertNotIn("Content-Encoding", res.headers)  # меньше COMPRESS_MIN_SIZE
+        res = self.client.get('/notes/public/filter')
+        self.assertNotIn("Content-Encoding", res.headers)
+
+        res = self.client.get('/notes/export', headers={**self.headers, **gzip_headers})
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertEqual(len(gzip.decompress(res.data).decode().splitlines()), 30)
+
+    def test_download_not_compressed(self):
+        os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", dir=Config.UPLOAD_FOLDER, delete=False) as file:
+            file.write("x" * 5000)
+        try:
+            res = self.client.get(f'/uploads/{os.path.basename(file.name)}', headers={"Accept-Encoding": "gzip"})
+            self.assertEqual(res.status_code, 200)
+            self.assertNotIn("Content-Encoding", res.headers)
+            res.close()
+        finally:
+            os.remove(file.name)
+
+    def test_upload_deduplicated(self):
+        upload_folder = tempfile.mkdtemp()
+        self.app.config["UPLOAD_FOLDER"] = upload_folder
+        try:
+            content = b"\x89PNG fake image" * 100
+            urls = []
+            for filename in ("cat.png", "same-cat.PNG"):
+                res = self.client.put('/upload', data={"image": (io.BytesIO(content), filename)},
+                                      content_type='multipart/form-data')
+                self.assertEqual(res.status_code, 200)
+                urls.append(json.loads(res.data))
+            digest = hashlib.sha256(content).hexdigest()
+            self.assertEqual(urls[0]["url"], f"upload/{digest[:2]}/{digest[2:4]}/{digest}.png")
+            self.assertEqual([data["duplicate"] for data in urls], [False, True])
+            self.assertEqual(urls[1]["url"], urls[0]["url"])
+            with open(os.path.join(upload_folder, digest[:2], digest[2:4], digest + ".png"), "rb") as file:
+                self.assertEqual(file.read(), content)
+
+            self.app.config["MAX_CONTENT_LENGTH"] = 1000
+            res = self.client.put('/upload', data={"image": (io.BytesIO(content), "big.png")},
+                                  content_type='multipart/form-data')
+            self.assertEqual(res.status_code, 413)
+        finally:
+            self.app.config["UPLOAD_FOLDER"] = Config.UPLOAD_FOLDER
+            self.app.config["MAX_CONTENT_LENGTH"] = Config.MAX_CONTENT_LENGTH
+            shutil.rmtree(upload_folder)
+
+    def test_resumable_upload(self):
+        upload_folder = tempfile.mkdtemp()
+        self.app.config["UPLOAD_FOLDER"] = upload_folder
+        try:
+            content = os.urandom(3000)
+            digest = hashlib.sha256(content).hexdigest()
+            upload = {"filename": "video.mp4", "size": len(content), "sha256": digest}
+            res = self.client.post('/upload/sessions', content_type='application/json', data=json.dumps(upload))
+            self.assertEqual(res.status_code, 401)
+            res = self.client.post('/upload/sessions', headers=self.headers, content_type='application/json',
+                                   data=json.dumps(upload))
+            self.assertEqual(res.status_code, 201)
+            url = f'/upload/sessions/{json.loads(res.data)["id"]}'
+
+            res = self.client.patch(url, data=content[:1000], headers={**self.headers, "Upload-Offset": "0"})
+            self.assertEqual(json.loads(res.data)["offset"], 1000)
+            # Повтор уже принятой части (например, после обрыва) - 409 и текущее смещение
+            res = self.client.patch(url, data=content[:1000], headers={**self.headers, "Upload-Offset": "0"})
+            self.assertEqual(res.status_code, 409)
+            self.assertEqual(json.loads(res.data)["offset"], 1000)
+            self.assertEqual(json.loads(self.client.get(url, headers=self.headers).data)["offset"], 1000)
+
+            # Чужую сессию другой пользователь не видит, не дописывает и не отменяет
+            UserModel(username="alex", password="alex").save()
+            alex_headers = {'Authorization': 'Basic ' + b64encode(b"alex:alex").decode('ascii')}
+            self.assertEqual(self.client.get(url, headers=alex_headers).status_code, 404)
+            res = self.client.patch(url, data=content[1000:], headers={**alex_headers, "Upload-Offset": "1000"})
+            self.assertEqual(res.status_code, 404)
+            self.assertEqual(self.client.delete(url, headers=alex_headers).status_code, 404)
+
+            res = self.client.patch(url, data=content[1000:], headers={**self.headers, "Upload-Offset": "1000"})
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 201)
+            self.assertEqual((data["sha256"], data["size"]), (digest, len(content)))
+            self.assertTrue(data["url"].endswith(f"{digest}.mp4"))
+            self.assertEqual(self.client.get(url, headers=self.headers).status_code, 404)
+
+            # Открытых загрузок у пользователя не больше UPLOAD_SESSIONS_PER_USER
+            statuses = [self.client.post('/upload/sessions', headers=self.headers, content_type='application/json',
+                                         data=json.dumps(upload)).status_code
+                        for _ in range(Config.UPLOAD_SESSIONS_PER_USER + 1)]
+            self.assertEqual(statuses, [201] * Config.UPLOAD_SESSIONS_PER_USER + [429])
+            res = self.client.post('/upload/sessions', headers=alex_headers, content_type='application/json',
+                                   data=json.dumps(upload))
+            self.assertEqual(res.status_code, 201)
+        finally:
+            self.app.config["UPLOAD_FOLDER"] = Config.UPLOAD_FOLDER
+            shutil.rmtree(upload_folder)
+
+    def test_upload_session_expiry(self):
+        store = ContentStore(tempfile.mkdtemp())
+        try:
+            session_id = store.create_session("video.mp4", 10)
+            self.assertEqual(store.append(session_id, 0, io.BytesIO(b"12345"))[1:], (5, True))
+            # .json не менялся с создания, но часть дописана недавно - сессия жива
+            old = time.time() - 120
+            os.utime(store._session_path(session_id, ".json"), (old, old))
+            store.expire_sessions(60)
+            self.assertEqual(store.session(session_id)[1], 5)
+
+            os.utime(store._session_path(session_id, ".part"), (old, old))
+            store.expire_sessions(60)
+            self.assertIsNone(store.session(session_id))
+            with self.assertRaises(NotFound):
+                store.append(session_id, 5, io.BytesIO(b"67890"))
+            with self.assertRaises(NotFound):
+                store.complete(session_id)
+        finally:
+            shutil.rmtree(store.root)
+
+    def test_download_upload(self):
+        upload_folder = tempfile.mkdtemp()
+        self.app.config["UPLOAD_FOLDER"] = upload_folder
+        try:
+            content = bytes(range(256)) * 10
+            res = self.client.put('/upload', data={"image": (io.BytesIO(content), "pic.png")},
+                                  content_type='multipart/form-data')
+            url = '/uploads/' + json.loads(res.data)["url"].split("/", 1)[1]
+            digest = hashlib.sha256(content).hexdigest()
+
+            res = self.client.get(url)
+            self.assertEqual(res.data, content)
+            self.assertEqual(res.headers["ETag"], f'"{digest}"')
+            self.assertIn("immutable", res.headers["Cache-Control"])
+            self.assertEqual(res.headers["Accept-Ranges"], "bytes")
+            res.close()
+            res = self.client.get(url, headers={"Range": "bytes=100-199"})
+            self.assertEqual(res.status_code, 206)
+            self.assertEqual(res.data, content[100:200])
+            self.assertEqual(res.headers["Content-Range"], f"bytes 100-199/{len(content)}")
+            res.close()
+            self.assertEqual(self.client.get(url, headers={"If-None-Match": f'"{digest}"'}).status_code, 304)
+
+            self.app.config["UPLOAD_SEND_MODE"] = "x-accel"
+            res = self.client.get(url)
+            self.assertEqual(res.headers["X-Accel-Redirect"], "/protected-uploads/" + url[len('/uploads/'):])
+            self.assertEqual(res.data, b"")
+
+            self.client.post('/upload/sessions', headers=self.headers, content_type='application/json',
+                             data=json.dumps({"filename": "a.bin", "size": 10}))
+            session_file = os.listdir(os.path.join(upload_folder, ".sessions"))[0]
+            self.assertEqual(self.client.get(f'/uploads/.sessions/{session_file}').status_code, 404)
+        finally:
+            self.app.config["UPLOAD_FOLDER"] = Config.UPLOAD_FOLDER
+            self.app.config["UPLOAD_SEND_MODE"] = Config.UPLOAD_SEND_MODE
+            shutil.rmtree(upload_folder)
+
+    def test_search_notes(self):
+        """
+        Полнотекстовый поиск учитывает видимость заметок и архив
+        """
+        alex = UserModel(username="alex", password="alex")
+        alex.save()
+        notes = [
+            NoteModel(author_id=self.user.id, text="Buy milk and bread"),
+            NoteModel(author_id=self.user.id, text="Milk milk milk", private=False),
+            NoteModel(author_id=alex.id, text="Alex private milk"),
+            NoteModel(author_id=alex.id, text="Alex public milkshake", private=False),
+            NoteModel(author_id=self.user.id, text="Archived milk", archive=True),
+            NoteModel(author_id=self.user.id, text="Nothing here"),
+        ]
+        for note in notes:
+            note.save()
+        notes[5].text = "Edited to mention milk"
+        notes[5].save()
+
+        res = self.client.get('/notes/search?q=milk', headers=self.headers)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        texts = [note["text"] for note in data["items"]]
+        self.assertEqual(texts[0], "Milk milk milk")
+        self.assertEqual(sorted(texts), sorted(["Buy milk and bread", "Milk milk milk", "Alex public milkshake",
+                                                "Edited to mention milk"]))
+
+        res = self.client.get('/notes/search?q=milk&limit=3', headers=self.headers)
+        data = json.loads(res.data)
+        self.assertEqual(len(data["items"]), 3)
+        data = json.loads(self.client.get(data["_links"]["next"], headers=self.headers).data)
+        self.assertEqual(len(data["items"]), 1)
+
+        res = self.client.get('/notes/search?q="AND(', headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+
+    def test_archive_scope(self):
+        """
+        Архивные заметки не попадают в выборки, пока их не включили явно, и восстанавливаются
+        """
+        note = NoteModel(author_id=self.user.id, text="Old public note", private=False)
+        note.save()
+        NoteModel(author_id=self.user.id, text="Current note", private=False).save()
+        note_id = note.id
+
+        res = self.client.delete(f'/notes/{note_id}/archive')
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(json.loads(res.data)["archive"])
+
+        texts = [n["text"] for n in json.loads(self.client.get('/notes', headers=self.headers).data)["items"]]
+        self.assertEqual(texts, ["Current note"])
+        texts = [n["text"] for n in json.loads(self.client.get('/notes/public/filter').data)["items"]]
+        self.assertEqual(texts, ["Current note"])
+        self.assertEqual(self.client.get(f'/notes/{note_id}', headers=self.headers).status_code, 404)
+        self.assertEqual(NoteModel.with_archived().count(), 2)
+        # Выгрузка содержит и архивные заметки - с признаком archive
+        res = self.client.get('/notes/export', headers=self.headers)
+        self.assertEqual([json.loads(line)["archive"] for line in res.data.splitlines()], [True, False])
+
+        alex = UserModel(username="alex", password="alex")
+        alex.save()
+        alex_headers = {'Authorization': 'Basic ' + b64encode(b"alex:alex").decode('ascii')}
+        self.assertEqual(self.client.put(f'/notes/{note_id}/restore', headers=alex_headers).status_code, 403)
+        with self.assertQueryBudget(note_resources.NoteRestore, "put"):
+            res = self.client.put(f'/notes/{note_id}/restore', headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(json.loads(res.data)["archive"])
+        texts = [n["text"] for n in json.loads(self.client.get('/notes/public/filter').data)["items"]]
+        self.assertEqual(texts, ["Old public note", "Current note"])
+        self.assertEqual(self.client.put('/notes/100/restore', headers=self.headers).status_code, 404)
+
+    def test_bulk_tags(self):
+        """
+        Массовое добавление/удаление тегов по id и по имени
+        """
+        alex = UserModel(username="alex", password="alex")
+        alex.save()
+        python = TagModel(name="python")
+        python.save()
+        own = []
+        for i in range(3):
+            note = NoteModel(author_id=self.user.id, text=f"Note {i}")
+            note.save()
+            own.append(note.id)
+        alien = NoteModel(author_id=alex.id, text="Alex note")
+        alien.save()
+        alien_id, python_id = alien.id, python.id
+        NoteModel.attach_tags([own[0]], [python_id])
+        db.session.commit()
+
+        body = {"notes": own + [alien_id, 999], "tags": [python_id, "flask", "flask", 12345, ""]}
+        with self.assertQueryBudget(note_resources.NotesTagsResource, "put"):
+            res = self.client.put('/notes/tags', headers=self.headers, data=json.dumps(body),
+                                  content_type='application/json')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["notes"], own)
+        self.assertEqual([tag["name"] for tag in data["tags"]], ["python", "flask"])
+        self.assertEqual(data["changed"], 5)
+        self.assertEqual(sorted(str(item["item"]) for item in data["rejected"]),
+                         sorted(["", "12345", str(alien_id), "999"]))
+        with self.app.app_context():
+            self.assertEqual(TagModel.query.count(), 2)
+            self.assertEqual([tag.name for tag in NoteModel.query.get(own[1]).tags], ["python", "flask"])
+            self.assertEqual(NoteModel.query.get(alien_id).tags, [])
+
+        # Все заметки отвергнуты - неизвестные имена не создаются
+        body = {"notes": [alien_id, 999], "tags": ["django"]}
+        res = self.client.put('/notes/tags', headers=self.headers, data=json.dumps(body),
+                              content_type='application/json')
+        self.assertEqual(json.loads(res.data)["changed"], 0)
+        with self.app.app_context():
+            self.assertEqual(TagModel.query.filter_by(name="django").count(), 0)
+
+        body = {"notes": own, "tags": ["flask"], "action": "detach"}
+        res = self.client.put('/notes/tags', headers=self.headers, data=json.dumps(body),
+                              content_type='application/json')
+        self.assertEqual(json.loads(res.data)["changed"], 3)
+        # Повтор (или параллельный запрос) с теми же связями - не ошибка, новых связей нет
+        with self.app.app_context():
+            self.assertEqual(NoteModel.attach_tags(own, [python_id]), 0)
+            db.session.commit()
+
+    def test_set_tags_unknown(self):
+        note = NoteModel(author_id=self.user.id, text="Note")
+        note.save()
+        res = self.client.put(f'/notes/{note.id}/add_tags', data=json.dumps({"tags": [42]}),
+                              content_type='application/json')
+        self.assertEqual(res.status_code, 400)
+
     def test_edit_note(self):
         """
         Редактирование заметки
@@ -316,3 +1419,154 @@ class TestNotes(TestCase):
             # drop all tables
             db.session.remove()
             db.drop_all()
+        credentials_cache.clear()
+        principals_cache.clear()
+        usernames.invalidate()
+        tag_names.invalidate()
+        response_cache.cache.clear()
+        rate_limit.limiter.clear()
+
+
+# Старт воркера в свежем процессе: импорт приложения и первый запрос
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from app import app
+imported = time.perf_counter()
+from api import db
+with app.app_context():
+    db.create_all()
+client = app.test_client()
+request_start = time.perf_counter()
+status = client.get('/notes/public/filter').status_code
+first_request = time.perf_counter() - request_start
+lazy = {'alembic': 'alembic' in sys.modules, 'apispec': app.extensions['apispec'] is not None}
+swagger = client.get('/swagger')
+print(json.dumps({'import': imported - start, 'first_request': first_request, 'status': status, 'lazy': lazy,
+                  'swagger': swagger.status_code, 'paths': len(swagger.get_json()['paths'])}))
+"""
+
+
+PROXY_SCRIPT = """
+import json
+from werkzeug.test import Client
+from app import app
+from api import db
+with app.app_context():
+    db.create_all()
+client = Client(app, app.response_class)
+statuses = []
+for forwarded in ("203.0.113.1", "203.0.113.1", "203.0.113.1", "203.0.113.2", "198.51.100.7, 203.0.113.2",
+                  "198.51.100.8, 203.0.113.2"):
+    response = client.get('/tags', headers={'X-Forwarded-For': forwarded}, environ_base={'REMOTE_ADDR': '10.0.0.1'})
+    statuses.append(response.status_code)
+print(json.dumps(statuses))
+"""
+
+# Процесс-"воркер" для test_sqlite_writes_from_get: role - setup, reader (GET с Basic-авторизацией, при которой
+# устаревший хэш пароля перезаписывается) или writer (POST /notes без перерыва)
+CONCURRENCY_SCRIPT = """
+import collections, json, sys, time
+from base64 import b64encode
+from werkzeug.test import Client
+from app import app
+from api import db
+from api.models.user import UserModel
+from helpers.passwords import PasswordHasher, context_settings
+role, count, seconds = sys.argv[1], int(sys.argv[2]), float(sys.argv[3])
+client = Client(app, app.response_class)
+
+def headers(username):
+    return {'Authorization': 'Basic ' + b64encode(f"{username}:secret".encode()).decode()}
+
+if role == "setup":
+    old_hasher = PasswordHasher(context_settings(["sha256_crypt"], {"sha256_crypt": 1000}), workers=0)
+    with app.app_context():
+        db.create_all()
+        UserModel("writer", "secret").save()
+        db.session.execute(UserModel.__table__.insert(), [
+            {"username": f"{prefix}{n}", "password_hash": old_hasher.hash("secret")}
+            for prefix in sys.argv[4:] for n in range(count)])
+        db.session.commit()
+    sys.exit()
+statuses = collections.Counter()
+deadline = time.monotonic() + seconds
+n = 0
+while time.monotonic() < deadline and (role == "writer" or n < count):
+    if role == "writer":
+        response = client.post('/notes', headers=headers("writer"), json={"text": f"note {n}"})
+    else:
+        response = client.get('/auth/token', headers=headers(sys.argv[4] + str(n)))
+    statuses[response.status_code] += 1
+    n += 1
+print(json.dumps(statuses))
+"""
+
+
+class TestStartup(TestCase):
+    IMPORT_BUDGET = 1.5  # Секунд на импорт app в воркере
+    FIRST_REQUEST_BUDGET = 0.25  # Секунд на первый запрос
+
+    def test_trusted_proxy_address(self):
+        """
+        С TRUSTED_PROXIES=1 корзина адреса - по клиенту из X-Forwarded-For, а не по адресу nginx;
+        подставленные клиентом звенья левее доверенного не учитываются
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            env = dict(os.environ, DATABASE_URL="sqlite:///" + os.path.join(directory, "proxy.db"),
+                       TRUSTED_PROXIES="1", RATE_LIMIT_ADDRESS="2/60")
+            root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            output = subprocess.run([sys.executable, "-c", PROXY_SCRIPT], cwd=root, env=env, check=True,
+                                    stdout=subprocess.PIPE).stdout
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(json.loads(output.splitlines()[-1]), [200, 200, 429, 200, 200, 429])
+
+    def test_sqlite_writes_from_get(self):
+        """
+        Процессы-воркеры: пока один непрерывно пишет, GET с Basic-авторизацией, перезаписывающий устаревший хэш
+        пароля, не падает с "database is locked" и не ждет окончания записей
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            env = dict(os.environ, DATABASE_URL="sqlite:///" + os.path.join(directory, "concurrency.db"),
+                       RATE_LIMIT_ENABLED="0")
+            root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+            def start(role, *args):
+                return subprocess.Popen([sys.executable, "-c", CONCURRENCY_SCRIPT, role, "5", "4", *args],
+                                        cwd=root, env=env, stdout=subprocess.PIPE)
+
+            self.assertEqual(start("setup", "a", "b").wait(), 0)
+            processes = [start("writer"), start("reader", "a"), start("reader", "b")]
+            writer, *readers = [json.loads(process.communicate()[0].splitlines()[-1]) for process in processes]
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(list(writer), ["201"])
+        self.assertGreater(writer["201"], 0)
+        for reader in readers:
+            # Каждый такой GET хэширует пароль заново (сотни мс на CPU), поэтому их немного - но все успешные
+            self.assertEqual(list(reader), ["200"])
+            self.assertGreater(reader["200"], 0)
+
+    def test_startup_budget(self):
+        """
+        Импорт приложения не строит документ OpenAPI и не загружает alembic, первый запрос укладывается в бюджет
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            env = dict(os.environ, DATABASE_URL="sqlite:///" + os.path.join(directory, "startup.db"))
+            root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], cwd=root, env=env, check=True,
+                                    stdout=subprocess.PIPE).stdout
+        finally:
+            shutil.rmtree(directory)
+        result = json.loads(output.splitlines()[-1])
+        self.assertEqual(result["status"], 200)
+        self.assertEqual(result["lazy"], {"alembic": False, "apispec": False})
+        self.assertLess(result["import"], self.IMPORT_BUDGET)
+        self.assertLess(result["first_request"], self.FIRST_REQUEST_BUDGET)
+        # Документ строится по первому запросу /swagger
+        self.assertEqual(result["swagger"], 200)
+        self.assertGreater(result["paths"], 10)
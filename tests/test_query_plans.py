@@ -0,0 +1,146 @@
+import os
+import re
+from api import db, response_cache
+from app import app
+from unittest import TestCase
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from api.models.user import UserModel, usernames
+from api.models.note import NoteModel
+from api.models.tag import TagModel, tag_names
+from api.resources.note import public_notes
+from helpers.conditional import row_validators, page_validators
+from helpers.pagination import encode_cursor
+from config import Config
+from contextlib import contextmanager
+
+# Планы проверяются на SQLite (по умолчанию) или на PostgreSQL: TEST_DATABASE_URL=postgresql://...
+DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or Config.TEST_DATABASE_URI
+LIMIT = Config.PAGE_SIZE + 1  # paginate() берет на одну запись больше
+
+
+@contextmanager
+def capture_queries():
+    """
+    Собирает SELECT-запросы, выполненные внутри блока, вместе с параметрами - чтобы потом получить их планы
+    """
+    queries = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            queries.append((statement, parameters))
+
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield queries
+    finally:
+        event.remove(Engine, "before_cursor_execute", before_cursor_execute)
+
+
+def explain(statement, parameters):
+    connection = db.session.connection()
+    if connection.dialect.name == "postgresql":
+        # На маленьких таблицах PostgreSQL и так выбрал бы Seq Scan; запрещаем его и сортировку,
+        # чтобы в плане остались только индексы - или Seq Scan/Sort, если подходящего индекса нет
+        connection.execute("SET LOCAL enable_seqscan = off")
+        connection.execute("SET LOCAL enable_sort = off")
+        return [row[0] for row in connection.execute(f"EXPLAIN {statement}", parameters)]
+    return [row[-1] for row in connection.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+
+
+def bad_steps(plan):
+    """
+    Шаги плана со сканированием всей таблицы или с временной сортировкой
+    """
+    tables = "|".join(db.metadata.tables)
+    # Таблицы в запросах ORM бывают с псевдонимами: tags AS tags_1
+    full_scan = re.compile(rf"^\s*SCAN ({tables})(_\d+)?\b|Seq Scan on")
+    sort = re.compile(r"USE TEMP B-TREE|^\s*(->\s*)?Sort\b")
+    return [step for step in plan if full_scan.search(step) or sort.search(step)]
+
+
+class TestQueryPlans(TestCase):
+    def setUp(self):
+        self.app = app
+        self.app.config.update({
+            'SQLALCHEMY_DATABASE_URI': DATABASE_URI
+        })
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+        self.user = UserModel(username="admin", password="admin")
+        self.user.save()
+        alex = UserModel(username="alex", password="alex")
+        alex.save()
+        tags = [TagModel(name=f"tag{i}") for i in range(3)]
+        for tag in tags:
+            tag.save()
+        for i in range(10):
+            note = NoteModel(author_id=(self.user.id, alex.id)[i % 2], text=f"Note {i}",
+                             private=bool(i % 3), archive=(i == 9))
+            note.save()
+            NoteModel.attach_tags([note.id], [tag.id for tag in tags[:i % 4]])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+        usernames.invalidate()
+        tag_names.invalidate()
+        response_cache.cache.clear()
+
+    def hot_queries(self):
+        """
+        Запросы горячих путей API в том виде, в каком их строят ресурсы (вместе с eager-загрузкой тегов и авторов).
+        Выгрузки (/notes/export) здесь нет: она читает все видимые заметки, включая архив, и проход по таблице ей подходит
+        """
+        user = self.user
+        visible = NoteModel.get_all_for_user(user)
+        return {
+            "note": lambda: visible.options(*NoteModel.eager("joined")).filter_by(id=1).all(),
+            "note validators": lambda: row_validators(
+                visible.filter(NoteModel.id == 1).join(NoteModel.author), NoteModel, UserModel),
+            "visible notes": lambda: visible.options(*NoteModel.eager("selectin")).
+                order_by(NoteModel.id).limit(LIMIT).all(),
+            "visible notes, next page": lambda: visible.options(*NoteModel.eager("selectin")).
+                filter(NoteModel.id > 2).order_by(NoteModel.id).limit(LIMIT).all(),
+            "public notes": lambda: public_notes().options(*NoteModel.eager("selectin")).
+                order_by(NoteModel.id).limit(LIMIT).all(),
+            "public notes of author": lambda: public_notes("admin").options(*NoteModel.eager("selectin")).
+                order_by(NoteModel.id).limit(LIMIT).all(),
+            "visible notes validators": lambda: page_validators(
+                visible.join(NoteModel.author), NoteModel.id, NoteModel, UserModel),
+            "visible notes validators, next page": lambda: page_validators(
+                visible.join(NoteModel.author), NoteModel.id, NoteModel, UserModel, after=encode_cursor(2)),
+            "public notes validators": lambda: page_validators(
+                public_notes("admin").join(NoteModel.author), NoteModel.id, NoteModel, UserModel),
+        }
+
+    def test_hot_queries_use_indexes(self):
+        """
+        Ни один запрос горячих путей не сканирует таблицу целиком и не сортирует результат во временном B-дереве
+        """
+        for name, run in self.hot_queries().items():
+            with self.subTest(name):
+                with capture_queries() as queries:
+                    run()
+                self.assertTrue(queries)
+                for statement, parameters in queries:
+                    plan = explain(statement, parameters)
+                    self.assertEqual(bad_steps(plan), [], f"{name}:\n{statement}\n" + "\n".join(plan))
+
+    def test_partial_indexes(self):
+        """
+        Выборки активных заметок идут по частичным индексам (WHERE archive = false), выборки с архивом - нет
+        """
+        def plan(query):
+            with capture_queries() as queries:
+                query.all()
+            return "\n".join(step for statement, parameters in queries for step in explain(statement, parameters))
+
+        self.assertIn("ix_note_model_private_id_active", plan(public_notes()))
+        self.assertIn("ix_note_model_author_id_private_active", plan(public_notes("admin")))
+        self.assertIn("ix_note_model_author_id_private_active", plan(NoteModel.get_all_for_user(self.user)))
+        self.assertNotIn("_active", plan(NoteModel.with_archived().filter_by(private=False)))